@@ -3,18 +3,19 @@ eKYC Face Verification API
 REST API for face verification using ID card and selfie images
 """
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, status, Form, Query
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import cv2
+from starlette.concurrency import run_in_threadpool
 import numpy as np
-from PIL import Image
-import io
 import torch
 from typing import Optional, List
 import logging
 import os
+import asyncio
+import threading
+import time
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -22,9 +23,28 @@ from pymongo import MongoClient
 from bson import ObjectId
 import base64
 
-from face_verification import verify
+from face_verification import FaceNotFound, compare_embeddings, face_embedding
+from utils.distance import findThreshold
+from utils.functions import decode_image
 from facenet.models.mtcnn import MTCNN
 from verification_models import VGGFace2
+from serving.inference_pool import InferencePool, InferencePoolFull
+from serving.embedding_batcher import EmbeddingBatcher
+from serving.detection_batcher import DetectionBatcher, DEFAULT_BUCKETS, detection_buckets, parse_buckets
+from serving.downscaled_detector import DownscaledDetector, downscale
+from serving.detection_profiles import DEFAULT_PROFILES, DetectionLadder
+from serving.roi import RegionHints, parse_roi
+from serving.haar_prefilter import HaarPrefilter
+from serving.preview_detector import PreviewDetector
+from id_documents.card import CardLocalizer, DEFAULT_TEMPLATES, load_templates
+from serving.uploads import BodySizeLimitMiddleware, UploadTooLarge, image_header, read_upload
+from serving.memory_guard import MemoryBudgetExceeded, MemoryGuard
+from serving.embedding_cache import EmbeddingCache
+from serving.enrollments import EnrollmentNotFound, EnrollmentStore
+from identification.gallery import EmbeddingGallery
+from quantization.int8 import QuantizedEmbeddingModel, load_quantized
+from backends.engines import DEFAULT_CACHE_DIR, apply_detector_engine, apply_verifier_engine
+from backends import compiled
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +62,98 @@ security = HTTPBearer()
 ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 
+# Inference pool (model calls run off the event loop)
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "2"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+INFERENCE_RETRY_AFTER = int(os.getenv("INFERENCE_RETRY_AFTER", "1"))
+
+# Inference-optimized VGGFace2 build (BN folding, no classifier head, channels_last)
+VGGFACE2_OPTIMIZE = os.getenv("VGGFACE2_OPTIMIZE", "1") == "1"
+
+# INT8 model variants built with `python -m quantization.calibrate` (CPU only)
+INT8_MODELS_DIR = os.getenv("INT8_MODELS_DIR", "quantization/artifacts")
+USE_INT8_VGGFACE2 = os.getenv("USE_INT8_VGGFACE2", "0") == "1"
+USE_INT8_MTCNN = os.getenv("USE_INT8_MTCNN", "0") == "1"
+
+# Execution engine for the detector / verifier: torch, onnxruntime or opencv
+DETECTOR_ENGINE = os.getenv("DETECTOR_ENGINE", "torch")
+VERIFIER_ENGINE = os.getenv("VERIFIER_ENGINE", "torch")
+ONNX_CACHE_DIR = os.getenv("ONNX_CACHE_DIR", DEFAULT_CACHE_DIR)
+
+# Compiled execution of the eager PyTorch models: eager, torchscript or inductor
+EXECUTION_MODE = os.getenv("EXECUTION_MODE", "eager")
+COMPILED_CACHE_DIR = os.getenv("COMPILED_CACHE_DIR", compiled.DEFAULT_CACHE_DIR)
+WARMUP = os.getenv("WARMUP", "1") == "1"
+
+# Cross-request micro-batching of VGGFace2 embeddings
+EMBEDDING_BATCHING = os.getenv("EMBEDDING_BATCHING", "1") == "1"
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_BATCH_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5"))
+
+# Per-image face/embedding cache for /verify, keyed by a hash of the uploaded bytes
+EMBEDDING_CACHE = os.getenv("EMBEDDING_CACHE", "1") == "1"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "1024"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", "600"))
+
+# 1:N identification over enrolled embeddings (/identify)
+IDENTIFICATION = os.getenv("IDENTIFICATION", "1") == "1"
+IDENTIFICATION_DTYPE = os.getenv("IDENTIFICATION_DTYPE", "float32")
+IDENTIFICATION_METRIC = os.getenv("IDENTIFICATION_METRIC", "euclidean")
+IDENTIFICATION_SHARD_SIZE = int(os.getenv("IDENTIFICATION_SHARD_SIZE", "65536"))
+IDENTIFICATION_WORKERS = int(os.getenv("IDENTIFICATION_WORKERS", "1"))
+IDENTIFICATION_MAX_K = int(os.getenv("IDENTIFICATION_MAX_K", "100"))
+# Enrollments made or deleted through other workers are picked up within this many seconds
+IDENTIFICATION_SYNC_SECONDS = float(os.getenv("IDENTIFICATION_SYNC_SECONDS", "30"))
+
+# Cross-request batched MTCNN detection (images padded into resolution buckets)
+DETECTION_BATCHING = os.getenv("DETECTION_BATCHING", "1") == "1"
+DETECTION_BATCH_SIZE = int(os.getenv("DETECTION_BATCH_SIZE", "16"))
+DETECTION_BATCH_WAIT_MS = float(os.getenv("DETECTION_BATCH_WAIT_MS", "5"))
+
+# Detect on a downscaled copy of large uploads (faces are still cropped at full resolution)
+DETECTION_MAX_SIDE = int(os.getenv("DETECTION_MAX_SIDE", "1024"))
+# The default buckets include canvases for images downscaled to DETECTION_MAX_SIDE
+DETECTION_BUCKETS = (
+    parse_buckets(os.getenv("DETECTION_BUCKETS", "")) or detection_buckets(DEFAULT_BUCKETS, DETECTION_MAX_SIDE)
+)
+# Per-input detection profiles (selfie, ID card): cheap detection first, exhaustive only if no face is found
+DETECTION_PROFILES = os.getenv("DETECTION_PROFILES", "1") == "1"
+# Profiles stop the detection pyramid early once a large, confident face is found
+DETECTION_DOMINANT_FACE = os.getenv("DETECTION_DOMINANT_FACE", "1") == "1"
+# Margin around client region hints, relative to the region's size
+ROI_MARGIN = float(os.getenv("ROI_MARGIN", "0.25"))
+# Locate the card in ID card photos and detect the face in its portrait region only
+ID_CARD_LOCALIZATION = os.getenv("ID_CARD_LOCALIZATION", "1") == "1"
+# JSON file of card templates (default: ID-1 cards and ID-3 passport pages)
+ID_CARD_TEMPLATES = os.getenv("ID_CARD_TEMPLATES", "")
+
+# Haar cascade prefilter in front of /detect-face: skips MTCNN on frames without a face
+HAAR_PREFILTER = os.getenv("HAAR_PREFILTER", "0") == "1"
+# Smallest face the prefilter answers for, relative to the image's shorter side
+HAAR_MIN_FACE = float(os.getenv("HAAR_MIN_FACE", "0.2"))
+# Recall safety margins: cascade resolution (in windows per smallest face), acceptance threshold, audited rejections
+HAAR_RECALL_MARGIN = float(os.getenv("HAAR_RECALL_MARGIN", "1.5"))
+HAAR_MIN_NEIGHBORS = int(os.getenv("HAAR_MIN_NEIGHBORS", "3"))
+HAAR_AUDIT_EVERY = int(os.getenv("HAAR_AUDIT_EVERY", "20"))
+
+# /detect-face?preview=true: small fixed resolution, PNet + RNet only
+PREVIEW_SIDE = int(os.getenv("PREVIEW_SIDE", "160"))
+PREVIEW_MIN_FACE = float(os.getenv("PREVIEW_MIN_FACE", "0.2"))
+PREVIEW_MAX_CANDIDATES = int(os.getenv("PREVIEW_MAX_CANDIDATES", "8"))
+
+# JPEGs are decoded at 1/2, 1/4 or 1/8 resolution while the longer side stays at least this large
+DECODE_MIN_SIDE = int(os.getenv("DECODE_MIN_SIDE", str(DETECTION_MAX_SIDE)))
+
+# Upload limits, enforced while the request is received (before any decode)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_REQUEST_BYTES = int(os.getenv("MAX_REQUEST_BYTES", str(2 * MAX_UPLOAD_BYTES + 1024 * 1024)))
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "40000000"))
+
+# Estimated decode + detection memory allowed per request (0 disables the check)
+REQUEST_MEMORY_BUDGET_MB = int(os.getenv("REQUEST_MEMORY_BUDGET_MB", "512"))
+# What to do with images over the budget: downscale or reject
+MEMORY_BUDGET_POLICY = os.getenv("MEMORY_BUDGET_POLICY", "downscale")
+
 # Initialize FastAPI
 app = FastAPI(
     title="eKYC Face Verification API",
@@ -58,18 +170,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized bodies before they are parsed
+app.add_middleware(BodySizeLimitMiddleware, max_bytes=MAX_REQUEST_BYTES)
+
 # Global models (loaded once at startup)
 device = None
 mtcnn = None
+detection_batcher = None
+detector = None
+detection_ladder = None
+region_hints = None
+card_localizer = None
+haar_prefilter = None
+preview_detector = None
+memory_guard = None
 verification_model = None
+embedding_batcher = None
+embedding_cache = None
 mongodb_client = None
 db = None
+enrollments = None
+gallery = None
+gallery_synced_at = 0.0
+gallery_sync_lock = threading.Lock()
+inference_pool = None
+models_ready = False
+
+
+def load_ml_models():
+    """Load ML models (blocking). Safe to call before forking worker processes."""
+    global device, mtcnn, verification_model
+
+    logger.info("Loading models...")
+
+    # Set device
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    logger.info(f"Using device: {device}")
+
+    # Load MTCNN for face detection
+    mtcnn = MTCNN(device=device)
+    logger.info("MTCNN loaded successfully")
+
+    use_int8 = device.type == "cpu"
+    if (USE_INT8_MTCNN or USE_INT8_VGGFACE2) and not use_int8:
+        logger.warning("INT8 models are CPU only, using FP32 models")
+
+    if USE_INT8_MTCNN and use_int8:
+        try:
+            mtcnn.rnet = load_quantized(os.path.join(INT8_MODELS_DIR, "rnet_int8.pt"))
+            mtcnn.onet = load_quantized(os.path.join(INT8_MODELS_DIR, "onet_int8.pt"))
+            logger.info("MTCNN INT8 RNet/ONet loaded successfully")
+        except Exception as e:
+            logger.error(f"Failed to load INT8 MTCNN nets, using FP32: {e}")
+
+    # Load VGGFace2 model for verification
+    try:
+        if USE_INT8_VGGFACE2 and use_int8:
+            verification_model = QuantizedEmbeddingModel(
+                load_quantized(os.path.join(INT8_MODELS_DIR, "vggface2_int8.pt"))
+            )
+            logger.info("VGGFace2 INT8 model loaded successfully")
+        else:
+            verification_model = VGGFace2.load_model(device=device, inference=VGGFACE2_OPTIMIZE)
+            logger.info("VGGFace2 model loaded successfully")
+    except Exception as e:
+        logger.error(f"Failed to load VGGFace2 model: {e}")
+        logger.warning("Model weights may be missing. API will return errors for verification requests.")
+
+
+def apply_engines():
+    """Swap the FP32 models for the configured inference engines (blocking). Never call before forking."""
+    global verification_model
+
+    # INT8 models take precedence over the engine setting
+    use_int8 = device.type == "cpu"
+    if DETECTOR_ENGINE != "torch" and not (USE_INT8_MTCNN and use_int8):
+        try:
+            apply_detector_engine(mtcnn, DETECTOR_ENGINE, ONNX_CACHE_DIR)
+            logger.info(f"MTCNN running on {DETECTOR_ENGINE}")
+        except Exception as e:
+            logger.error(f"Failed to run MTCNN on {DETECTOR_ENGINE}, using torch: {e}")
+
+    if VERIFIER_ENGINE != "torch" and verification_model is not None and not (USE_INT8_VGGFACE2 and use_int8):
+        try:
+            verification_model = apply_verifier_engine(verification_model, VERIFIER_ENGINE, ONNX_CACHE_DIR)
+            logger.info(f"VGGFace2 running on {VERIFIER_ENGINE}")
+        except Exception as e:
+            logger.error(f"Failed to run VGGFace2 on {VERIFIER_ENGINE}, using torch: {e}")
 
 
 @app.on_event("startup")
 async def load_models():
     """Load ML models and connect to MongoDB on startup"""
-    global device, mtcnn, verification_model, mongodb_client, db
+    global mtcnn, verification_model, detection_batcher, detector, detection_ladder, region_hints, memory_guard
+    global embedding_batcher, embedding_cache, card_localizer, haar_prefilter, preview_detector
+    global mongodb_client, db, enrollments, gallery, inference_pool
 
     # Connect to MongoDB
     mongodb_url = os.getenv("MONGODB_URL", "mongodb://localhost:27017/ekyc")
@@ -81,51 +276,339 @@ async def load_models():
         # Create indexes
         db.verifications.create_index([("timestamp", -1)])
         db.verifications.create_index([("verified", 1)])
+
+        enrollments = EnrollmentStore(db.enrollments)
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
         logger.warning("API will work but verification history will not be saved")
 
-    logger.info("Loading models...")
+    # Models may already have been loaded by a pre-fork master (serving/prefork.py)
+    if mtcnn is None:
+        load_ml_models()
+    else:
+        logger.info("Using models preloaded by the master process")
+
+    # Exporting to ONNX and compiling run the models, which must not happen in a
+    # pre-fork master, so both are done per worker (exports are cached on disk,
+    # compiled graphs are private to the worker).
+    apply_engines()
+
+    if EXECUTION_MODE != "eager":
+        try:
+            compiled.apply_detector_mode(mtcnn, EXECUTION_MODE, COMPILED_CACHE_DIR)
+            if verification_model is not None:
+                verification_model = compiled.apply_verifier_mode(
+                    verification_model, EXECUTION_MODE, COMPILED_CACHE_DIR
+                )
+            logger.info(f"Models running in {EXECUTION_MODE} mode")
+        except Exception as e:
+            logger.error(f"Failed to compile models ({EXECUTION_MODE}), keeping them as loaded: {e}")
+
+    # Threads do not survive fork, so schedulers are always started per worker
+    if DETECTION_BATCHING:
+        detection_batcher = DetectionBatcher(
+            mtcnn,
+            buckets=DETECTION_BUCKETS,
+            max_batch_size=DETECTION_BATCH_SIZE,
+            max_wait_ms=DETECTION_BATCH_WAIT_MS,
+        )
+        logger.info(f"Detection batching enabled: buckets {DETECTION_BUCKETS}")
+
+    detector = detection_batcher or mtcnn
+    if DETECTION_MAX_SIDE > 0:
+        detector = DownscaledDetector(detector, DETECTION_MAX_SIDE)
+        logger.info(f"Detecting faces at up to {DETECTION_MAX_SIDE} px")
+
+    if DETECTION_PROFILES:
+        profiles = DEFAULT_PROFILES
+        if not DETECTION_DOMINANT_FACE:
+            profiles = {name: {**profile, "dominant_face": None} for name, profile in profiles.items()}
+        detection_ladder = DetectionLadder(detection_batcher or mtcnn, profiles, max_side=DETECTION_MAX_SIDE)
+        logger.info(f"Detection profiles enabled: {', '.join(detection_ladder.profiles)}")
+
+    region_hints = RegionHints(margin=ROI_MARGIN)
+    preview_detector = PreviewDetector(
+        mtcnn, side=PREVIEW_SIDE, min_face=PREVIEW_MIN_FACE, max_candidates=PREVIEW_MAX_CANDIDATES
+    )
 
-    # Set device
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    logger.info(f"Using device: {device}")
+    if HAAR_PREFILTER:
+        try:
+            haar_prefilter = HaarPrefilter(
+                detector,
+                min_face=HAAR_MIN_FACE,
+                recall_margin=HAAR_RECALL_MARGIN,
+                min_neighbors=HAAR_MIN_NEIGHBORS,
+                audit_every=HAAR_AUDIT_EVERY,
+            )
+            logger.info("Haar cascade prefilter enabled for /detect-face")
+        except (ImportError, ValueError) as e:
+            logger.error(f"Failed to load the Haar cascade prefilter, detecting without it: {e}")
+
+    if ID_CARD_LOCALIZATION:
+        templates = load_templates(ID_CARD_TEMPLATES) if ID_CARD_TEMPLATES else DEFAULT_TEMPLATES
+        card_localizer = CardLocalizer(templates)
+        logger.info(f"ID card localization enabled: {', '.join(templates)}")
+
+    if REQUEST_MEMORY_BUDGET_MB > 0:
+        memory_guard = MemoryGuard(
+            REQUEST_MEMORY_BUDGET_MB * 1024 * 1024,
+            policy=MEMORY_BUDGET_POLICY,
+            decode_min_side=DECODE_MIN_SIDE,
+            detection_side=DETECTION_MAX_SIDE,
+            min_face_size=mtcnn.min_face_size,
+            factor=mtcnn.factor,
+            buckets=DETECTION_BUCKETS if detection_batcher else None,
+        )
+        logger.info(f"Request memory budget: {REQUEST_MEMORY_BUDGET_MB} MB ({MEMORY_BUDGET_POLICY} over budget)")
 
-    # Load MTCNN for face detection
-    mtcnn = MTCNN(device=device)
-    logger.info("MTCNN loaded successfully")
+    if EMBEDDING_BATCHING and verification_model is not None:
+        embedding_batcher = EmbeddingBatcher(
+            verification_model,
+            max_batch_size=EMBEDDING_BATCH_SIZE,
+            max_wait_ms=EMBEDDING_BATCH_WAIT_MS,
+        )
+        logger.info(f"Embedding batching enabled: up to {EMBEDDING_BATCH_SIZE} faces / {EMBEDDING_BATCH_WAIT_MS} ms")
+
+    if EMBEDDING_CACHE:
+        embedding_cache = EmbeddingCache(max_entries=EMBEDDING_CACHE_SIZE, ttl_seconds=EMBEDDING_CACHE_TTL)
+        logger.info(f"Embedding cache enabled: {EMBEDDING_CACHE_SIZE} images, {EMBEDDING_CACHE_TTL:g}s TTL")
+
+    if IDENTIFICATION and enrollments is not None:
+        try:
+            gallery = EmbeddingGallery(
+                dtype=IDENTIFICATION_DTYPE,
+                metric=IDENTIFICATION_METRIC,
+                shard_size=IDENTIFICATION_SHARD_SIZE,
+                workers=IDENTIFICATION_WORKERS,
+            )
+            logger.info(f"Identification enabled: {IDENTIFICATION_DTYPE} gallery, {IDENTIFICATION_METRIC} distance")
+        except Exception as e:
+            logger.error(f"Failed to create the identification gallery, /identify is disabled: {e}")
+
+    inference_pool = InferencePool(
+        max_workers=INFERENCE_WORKERS,
+        max_queue=INFERENCE_QUEUE_SIZE,
+        retry_after=INFERENCE_RETRY_AFTER,
+    )
+    logger.info(f"Inference pool started: {INFERENCE_WORKERS} workers, queue size {INFERENCE_QUEUE_SIZE}")
+
+    logger.info("All models loaded successfully")
+
+    # /health reports ready once the warm-up has finished
+    asyncio.get_running_loop().run_in_executor(None, warm_up_models)
+
+
+def warm_up_models():
+    """Run representative inputs through the models (blocking), then mark them ready"""
+    global models_ready
+
+    if WARMUP:
+        try:
+            seconds = compiled.warm_up(
+                detector,
+                embedding_batcher or verification_model,
+                image_shapes=DETECTION_BUCKETS if detection_batcher else ((480, 640), (1080, 1440)),
+            )
+            logger.info(f"Models warmed up in {seconds:.1f}s")
+        except Exception as e:
+            logger.error(f"Model warm-up failed: {e}", exc_info=True)
+
+    if gallery is not None:
+        try:
+            sync_gallery(force=True)
+        except Exception as e:
+            logger.error(f"Failed to load the identification gallery: {e}", exc_info=True)
+
+    models_ready = True
+
+
+def sync_gallery(force: bool = False):
+    """Load enrollments added or deleted since the last sync into the gallery (blocking)"""
+    global gallery_synced_at
+
+    with gallery_sync_lock:
+        if not force and time.monotonic() - gallery_synced_at < IDENTIFICATION_SYNC_SECONDS:
+            return
+
+        added, removed = enrollments.sync_gallery(gallery, "VGG-Face2")
+        gallery_synced_at = time.monotonic()
+        if added or removed:
+            logger.info(f"Gallery synced: {added} added, {removed} removed, {len(gallery)} identities")
+
+
+@app.on_event("shutdown")
+async def shutdown_workers():
+    """Stop inference workers on shutdown"""
+    if inference_pool is not None:
+        inference_pool.shutdown(wait=False)
+    if embedding_batcher is not None:
+        embedding_batcher.close()
+    if detection_batcher is not None:
+        detection_batcher.close()
+    if gallery is not None:
+        gallery.close()
+
+
+def load_image_from_upload(file_content: bytes, budget_share: float = 1.0, side_limit: int = None) -> np.ndarray:
+    """
+    Decode an uploaded file to an RGB numpy array, within the per-request memory budget,
+    with its longer side at most `side_limit` if given (JPEGs are decoded at reduced resolution)
+    """
+    header = image_header(file_content)
+    if header is None:
+        raise HTTPException(status_code=400, detail="Invalid image format: cannot identify image file")
+    width, height, image_format = header
+
+    # Checked from the header, before anything is decoded
+    max_side = None
+    decode_side = DECODE_MIN_SIDE
+    if memory_guard is not None:
+        try:
+            max_side, estimate = memory_guard.plan(width, height, image_format, share=budget_share)
+        except MemoryBudgetExceeded as e:
+            logger.warning(f"Rejecting {width}x{height} {image_format} image: {e}")
+            raise HTTPException(status_code=413, detail=f"Image {e}")
+
+        decode_side = memory_guard.decode_side(max_side)
+        logger.info(
+            f"Image {width}x{height} {image_format}: ~{estimate / 2 ** 20:.0f} MB estimated"
+            + (f", downscaling to {max_side} px to fit the memory budget" if max_side else "")
+        )
+
+    if side_limit:
+        max_side = min(max_side, side_limit) if max_side else side_limit
+        decode_side = min(decode_side, side_limit) if decode_side else side_limit
 
-    # Load VGGFace2 model for verification
     try:
-        verification_model = VGGFace2.load_model(device=device)
-        logger.info("VGGFace2 model loaded successfully")
+        # Large JPEGs are decoded at reduced resolution, down to the detection size
+        image = decode_image(file_content, target_side=decode_side)
     except Exception as e:
-        logger.error(f"Failed to load VGGFace2 model: {e}")
-        logger.warning("Model weights may be missing. API will return errors for verification requests.")
+        logger.error(f"Error loading image: {e}")
+        raise HTTPException(status_code=400, detail=f"Invalid image format: {str(e)}")
+
+    if max_side:
+        image, _ = downscale(image, max_side)
+    return image
+
+
+def original_scale(file_content: bytes, image: np.ndarray) -> float:
+    """Factor from the coordinates of a decoded upload (reduced decode, downscaling) to the original image's"""
+    width, height, _ = image_header(file_content)
+    return max(width, height) / max(image.shape[:2])
 
-    logger.info("All models loaded successfully")
+
+async def read_image_upload(upload: UploadFile, label: str) -> bytearray:
+    """Read an uploaded image in chunks, rejecting it as soon as it exceeds the upload limits"""
+    try:
+        return await read_upload(upload, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=f"{label} {e}")
 
 
-def load_image_from_upload(file_content: bytes) -> np.ndarray:
-    """Convert uploaded file to numpy array (OpenCV format)"""
+async def run_inference(func, *args):
+    """Run a blocking inference call on the inference pool"""
     try:
-        # Convert bytes to PIL Image
-        image = Image.open(io.BytesIO(file_content))
+        return await inference_pool.run(func, *args)
+    except InferencePoolFull as e:
+        logger.warning("Inference queue full, rejecting request")
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
 
-        # Convert to RGB if needed
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
 
-        # Convert PIL Image to numpy array
-        image_np = np.array(image)
+def parse_roi_field(spec: Optional[str], label: str):
+    """Parse an optional region hint form field, rejecting malformed ones with 400"""
+    try:
+        return parse_roi(spec)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"{label}: {e}")
 
-        # Convert RGB to BGR (OpenCV format)
-        image_bgr = cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR)
 
-        return image_bgr
+def face_from_upload(content: bytes, profile: str, label: str, roi=None) -> dict:
+    """
+    Decode an upload, then detect and embed its face with a detection profile,
+    in the hinted region if any (else in the card portrait of ID cards), through
+    the embedding cache if enabled (blocking)
+    """
+    face_detector = detection_ladder.profile(profile) if detection_ladder else detector
+    if roi is not None:
+        face_detector = region_hints.detector(face_detector, roi)
+    elif profile == "id_card" and card_localizer is not None:
+        face_detector = card_localizer.detector(face_detector)
+
+    def compute():
+        image = load_image_from_upload(content, budget_share=0.5)
+        logger.info(f"Image loaded: {image.shape}")
+        face = face_embedding(
+            image, face_detector, embedding_batcher or verification_model, model_name="VGG-Face2", require_face=True
+        )
+
+        # Box and landmarks of the original image, not of the decoded one
+        scale = original_scale(content, image)
+        face["box"] = (np.asarray(face["box"]) * scale).tolist()
+        if face["landmarks"] is not None:
+            face["landmarks"] = (np.asarray(face["landmarks"]) * scale).tolist()
+        return face
+
+    try:
+        if embedding_cache is None:
+            return compute()
+        return embedding_cache.get_or_compute(f"{profile}:{roi}:{EmbeddingCache.key(content)}", compute)
+    except FaceNotFound:
+        raise HTTPException(status_code=422, detail=f"No face detected in {label}")
+
+
+def verify_uploads(id_card_content: bytes, selfie_content: bytes, id_card_roi=None, selfie_roi=None) -> dict:
+    """Decode both uploads, then detect, embed and compare their faces (blocking)"""
+    id_face = face_from_upload(id_card_content, "id_card", "ID card image", id_card_roi)
+    selfie_face = face_from_upload(selfie_content, "selfie", "Selfie image", selfie_roi)
+    return compare_embeddings(id_face["embedding"], selfie_face["embedding"], "euclidean", "VGG-Face2")
+
+
+def detect_upload(image_content: bytes, roi=None, preview: bool = False):
+    """Decode an upload and run face detection, in the hinted region if any (blocking)"""
+    if preview:
+        # At preview size MTCNN costs less than the Haar prefilter would
+        img = load_image_from_upload(image_content, side_limit=PREVIEW_SIDE)
+        boxes, probs = region_hints.detect(preview_detector, img, roi)
+    else:
+        img = load_image_from_upload(image_content)
+        boxes, probs = region_hints.detect(haar_prefilter or detector, img, roi)
+
+    # Boxes of the original image, not of the decoded one
+    if boxes is not None:
+        boxes = np.asarray(boxes) * original_scale(image_content, img)
+    return boxes, probs
+
+
+def enroll_upload(id_card_content: bytes) -> dict:
+    """Detect and embed the face of an ID card upload for enrollment (blocking)"""
+    return face_from_upload(id_card_content, "id_card", "ID card image")
+
+
+def verify_enrolled_upload(enrollment: dict, selfie_content: bytes, selfie_roi=None) -> dict:
+    """Embed a selfie upload and compare it with an enrolled ID card embedding (blocking)"""
+    selfie_face = face_from_upload(selfie_content, "selfie", "Selfie image", selfie_roi)
+    return compare_embeddings(enrollment["embedding"], selfie_face["embedding"], "euclidean", enrollment["model"])
+
+
+def identify_upload(selfie_content: bytes, k: int) -> dict:
+    """Embed a selfie upload and find the closest enrolled identities (blocking)"""
+    try:
+        sync_gallery()
     except Exception as e:
-        logger.error(f"Error loading image: {e}")
-        raise HTTPException(status_code=400, detail=f"Invalid image format: {str(e)}")
+        logger.error(f"Gallery sync failed, searching the current gallery: {e}")
+
+    face = face_from_upload(selfie_content, "selfie", "Selfie image")
+
+    threshold = findThreshold(model_name="VGG-Face2", distance_metric=IDENTIFICATION_METRIC)
+    candidates = [
+        {"enrollment_id": enrollment_id, "distance": distance, "match": distance < threshold}
+        for enrollment_id, distance in gallery.search(face["embedding"].numpy(), k)[0]
+    ]
+    return {"candidates": candidates, "threshold": threshold}
 
 
 def image_to_base64(image_bytes: bytes) -> str:
@@ -173,6 +656,9 @@ async def root():
         "status": "running",
         "endpoints": {
             "POST /verify": "Verify face between ID card and selfie",
+            "POST /enroll": "Enroll an ID card face for repeated selfie checks",
+            "POST /verify/{enrollment_id}": "Verify a selfie against an enrolled ID card",
+            "POST /identify": "Find the enrolled ID cards closest to a selfie",
             "GET /health": "Health check",
             "GET /docs": "API documentation (Swagger UI)",
         }
@@ -184,19 +670,36 @@ async def health_check():
     """Health check endpoint"""
     models_loaded = verification_model is not None and mtcnn is not None
 
-    return {
-        "status": "healthy" if models_loaded else "degraded",
+    content = {
+        "status": ("healthy" if models_ready else "warming_up") if models_loaded else "degraded",
+        "ready": models_ready,
         "models_loaded": models_loaded,
+        "execution_mode": EXECUTION_MODE,
         "device": str(device) if device else "not initialized",
         "mtcnn": mtcnn is not None,
-        "verification_model": verification_model is not None
+        "verification_model": verification_model is not None,
+        "inference_pool": inference_pool.stats() if inference_pool else None,
+        "embedding_batcher": embedding_batcher.stats() if embedding_batcher else None,
+        "detection_batcher": detection_batcher.stats() if detection_batcher else None,
+        "memory_guard": memory_guard.stats() if memory_guard else None,
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "detection_ladder": detection_ladder.stats() if detection_ladder else None,
+        "region_hints": region_hints.stats() if region_hints else None,
+        "haar_prefilter": haar_prefilter.stats() if haar_prefilter else None,
+        "card_localizer": card_localizer.stats() if card_localizer else None,
+        "gallery": gallery.stats() if gallery else None
     }
 
+    # Not ready for traffic until the models are warmed up
+    return JSONResponse(content=content, status_code=200 if models_ready else 503)
+
 
 @app.post("/verify")
 async def verify_face(
     id_card: UploadFile = File(..., description="ID card image with face"),
-    selfie: UploadFile = File(..., description="Selfie image for verification")
+    selfie: UploadFile = File(..., description="Selfie image for verification"),
+    id_card_roi: Optional[str] = Form(None, description="Face region hint x1,y1,x2,y2 (0-1) in the ID card"),
+    selfie_roi: Optional[str] = Form(None, description="Face region hint x1,y1,x2,y2 (0-1) in the selfie")
 ):
     """
     Verify if the face in the selfie matches the face in the ID card
@@ -204,6 +707,8 @@ async def verify_face(
     Args:
         id_card: Image file of ID card containing a face
         selfie: Image file of selfie to verify
+        id_card_roi, selfie_roi: Optional regions where the faces are expected,
+            e.g. the capture guides of the client
 
     Returns:
         JSON response with verification result and confidence score
@@ -220,30 +725,14 @@ async def verify_face(
         # Read uploaded files
         logger.info(f"Processing verification request - ID: {id_card.filename}, Selfie: {selfie.filename}")
 
-        id_card_content = await id_card.read()
-        selfie_content = await selfie.read()
-
-        # Validate file sizes
-        if len(id_card_content) > 10 * 1024 * 1024:  # 10MB limit
-            raise HTTPException(status_code=400, detail="ID card image too large (max 10MB)")
+        id_card_region = parse_roi_field(id_card_roi, "ID card region")
+        selfie_region = parse_roi_field(selfie_roi, "Selfie region")
 
-        if len(selfie_content) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="Selfie image too large (max 10MB)")
+        id_card_content = await read_image_upload(id_card, "ID card image")
+        selfie_content = await read_image_upload(selfie, "Selfie image")
 
-        # Load images
-        id_image = load_image_from_upload(id_card_content)
-        selfie_image = load_image_from_upload(selfie_content)
-
-        logger.info(f"Images loaded - ID: {id_image.shape}, Selfie: {selfie_image.shape}")
-
-        # Perform verification
-        result = verify(
-            id_image,
-            selfie_image,
-            mtcnn,
-            verification_model,
-            model_name="VGG-Face2"
-        )
+        # Decode images and perform verification on the inference pool
+        result = await run_inference(verify_uploads, id_card_content, selfie_content, id_card_region, selfie_region)
 
         logger.info(f"Verification result: {result}")
 
@@ -286,15 +775,231 @@ async def verify_face(
         )
 
 
+@app.post("/enroll")
+async def enroll(
+    id_card: UploadFile = File(..., description="ID card image with face")
+):
+    """
+    Enroll the face of an ID card for repeated selfie checks
+
+    The ID card face is detected and embedded once; later checks with
+    POST /verify/{enrollment_id} only need a selfie.
+
+    Args:
+        id_card: Image file of ID card containing a face
+
+    Returns:
+        JSON response with the enrollment ID
+    """
+
+    if verification_model is None or mtcnn is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Models not loaded. Please ensure model weights are available."
+        )
+
+    if enrollments is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Database not available"
+        )
+
+    try:
+        logger.info(f"Processing enrollment request - ID: {id_card.filename}")
+
+        id_card_content = await read_image_upload(id_card, "ID card image")
+        face = await run_inference(enroll_upload, id_card_content)
+
+        # MongoDB calls block, so they run off the event loop
+        enrollment_id = await run_in_threadpool(
+            enrollments.add,
+            face["embedding"],
+            "VGG-Face2",
+            bbox=face["box"],
+            id_card_filename=id_card.filename,
+        )
+        logger.info(f"Enrollment saved: {enrollment_id}")
+
+        if gallery is not None:
+            gallery.add([enrollment_id], face["embedding"].numpy())
+
+        return JSONResponse(content={
+            "enrollment_id": enrollment_id,
+            "bbox": face["box"],
+            "message": "Enrollment completed successfully"
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Enrollment error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Enrollment failed: {str(e)}"
+        )
+
+
+@app.post("/verify/{enrollment_id}")
+async def verify_enrolled_face(
+    enrollment_id: str,
+    selfie: UploadFile = File(..., description="Selfie image for verification"),
+    selfie_roi: Optional[str] = Form(None, description="Face region hint x1,y1,x2,y2 (0-1) in the selfie")
+):
+    """
+    Verify if the face in the selfie matches an enrolled ID card
+
+    Args:
+        enrollment_id: ID returned by POST /enroll
+        selfie: Image file of selfie to verify
+        selfie_roi: Optional region where the face is expected
+
+    Returns:
+        JSON response with verification result and confidence score
+    """
+
+    if verification_model is None or mtcnn is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Models not loaded. Please ensure model weights are available."
+        )
+
+    if enrollments is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Database not available"
+        )
+
+    try:
+        logger.info(f"Processing verification request - Enrollment: {enrollment_id}, Selfie: {selfie.filename}")
+
+        try:
+            enrollment = await run_in_threadpool(enrollments.get, enrollment_id)
+        except EnrollmentNotFound:
+            raise HTTPException(status_code=404, detail="Enrollment not found")
+
+        if enrollment["model"] != "VGG-Face2":
+            raise HTTPException(
+                status_code=409,
+                detail=f"Enrollment was made with {enrollment['model']}, please enroll again"
+            )
+
+        selfie_region = parse_roi_field(selfie_roi, "Selfie region")
+        selfie_content = await read_image_upload(selfie, "Selfie image")
+        result = await run_inference(verify_enrolled_upload, enrollment, selfie_content, selfie_region)
+
+        logger.info(f"Verification result: {result}")
+
+        response = {
+            "verified": bool(result.get("verified", False)),
+            "confidence": float(result.get("distance", 0.0)),
+            "threshold": float(result.get("threshold", 0.4)),
+            "match": result.get("verified", False),
+            "enrollment_id": enrollment_id,
+            "message": "Face verification completed successfully"
+        }
+
+        # Save to MongoDB (the ID card image is not kept with enrollments)
+        if db is not None:
+            try:
+                verification_doc = {
+                    "timestamp": datetime.utcnow(),
+                    "verified": response["verified"],
+                    "confidence": response["confidence"],
+                    "threshold": response["threshold"],
+                    "enrollment_id": enrollment_id,
+                    "id_card_filename": enrollment.get("id_card_filename"),
+                    "selfie_filename": selfie.filename,
+                    "selfie_image": image_to_base64(selfie_content),
+                }
+                await run_in_threadpool(db.verifications.insert_one, verification_doc)
+                logger.info(f"Verification saved to database")
+            except Exception as e:
+                logger.error(f"Failed to save verification to database: {e}")
+
+        return JSONResponse(content=response)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Verification error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Verification failed: {str(e)}"
+        )
+
+
+@app.post("/identify")
+async def identify(
+    selfie: UploadFile = File(..., description="Selfie image to identify"),
+    k: int = Query(5, ge=1, le=IDENTIFICATION_MAX_K, description="Number of candidates to return")
+):
+    """
+    Find the enrolled ID cards whose faces are closest to the selfie (1:N)
+
+    Args:
+        selfie: Image file of selfie to identify
+        k: Number of candidates to return
+
+    Returns:
+        JSON response with the closest enrollments, closest first
+    """
+
+    if verification_model is None or mtcnn is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Models not loaded. Please ensure model weights are available."
+        )
+
+    if gallery is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Identification not available"
+        )
+
+    try:
+        logger.info(f"Processing identification request - Selfie: {selfie.filename}, k={k}")
+
+        selfie_content = await read_image_upload(selfie, "Selfie image")
+        result = await run_inference(identify_upload, selfie_content, k)
+
+        candidates = result["candidates"]
+        identified = bool(candidates) and candidates[0]["match"]
+        logger.info(f"Identification result: {candidates[:1]}")
+
+        return JSONResponse(content={
+            "identified": identified,
+            "enrollment_id": candidates[0]["enrollment_id"] if identified else None,
+            "candidates": candidates,
+            "threshold": float(result["threshold"]),
+            "metric": IDENTIFICATION_METRIC,
+            "gallery_size": len(gallery),
+            "message": "Identification completed successfully"
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Identification error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Identification failed: {str(e)}"
+        )
+
+
 @app.post("/detect-face")
 async def detect_face(
-    image: UploadFile = File(..., description="Image to detect face in")
+    image: UploadFile = File(..., description="Image to detect face in"),
+    roi: Optional[str] = Form(None, description="Face region hint x1,y1,x2,y2 (0-1)"),
+    preview: bool = Query(False, description="Fast, coarser detection of large faces for capture previews")
 ):
     """
     Detect face in an image
 
     Args:
         image: Image file to detect face in
+        roi: Optional region where the face is expected; the whole image is
+            searched if no face is found there
+        preview: Detect at a small fixed resolution without the last MTCNN stage
 
     Returns:
         JSON response with face detection result
@@ -307,15 +1012,10 @@ async def detect_face(
         )
 
     try:
-        # Read and load image
-        image_content = await image.read()
-        img = load_image_from_upload(image_content)
-
-        # Convert to RGB for MTCNN
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        # Detect face
-        boxes, probs = mtcnn.detect(img_rgb)
+        # Read image, then decode and detect on the inference pool
+        region = parse_roi_field(roi, "Region")
+        image_content = await read_image_upload(image, "Image")
+        boxes, probs = await run_inference(detect_upload, image_content, region, preview)
 
         if boxes is not None and len(boxes) > 0:
             faces = []
@@ -337,6 +1037,8 @@ async def detect_face(
                 "message": "No faces detected"
             })
 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Face detection error: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -524,6 +1226,49 @@ async def delete_verification(
         )
 
 
+
+@app.delete("/admin/enrollments/{enrollment_id}")
+async def delete_enrollment(
+    enrollment_id: str,
+    username: str = Depends(verify_token)
+):
+    """
+    Delete an enrollment and its stored embedding (admin only)
+
+    Args:
+        enrollment_id: ID of enrollment to delete
+        username: Verified admin username from token
+
+    Returns:
+        Success message
+    """
+    if enrollments is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Database not available"
+        )
+
+    try:
+        if not await run_in_threadpool(enrollments.delete, enrollment_id):
+            raise HTTPException(
+                status_code=404,
+                detail="Enrollment not found"
+            )
+
+        if gallery is not None:
+            gallery.remove([enrollment_id])
+
+        return {"message": "Enrollment deleted successfully"}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to delete enrollment: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to delete enrollment: {str(e)}"
+        )
+
 if __name__ == "__main__":
     import uvicorn
 
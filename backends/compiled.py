@@ -0,0 +1,202 @@
+"""
+Compiled execution modes for the eager PyTorch models (MTCNN nets and VGGFace2).
+
+Modes:
+    eager        plain PyTorch (default)
+    torchscript  traced, frozen and optimized with torch.jit.optimize_for_inference
+    inductor     torch.compile with the inductor CPU/GPU backend
+
+Frozen TorchScript graphs are cached on disk by a hash of the model weights, and
+inductor's compiled kernels go to its on-disk FX graph cache, so restarts skip most
+of the compilation work. Compilation is lazy (inductor) or input-shape specialized
+(both modes), so `warm_up()` should run representative inputs through the models
+before serving traffic.
+
+Models that were already replaced by an INT8 artifact or an ONNX engine are left
+as they are.
+"""
+
+import contextlib
+import logging
+import os
+import time
+
+import torch
+from torch import nn
+
+from backends.engines import MODEL_SPECS, weights_digest
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODES = ("eager", "torchscript", "inductor")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "compiled_cache")
+
+WARMUP_IMAGE = os.path.join(os.path.dirname(__file__), "../facenet/data/multiface.jpg")
+
+
+class CompiledModel(nn.Module):
+    """
+    Run a compiled model under torch.inference_mode, keeping the `device()`
+    interface of InceptionResnetV1.
+
+    `channels_last` converts inputs the way the optimized VGGFace2 build does in
+    its own forward(), which is bypassed by the compiled graph. `context` is entered
+    around every call (torch.compile settings are thread local in recent releases,
+    and calls come from the inference pool and batcher threads).
+    """
+
+    def __init__(self, model, device: torch.device, channels_last: bool = False, context=None):
+        super().__init__()
+        self.model = model
+        self._device = device
+        self.channels_last = channels_last
+        self.context = context or contextlib.nullcontext
+
+    def device(self):
+        return self._device
+
+    def forward(self, x):
+        with torch.inference_mode(), self.context():
+            if self.channels_last:
+                x = x.contiguous(memory_format=torch.channels_last)
+            return self.model(x)
+
+
+def is_eager(model) -> bool:
+    """True for eager nn.Modules with weights (not INT8 TorchScript or ONNX engine wrappers)."""
+    return (
+        isinstance(model, nn.Module)
+        and not isinstance(model, (torch.jit.ScriptModule, CompiledModel))
+        and next(model.parameters(), None) is not None
+    )
+
+
+def model_device(model: nn.Module) -> torch.device:
+    return next(model.parameters()).device
+
+
+def torchscript_model(model: nn.Module, name: str, cache_dir: str = DEFAULT_CACHE_DIR) -> torch.jit.ScriptModule:
+    """
+    Trace and freeze a model, or load the frozen graph cached for the same weights,
+    then apply torch.jit.optimize_for_inference.
+
+    Optimized graphs cannot be serialized, so the frozen graph is what gets cached.
+    """
+    device = model_device(model)
+    path = os.path.join(cache_dir, f"{name}-{weights_digest(model)}.pt")
+
+    if os.path.exists(path):
+        frozen = torch.jit.load(path, map_location=device)
+        logger.info(f"Loaded cached TorchScript {name} from {path}")
+    else:
+        example = torch.rand(MODEL_SPECS[name][0], device=device)
+        with torch.no_grad():
+            frozen = torch.jit.freeze(torch.jit.trace(model.eval(), example).eval())
+
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = path + ".tmp"
+        torch.jit.save(frozen, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info(f"Traced {name} to {path}")
+
+    return torch.jit.optimize_for_inference(frozen)
+
+
+def recompile_limit(limit: int = 64):
+    """
+    Context raising torch.compile's per-function graph limit.
+
+    PNet still specializes on image size parity (ceil-mode pooling) and conv size
+    thresholds across the pyramid, which needs more than the default 8 graphs.
+    """
+    import torch._dynamo
+
+    name = "recompile_limit" if hasattr(torch._dynamo.config, "recompile_limit") else "cache_size_limit"
+    return torch._dynamo.config.patch(**{name: limit})
+
+
+def inductor_model(model: nn.Module, cache_dir: str = DEFAULT_CACHE_DIR):
+    """torch.compile a model with the inductor backend, caching compiled kernels in `cache_dir`."""
+    # Read by inductor whenever it looks up its cache, in any thread. Assigned
+    # rather than defaulted: torch fills it in with a temp folder on first use.
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(os.path.abspath(cache_dir), "inductor")
+
+    # Batch size (and PNet's image size) varies between calls
+    return torch.compile(model, backend="inductor", dynamic=True, options={"fx_graph_cache": True})
+
+
+def compile_model(model: nn.Module, name: str, mode: str = "eager", cache_dir: str = DEFAULT_CACHE_DIR) -> nn.Module:
+    """
+    Return `model` executed in the requested mode.
+
+    Parameters:
+        model (nn.Module): The eager PyTorch model.
+        name (str): One of 'pnet', 'rnet', 'onet', 'vggface2'.
+        mode (str): One of EXECUTION_MODES.
+        cache_dir (str): Where compiled artifacts are cached.
+    """
+    if mode not in EXECUTION_MODES:
+        raise ValueError(f"Unknown execution mode '{mode}', expected one of {EXECUTION_MODES}")
+    if mode == "eager" or not is_eager(model):
+        return model
+
+    device = model_device(model)
+
+    # The optimized VGGFace2 build enters inference_mode and converts its input to
+    # channels_last in forward(); the wrapper does both around the compiled graph.
+    channels_last = getattr(model, "inference_only", False)
+    if channels_last:
+        model.inference_only = False
+
+    if mode == "torchscript":
+        return CompiledModel(torchscript_model(model, name, cache_dir), device, channels_last=channels_last)
+
+    return CompiledModel(inductor_model(model, cache_dir), device, channels_last=channels_last, context=recompile_limit)
+
+
+def apply_detector_mode(mtcnn, mode: str = "eager", cache_dir: str = DEFAULT_CACHE_DIR):
+    """Compile the P/R/O-nets of an MTCNN. Returns the same MTCNN."""
+    for name in ("pnet", "rnet", "onet"):
+        setattr(mtcnn, name, compile_model(getattr(mtcnn, name), name, mode, cache_dir))
+    return mtcnn
+
+
+def apply_verifier_mode(model: nn.Module, mode: str = "eager", cache_dir: str = DEFAULT_CACHE_DIR) -> nn.Module:
+    """Return the VGGFace2 model compiled in the requested mode."""
+    return compile_model(model, "vggface2", mode, cache_dir)
+
+
+def warm_up(detector=None, embedder=None, image_shapes=((480, 640),), batch_sizes=(1, 2)) -> float:
+    """
+    Run representative inputs through the models so that compilation, shape
+    specialization and allocator warm-up happen before real traffic.
+
+    Parameters:
+        detector: MTCNN or DetectionBatcher (anything with `detect(img)`).
+        embedder: VGGFace2 model or EmbeddingBatcher.
+        image_shapes: (height, width) of the images to detect on. A real photo is
+            resized to each shape so that RNet and ONet receive candidates too.
+        batch_sizes: Face batch sizes to embed.
+
+    Returns:
+        float: Seconds spent warming up.
+    """
+    import cv2
+
+    from utils.functions import get_image
+
+    start = time.perf_counter()
+
+    if detector is not None:
+        image = get_image(WARMUP_IMAGE)
+        for height, width in image_shapes:
+            detector.detect(cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA))
+
+    if embedder is not None:
+        device = embedder.device()
+        for batch_size in batch_sizes:
+            with torch.inference_mode():
+                embedder(torch.rand(batch_size, 3, 160, 160, device=device) * 2 - 1)
+
+    return time.perf_counter() - start
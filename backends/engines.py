@@ -0,0 +1,235 @@
+"""
+Pluggable inference engines for the MTCNN nets and the VGGFace2 verifier.
+
+Models are exported to ONNX once (cached by a hash of their weights) and executed
+with one of:
+    torch        eager PyTorch (default, no export)
+    onnxruntime  ONNX Runtime CPU execution provider (optional dependency)
+    opencv       cv2.dnn
+
+Engine wrappers are nn.Modules that take and return torch tensors, so MTCNN.detect()
+and the VGGFace2 forward()/device() interface are unchanged.
+
+Benchmark the engines on this machine:
+    python -m backends.engines
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import torch
+from torch import nn
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("torch", "onnxruntime", "opencv")
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "onnx_cache")
+
+# name: (example input shape, output names, extra dynamic input axes)
+MODEL_SPECS = {
+    "pnet": ((1, 3, 48, 48), ["reg", "prob"], {2: "height", 3: "width"}),
+    "rnet": ((1, 3, 24, 24), ["reg", "prob"], {}),
+    "onet": ((1, 3, 48, 48), ["reg", "landmarks", "prob"], {}),
+    "vggface2": ((1, 3, 160, 160), ["embedding"], {}),
+}
+
+
+def weights_digest(model: nn.Module) -> str:
+    """Short hash of a model's parameters and buffers, used as the export cache key."""
+    digest = hashlib.sha1()
+    for key, value in model.state_dict().items():
+        digest.update(key.encode())
+        digest.update(value.detach().cpu().contiguous().numpy().tobytes())
+    return digest.hexdigest()[:12]
+
+
+def export_onnx(model: nn.Module, name: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """
+    Export a model to ONNX unless an export of the same weights is already cached.
+
+    Returns:
+        str: Path of the ONNX file.
+    """
+    shape, output_names, dynamic_input = MODEL_SPECS[name]
+    path = os.path.join(cache_dir, f"{name}-{weights_digest(model)}.onnx")
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # A CPU copy is exported, leaving the caller's model on its device
+    export_model = copy.deepcopy(model).cpu().eval()
+
+    # The optimized VGGFace2 build runs forward() under inference_mode, which
+    # cannot be traced; export the same (fused) graph without it.
+    if getattr(export_model, "inference_only", False):
+        export_model.inference_only = False
+
+    dynamic_axes = {"input": {0: "batch", **dynamic_input}}
+    dynamic_axes.update({output: {0: "batch"} for output in output_names})
+
+    # Workers starting together may export the same model
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            export_model, (torch.rand(shape),), tmp_path,
+            input_names=["input"], output_names=output_names,
+            dynamic_axes=dynamic_axes, opset_version=13, dynamo=False,
+        )
+    os.replace(tmp_path, path)
+
+    logger.info(f"Exported {name} to {path}")
+    return path
+
+
+class OnnxRuntimeModel(nn.Module):
+    """
+    Run an exported model with ONNX Runtime (CPU).
+
+    The session is created on first use so that it (and its thread pool) belongs to
+    the process that runs it, e.g. a worker forked by serving.prefork.
+    """
+
+    def __init__(self, path: str, output_names: list):
+        super().__init__()
+        try:
+            import onnxruntime  # noqa: F401
+        except ImportError as e:
+            raise ImportError("The onnxruntime engine requires `pip install onnxruntime`") from e
+
+        self.path = path
+        self.output_names = output_names
+        self._session = None
+        self._lock = threading.Lock()
+
+    def device(self):
+        return torch.device("cpu")
+
+    def session(self):
+        with self._lock:
+            if self._session is None:
+                import onnxruntime as ort
+
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = torch.get_num_threads()
+                self._session = ort.InferenceSession(self.path, options, providers=["CPUExecutionProvider"])
+            return self._session
+
+    def forward(self, x):
+        x = np.ascontiguousarray(x.detach().cpu().float().numpy())
+        outputs = self.session().run(self.output_names, {"input": x})
+        outputs = tuple(torch.from_numpy(out) for out in outputs)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+class OpenCVDNNModel(nn.Module):
+    """
+    Run an exported model with cv2.dnn.
+
+    The network is loaded on first use, and calls are serialized because a
+    cv2.dnn.Net is not thread safe.
+    """
+
+    def __init__(self, path: str, output_names: list):
+        super().__init__()
+        self.path = path
+        self.output_names = output_names
+        self._net = None
+        self._lock = threading.Lock()
+
+    def device(self):
+        return torch.device("cpu")
+
+    def forward(self, x):
+        import cv2
+
+        x = np.ascontiguousarray(x.detach().cpu().float().numpy())
+        with self._lock:
+            if self._net is None:
+                self._net = cv2.dnn.readNetFromONNX(self.path)
+            self._net.setInput(x)
+            outputs = self._net.forward(self.output_names)
+        outputs = tuple(torch.from_numpy(np.array(out)) for out in outputs)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+def load_engine(model: nn.Module, name: str, engine: str = "torch", cache_dir: str = DEFAULT_CACHE_DIR) -> nn.Module:
+    """
+    Return `model` executed by the requested engine.
+
+    Parameters:
+        model (nn.Module): The eager PyTorch model.
+        name (str): One of MODEL_SPECS ('pnet', 'rnet', 'onet', 'vggface2').
+        engine (str): One of ENGINES.
+        cache_dir (str): Where ONNX exports are cached.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{engine}', expected one of {ENGINES}")
+    if engine == "torch":
+        return model
+
+    path = export_onnx(model, name, cache_dir)
+    output_names = MODEL_SPECS[name][1]
+    if engine == "onnxruntime":
+        return OnnxRuntimeModel(path, output_names)
+    return OpenCVDNNModel(path, output_names)
+
+
+def apply_detector_engine(mtcnn, engine: str = "torch", cache_dir: str = DEFAULT_CACHE_DIR):
+    """Swap the P/R/O-nets of an MTCNN for the requested engine. Returns the same MTCNN."""
+    for name in ("pnet", "rnet", "onet"):
+        setattr(mtcnn, name, load_engine(getattr(mtcnn, name), name, engine, cache_dir))
+    return mtcnn
+
+
+def apply_verifier_engine(model: nn.Module, engine: str = "torch", cache_dir: str = DEFAULT_CACHE_DIR) -> nn.Module:
+    """Return the VGGFace2 model executed by the requested engine."""
+    return load_engine(model, "vggface2", engine, cache_dir)
+
+
+def benchmark_engines(repeat: int = 5) -> dict:
+    """Time MTCNN detection and VGGFace2 embedding with every available engine."""
+    from facenet.models.mtcnn import MTCNN
+    from utils.functions import get_image
+    from verification_models import VGGFace2
+
+    image = get_image(os.path.join(os.path.dirname(__file__), "../facenet/data/multiface.jpg"))
+    faces = torch.rand(8, 3, 160, 160) * 2 - 1
+
+    try:
+        verifier = VGGFace2.load_model(inference=True)
+    except FileNotFoundError:
+        logger.warning("VGGFace2 weights not found, benchmarking random weights")
+        verifier = VGGFace2.load_model(pretrained=None, inference=True)
+
+    results = {}
+    for engine in ENGINES:
+        try:
+            mtcnn = apply_detector_engine(MTCNN(), engine)
+            model = apply_verifier_engine(verifier, engine)
+        except ImportError as e:
+            logger.warning(f"Skipping {engine}: {e}")
+            continue
+
+        timings = {}
+        for label, run in (("detect", lambda: mtcnn.detect(image)), ("embed_batch8", lambda: model(faces))):
+            run()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                run()
+            timings[label] = (time.perf_counter() - start) / repeat
+        results[engine] = timings
+
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    for engine, timings in benchmark_engines().items():
+        print(engine, ", ".join(f"{k}: {v * 1000:.1f} ms" for k, v in timings.items()))
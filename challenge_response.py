@@ -8,6 +8,8 @@ from facenet.models.mtcnn import MTCNN
 from liveness_detection.blink_detection import *
 from liveness_detection.emotion_prediction import *
 from liveness_detection.face_orientation import *
+from serving.detection_profiles import DetectionLadder
+from serving.haar_prefilter import TURNED_FACE_CASCADES, HaarPrefilter
 from utils.functions import extract_face
 
 
@@ -105,7 +107,13 @@ if __name__ == "__main__":
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    mtcnn = MTCNN()
+    # Webcam frames: a cheap 480 px step first, then the exhaustive detection
+    mtcnn = DetectionLadder(MTCNN()).profile("video_frame")
+    try:
+        # Skip MTCNN on frames without a face, and run it around the face otherwise
+        mtcnn = HaarPrefilter(mtcnn, min_face=0.25, cascades=TURNED_FACE_CASCADES)
+    except ImportError as e:
+        print(e)
     blink_detector = BlinkDetector()
     emotion_predictor = EmotionPredictor()
     face_orientation_detector = FaceOrientationDetector()
@@ -8,25 +8,38 @@ from utils.functions import *
 from verification_models import VGGFace2
 
 
-def face_matching(
-    face1, face2, model: torch.nn.Module, distance_metric_name, model_name, device="cpu"
-):
+class FaceNotFound(Exception):
+    """Raised when no face is detected in an image that requires one."""
+
+
+def embed_faces(faces: list, model: torch.nn.Module, model_name="VGG-Face2") -> torch.Tensor:
     """
-    Perform face matching to verify the similarity of two faces using a given distance metric and model.
+    Embed face crops in one forward pass (or one batcher submission).
 
     Parameters:
-        face1: The first face image for comparison.
-        face2: The second face image for comparison.
-        model (torch.nn.Module): The face recognition model.
-        distance_metric_name: The name of the distance metric to be used ('cosine', 'L1', or 'euclidean').
+        faces (list): RGB face crops (numpy arrays).
+        model (torch.nn.Module): The face recognition model, or an EmbeddingBatcher wrapping it.
         model_name: The name of the face recognition model.
-        device (str, optional): The device on which the model should run (default is 'cpu').
 
     Returns:
-        dict: Dictionary containing verification result, distance, and threshold.
+        torch.Tensor: One embedding per face.
     """
     assert model_name == "VGG-Face2", f"{model_name} is not supported"
 
+    device = model.device()
+    batch = torch.cat([face_transform(face, model_name=model_name, device=device) for face in faces], dim=0)
+
+    with torch.inference_mode():
+        return model(batch)
+
+
+def compare_embeddings(embedding1, embedding2, distance_metric_name, model_name):
+    """
+    Compare two face embeddings with the given distance metric and the model's threshold.
+
+    Returns:
+        dict: Dictionary containing verification result, distance, and threshold.
+    """
     distance_metric = {
         "cosine": Cosine_Distance,
         "L1": L1_Distance,
@@ -35,15 +48,7 @@ def face_matching(
 
     distance_func = distance_metric.get(distance_metric_name, Euclidean_Distance)
 
-    device = model.device()
-
-    face1 = face_transform(face1, model_name=model_name, device=device)
-    face2 = face_transform(face2, model_name=model_name, device=device)
-
-    result1 = model(face1)
-    result2 = model(face2)
-
-    dis = distance_func(result1, result2)
+    dis = distance_func(embedding1, embedding2)
 
     threshold = findThreshold(
         model_name=model_name, distance_metric=distance_metric_name
@@ -58,12 +63,65 @@ def face_matching(
     }
 
 
+def face_matching(
+    face1, face2, model: torch.nn.Module, distance_metric_name, model_name, device="cpu"
+):
+    """
+    Perform face matching to verify the similarity of two faces using a given distance metric and model.
+
+    Parameters:
+        face1: The first face image for comparison.
+        face2: The second face image for comparison.
+        model (torch.nn.Module): The face recognition model, or an EmbeddingBatcher wrapping it.
+        distance_metric_name: The name of the distance metric to be used ('cosine', 'L1', or 'euclidean').
+        model_name: The name of the face recognition model.
+        device (str, optional): The device on which the model should run (default is 'cpu').
+
+    Returns:
+        dict: Dictionary containing verification result, distance, and threshold.
+    """
+    # Embed both faces in one forward pass (or one batcher submission)
+    embeddings = embed_faces([face1, face2], model, model_name)
+
+    return compare_embeddings(embeddings[0:1], embeddings[1:2], distance_metric_name, model_name)
+
+
+def face_embedding(img: np.ndarray, detector_model: MTCNN, verifier_model, model_name="VGG-Face2",
+                   require_face=False) -> dict:
+    """
+    Detect the largest face of an image and embed it.
+
+    Parameters:
+        img (np.ndarray): A numpy RGB image containing a face.
+        detector_model (MTCNN): The face detection model.
+        verifier_model: The face verification model (or an EmbeddingBatcher).
+        model_name (str, optional): The name of the verification model (default is 'VGG-Face2').
+        require_face (bool, optional): Raise FaceNotFound instead of embedding the
+            whole image, as verify() does, when no face is found.
+
+    Returns:
+        dict: "box" and "landmarks" of the face (None if no face was found) and its
+            "embedding" (1 x 512, CPU).
+    """
+    face, box, landmarks = extract_face(img, detector_model, padding=1)
+    if box is None and require_face:
+        raise FaceNotFound("No face detected")
+    embedding = embed_faces([face], verifier_model, model_name)
+
+    return {
+        "box": None if box is None else np.asarray(box).tolist(),
+        "landmarks": None if landmarks is None else np.asarray(landmarks).tolist(),
+        "embedding": embedding.detach().cpu(),
+    }
+
+
 def verify(
     img1: np.ndarray,
     img2: np.ndarray,
     detector_model: MTCNN,
     verifier_model,
     model_name="VGG-Face2",
+    id_card_detector=None,
 ):
     """
     Verify the similarity between two face images.
@@ -74,12 +132,15 @@ def verify(
         detector_model (MTCNN): The face detection model used to locate faces in the images.
         verifier_model: The face verification model used for similarity comparison.
         model_name (str, optional): The name of the verification model (default is 'VGG-Face2').
+        id_card_detector (optional): Detector for img1 when it is an ID card, e.g. an
+            id_documents.card.CardLocalizer detector searching only the card's portrait
+            (default is detector_model).
 
     Returns:
         dict: Dictionary containing verification result, distance, and threshold.
     """
 
-    face1, box1, landmarks = extract_face(img1, detector_model, padding=1)
+    face1, box1, landmarks = extract_face(img1, id_card_detector or detector_model, padding=1)
     face2, box2, landmarks = extract_face(img2, detector_model, padding=1)
 
     result = face_matching(
@@ -269,7 +269,7 @@ class MTCNN(nn.Module):
         else:
             return faces
 
-    def detect(self, img, landmarks=False):
+    def detect(self, img, landmarks=False, min_face_size=None, dominant_face=None, report=None):
         """Detect all faces in PIL image and return bounding boxes and optional facial landmarks.
  
         This method is used by the forward method and is also useful for face detection tasks
@@ -283,6 +283,11 @@ class MTCNN(nn.Module):
         Keyword Arguments:
             landmarks {bool} -- Whether to return facial landmarks in addition to bounding boxes.
                 (default: {False})
+            min_face_size {int} -- Minimum face size for this call, instead of self.min_face_size.
+                (default: {None})
+            dominant_face {float} -- Stop the pyramid early once a face covering this fraction
+                of the image is found (see detect_face). (default: {None})
+            report {dict} -- Receives the pyramid scales and the skipped ones. (default: {None})
         
         Returns:
             tuple(numpy.ndarray, list) -- For N detected faces, a tuple containing an
@@ -311,10 +316,11 @@ class MTCNN(nn.Module):
 
         with torch.no_grad():
             batch_boxes, batch_points = detect_face(
-                img, self.min_face_size,
+                img, min_face_size or self.min_face_size,
                 self.pnet, self.rnet, self.onet,
                 self.thresholds, self.factor,
-                self.device
+                self.device,
+                dominant_face=dominant_face, report=report
             )
 
         boxes, probs, points = [], [], []
@@ -6,6 +6,7 @@ from PIL import Image
 import numpy as np
 import os
 import math
+from functools import lru_cache
 
 # OpenCV is optional, but required if using numpy arrays instead of PIL
 try:
@@ -22,7 +23,25 @@ def fixed_batch_process(im_data, model):
 
     return tuple(torch.cat(v, dim=0) for v in zip(*out))
 
-def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
+def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device, fused_pyramid=True,
+                dominant_face=None, dominant_prob=0.95, report=None, stages=3, max_candidates=None):
+    """
+    MTCNN face detection.
+
+    With `dominant_face` (a fraction of the image area), the pyramid is processed
+    coarse-first: the scales that can detect a face of that size go through all
+    three stages first, and the finer scales are skipped if every image has a face
+    at least that large with an ONet score of at least `dominant_prob`. Smaller
+    faces are then not returned. Otherwise the finer scales are processed too and
+    the result is that of a full detection.
+
+    `report`, if a dict, receives the pyramid "scales" and the "skipped_scales".
+
+    With `stages=2`, detection stops after RNet (`onet` is not used): boxes are
+    RNet's regressed boxes and scores, and landmarks are all zero. `max_candidates`
+    caps the PNet candidates passed to RNet (over the whole batch, highest PNet
+    scores first), which bounds the cost of the later stages.
+    """
     if isinstance(imgs, (np.ndarray, torch.Tensor)):
         if isinstance(imgs,np.ndarray):
             imgs = torch.as_tensor(imgs.copy(), device=device)
@@ -42,52 +61,123 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
 
     
 
-    model_dtype = next(pnet.parameters()).dtype
+    # Engine wrappers (backends.engines) have no parameters and run in float32
+    model_dtype = next(pnet.parameters(), torch.empty(0)).dtype
+    # Stage 2 / 3 crops are taken from the input images (N, H, W, C)
+    imgs_hwc = imgs
     imgs = imgs.permute(0, 3, 1, 2).type(model_dtype)
 
     batch_size = len(imgs)
     h, w = imgs.shape[2:4]
-    m = 12.0 / minsize
-    minl = min(h, w)
-    minl = minl * m
 
     # Create scale pyramid
-    scale_i = m
-    scales = []
-    while minl >= 12:
-        scales.append(scale_i)
-        scale_i = scale_i * factor
-        minl = minl * factor
+    scales = pyramid_scales(h, w, minsize, factor)
+
+    # Summed-area tables for the stage 1 canvases and stage 2 / 3 crops, built on first use per image
+    tables = {}
+
+    passes = [scales]
+    if dominant_face:
+        coarse = dominant_face_scales(h, w, scales, dominant_face, factor)
+        passes = [coarse, scales[:len(scales) - len(coarse)]]
+
+    results = []
+    skipped = []
+    for i, pass_scales in enumerate(passes):
+        if not pass_scales:
+            continue
+        results.append(detect_scales(
+            imgs, imgs_hwc, pass_scales, pnet, rnet, onet, threshold, model_dtype, device, tables, fused_pyramid,
+            stages, max_candidates
+        ))
+
+        if i == 0 and dominant_face:
+            boxes, image_inds, _ = results[0]
+            if has_dominant_face(boxes, image_inds, batch_size, dominant_face * h * w, dominant_prob):
+                skipped = passes[1]
+                break
+
+    if report is not None:
+        report["scales"] = list(scales)
+        report["skipped_scales"] = list(skipped)
+
+    if len(results) == 1:
+        boxes, image_inds, points = results[0]
+    elif results:
+        # Faces found by both passes
+        boxes, image_inds, points = (torch.cat(v, dim=0) for v in zip(*results))
+        pick = batched_nms_auto(boxes[:, :4], boxes[:, 4], image_inds, 0.7, 'Min')
+        boxes, image_inds, points = boxes[pick], image_inds[pick], points[pick]
+    else:
+        boxes = torch.zeros(0, 5, device=device)
+        image_inds = torch.zeros(0, dtype=torch.int64, device=device)
+        points = torch.zeros(0, 5, 2, device=device)
+
+    boxes = boxes.cpu().numpy()
+    points = points.cpu().numpy()
+
+    image_inds = image_inds.cpu()
+
+    batch_boxes = []
+    batch_points = []
+    for b_i in range(batch_size):
+        b_i_inds = np.where(image_inds == b_i)
+        batch_boxes.append(boxes[b_i_inds].copy())
+        batch_points.append(points[b_i_inds].copy())
+
+    batch_boxes, batch_points = np.array(batch_boxes, dtype=object), np.array(batch_points, dtype=object)
+
+    return batch_boxes, batch_points
+
+
+def detect_scales(imgs, imgs_hwc, scales, pnet, rnet, onet, threshold, model_dtype, device, tables,
+                  fused_pyramid=True, stages=3, max_candidates=None):
+    """
+    The three MTCNN stages over the given pyramid scales.
+
+    Arguments:
+        imgs {torch.Tensor} -- Images in (N, C, H, W) layout and the model dtype.
+        imgs_hwc {torch.Tensor} -- The same images in (N, H, W, C) layout, as passed to detect_face.
+        tables {dict} -- Cache of summed-area tables by image index, shared between calls.
+        stages {int} -- 2 to stop after RNet (zero landmarks). (default: {3})
+        max_candidates {int} -- Maximum PNet candidates passed to RNet. (default: {None})
+
+    Returns:
+        tuple -- boxes (K, 5): x1, y1, x2, y2, score, image_inds (K,) and points (K, 5, 2).
+    """
+    h, w = imgs.shape[2:4]
 
     # First stage
-    boxes = []
-    image_inds = []
+    if fused_pyramid:
+        boxes, image_inds = pnet_pyramid(imgs_hwc, scales, pnet, threshold[0], model_dtype, tables)
+    else:
+        boxes = []
+        image_inds = []
 
-    scale_picks = []
+        scale_picks = []
 
-    all_i = 0
-    offset = 0
-    for scale in scales:
-        im_data = imresample(imgs, (int(h * scale + 1), int(w * scale + 1)))
-        im_data = (im_data - 127.5) * 0.0078125
-        reg, probs = pnet(im_data)
-    
-        boxes_scale, image_inds_scale = generateBoundingBox(reg, probs[:, 1], scale, threshold[0])
-        boxes.append(boxes_scale)
-        image_inds.append(image_inds_scale)
+        all_i = 0
+        offset = 0
+        for scale in scales:
+            im_data = imresample(imgs, (int(h * scale + 1), int(w * scale + 1)))
+            im_data = (im_data - 127.5) * 0.0078125
+            reg, probs = pnet(im_data)
 
-        pick = batched_nms(boxes_scale[:, :4], boxes_scale[:, 4], image_inds_scale, 0.5)
-        scale_picks.append(pick + offset)
-        offset += boxes_scale.shape[0]
+            boxes_scale, image_inds_scale = generateBoundingBox(reg, probs[:, 1], scale, threshold[0])
+            boxes.append(boxes_scale)
+            image_inds.append(image_inds_scale)
 
-    boxes = torch.cat(boxes, dim=0)
-    image_inds = torch.cat(image_inds, dim=0)
+            pick = batched_nms(boxes_scale[:, :4], boxes_scale[:, 4], image_inds_scale, 0.5)
+            scale_picks.append(pick + offset)
+            offset += boxes_scale.shape[0]
 
-    scale_picks = torch.cat(scale_picks, dim=0)
+        boxes = torch.cat(boxes, dim=0)
+        image_inds = torch.cat(image_inds, dim=0)
 
-    # NMS within each scale + image
-    boxes, image_inds = boxes[scale_picks], image_inds[scale_picks]
+        scale_picks = torch.cat(scale_picks, dim=0)
 
+        # NMS within each scale + image
+        boxes, image_inds = boxes[scale_picks], image_inds[scale_picks]
 
     # NMS within each image
     pick = batched_nms(boxes[:, :4], boxes[:, 4], image_inds, 0.7)
@@ -101,17 +191,16 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
     qq4 = boxes[:, 3] + boxes[:, 8] * regh
     boxes = torch.stack([qq1, qq2, qq3, qq4, boxes[:, 4]]).permute(1, 0)
     boxes = rerec(boxes)
-    y, ey, x, ex = pad(boxes, w, h)
-    
+
+    if max_candidates is not None and len(boxes) > max_candidates:
+        keep = torch.topk(boxes[:, 4], max_candidates).indices
+        boxes, image_inds = boxes[keep], image_inds[keep]
+
     # Second stage
     if len(boxes) > 0:
-        im_data = []
-        for k in range(len(y)):
-            if ey[k] > (y[k] - 1) and ex[k] > (x[k] - 1):
-                img_k = imgs[image_inds[k], :, (y[k] - 1):ey[k], (x[k] - 1):ex[k]].unsqueeze(0)
-                im_data.append(imresample(img_k, (24, 24)))
-        im_data = torch.cat(im_data, dim=0)
-        im_data = (im_data - 127.5) * 0.0078125
+        im_data, boxes, image_inds = crop_candidates(imgs_hwc, boxes, image_inds, w, h, 24, tables)
+    if len(boxes) > 0:
+        im_data = (im_data.type(model_dtype) - 127.5) * 0.0078125
 
         # This is equivalent to out = rnet(im_data) to avoid GPU out of memory.
         out = fixed_batch_process(im_data, rnet)
@@ -128,19 +217,19 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
         pick = batched_nms(boxes[:, :4], boxes[:, 4], image_inds, 0.7)
         boxes, image_inds, mv = boxes[pick], image_inds[pick], mv[pick]
         boxes = bbreg(boxes, mv)
+        if stages == 2:
+            # The final NMS of the third stage, which merges RNet's overlapping boxes
+            pick = batched_nms_auto(boxes[:, :4], boxes[:, 4], image_inds, 0.7, 'Min')
+            boxes, image_inds = boxes[pick], image_inds[pick]
+            return boxes, image_inds, torch.zeros(len(boxes), 5, 2, device=device)
         boxes = rerec(boxes)
 
     # Third stage
     points = torch.zeros(0, 5, 2, device=device)
     if len(boxes) > 0:
-        y, ey, x, ex = pad(boxes, w, h)
-        im_data = []
-        for k in range(len(y)):
-            if ey[k] > (y[k] - 1) and ex[k] > (x[k] - 1):
-                img_k = imgs[image_inds[k], :, (y[k] - 1):ey[k], (x[k] - 1):ex[k]].unsqueeze(0)
-                im_data.append(imresample(img_k, (48, 48)))
-        im_data = torch.cat(im_data, dim=0)
-        im_data = (im_data - 127.5) * 0.0078125
+        im_data, boxes, image_inds = crop_candidates(imgs_hwc, boxes, image_inds, w, h, 48, tables)
+    if len(boxes) > 0:
+        im_data = (im_data.type(model_dtype) - 127.5) * 0.0078125
         
         # This is equivalent to out = onet(im_data) to avoid GPU out of memory.
         out = fixed_batch_process(im_data, onet)
@@ -165,24 +254,28 @@ def detect_face(imgs, minsize, pnet, rnet, onet, threshold, factor, device):
 
         # NMS within each image using "Min" strategy
         # pick = batched_nms(boxes[:, :4], boxes[:, 4], image_inds, 0.7)
-        pick = batched_nms_numpy(boxes[:, :4], boxes[:, 4], image_inds, 0.7, 'Min')
+        pick = batched_nms_auto(boxes[:, :4], boxes[:, 4], image_inds, 0.7, 'Min')
         boxes, image_inds, points = boxes[pick], image_inds[pick], points[pick]
 
-    boxes = boxes.cpu().numpy()
-    points = points.cpu().numpy()
+    return boxes, image_inds, points
 
-    image_inds = image_inds.cpu()
 
-    batch_boxes = []
-    batch_points = []
-    for b_i in range(batch_size):
-        b_i_inds = np.where(image_inds == b_i)
-        batch_boxes.append(boxes[b_i_inds].copy())
-        batch_points.append(points[b_i_inds].copy())
+def dominant_face_scales(h, w, scales, fraction, factor):
+    """
+    The coarse end of `scales` (largest first) that can detect a face covering
+    `fraction` of an h x w image, with one pyramid step of margin.
+    """
+    face_side = math.sqrt(fraction * h * w)
+    # A PNet window of 12 px at scale s covers a 12 / s px face
+    limit = 12.0 / (face_side * factor)
+    return [scale for scale in scales if scale <= limit]
 
-    batch_boxes, batch_points = np.array(batch_boxes, dtype=object), np.array(batch_points, dtype=object)
 
-    return batch_boxes, batch_points
+def has_dominant_face(boxes, image_inds, batch_size, min_area, min_prob):
+    """Whether every image has a face of at least `min_area` px with a score of at least `min_prob`."""
+    area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    found = image_inds[(area >= min_area) & (boxes[:, 4] >= min_prob)]
+    return len(found.unique()) == batch_size
 
 
 def bbreg(boundingbox, reg):
@@ -218,6 +311,201 @@ def generateBoundingBox(reg, probs, scale, thresh):
     return boundingbox, image_inds
 
 
+def pyramid_scales(h, w, minsize, factor):
+    """Image pyramid scales for detect_face, largest first (faces of `minsize` px map to PNet's 12 px window)."""
+    m = 12.0 / minsize
+    minl = min(h, w)
+    minl = minl * m
+
+    scale_i = m
+    scales = []
+    while minl >= 12:
+        scales.append(scale_i)
+        scale_i = scale_i * factor
+        minl = minl * factor
+    return scales
+
+# Largest canvas the scaled images are packed into. PNet's cost per pixel grows on
+# large inputs on CPU, so big scales get a canvas each and the small ones share.
+MAX_CANVAS_PIXELS = 160000
+
+
+def pnet_output_size(size):
+    """PNet output length for an input length: conv3 -> 2x2 ceil-mode pool -> conv3 -> conv3."""
+    return math.ceil((size - 2) / 2) - 4
+
+
+def pyramid_layout(h, w, scales, max_pixels=MAX_CANVAS_PIXELS):
+    """
+    Pack the scaled images of an (h, w) pyramid into as few canvases as possible.
+
+    Tiles are placed largest first on shelves at even offsets, so PNet's stride 2
+    output grid lines up with every tile, and tile footprints are rounded up to
+    even sizes so that no output window reads into the next tile. A canvas takes
+    tiles until it would exceed `max_pixels`; a larger tile gets one to itself.
+
+    Returns:
+        list: (canvas height, canvas width, tiles) per canvas, tiles being
+            (scale index, y, x, height, width) in input pixels.
+    """
+    even = lambda v: v + v % 2
+    canvases = []
+    shelves = []  # [y, height, used width] of the last canvas
+
+    for i, scale in enumerate(scales):
+        th, tw = int(h * scale + 1), int(w * scale + 1)
+        for shelf in shelves:
+            if shelf[2] + tw <= canvases[-1][1] and th <= shelf[1]:
+                break
+        else:
+            bottom = shelves[-1][0] + shelves[-1][1] if shelves else 0
+            if not shelves or (bottom + even(th)) * canvases[-1][1] > max_pixels:
+                canvases.append([0, even(tw), []])
+                bottom, shelves = 0, []
+            shelf = [bottom, even(th), 0]
+            shelves.append(shelf)
+            canvases[-1][0] = bottom + even(th)
+
+        canvases[-1][2].append((i, shelf[0], shelf[2], th, tw))
+        shelf[2] += even(tw)
+
+    return [(canvas_h, canvas_w, tuple(tiles)) for canvas_h, canvas_w, tiles in canvases]
+
+
+# Peak bytes of PNet activations per input pixel (conv1 + PReLU outputs dominate)
+PNET_BYTES_PER_PIXEL = 128
+# RNet / ONet crops and outputs, model inputs and allocator slack
+DETECTION_OVERHEAD_BYTES = 48 * 1024 * 1024
+
+
+def detection_memory(h, w, minsize=20, factor=0.709, batch_size=1):
+    """
+    Rough peak memory (bytes) detect_face needs for `batch_size` RGB images of h x w.
+
+    Counts the uint8 and float32 copies of the images, their summed-area tables,
+    the PNet canvases of the image pyramid and PNet's activations on the largest
+    canvas. Measured peaks are within about 25% of the estimate.
+    """
+    pixels = h * w
+    table_bytes = 4 if 255 * pixels < 2 ** 31 else 8
+    layout = pyramid_layout(h, w, tuple(pyramid_scales(h, w, minsize, factor)))
+    canvas_pixels = sum(canvas_h * canvas_w for canvas_h, canvas_w, _ in layout)
+    largest_canvas = max((canvas_h * canvas_w for canvas_h, canvas_w, _ in layout), default=0)
+
+    per_image = pixels * 3 * (1 + 4 + table_bytes) + canvas_pixels * 3 * 4 + largest_canvas * PNET_BYTES_PER_PIXEL
+    return batch_size * per_image + DETECTION_OVERHEAD_BYTES
+
+# Plans of the full pyramid and of its dominant-face split, for a few image sizes
+@lru_cache(maxsize=32)
+def pyramid_plan(h, w, scales, max_pixels=MAX_CANVAS_PIXELS):
+    """
+    Layout and decode maps for the canvases of pyramid_layout().
+
+    Returns:
+        tuple: (layout, cell_scale (Q,), cell_x (Q,), cell_y (Q,)) -- the scale index
+            (-1 for padding) and window position in its scaled image of each PNet
+            output cell, over all canvases (row major).
+    """
+    layout = pyramid_layout(h, w, scales, max_pixels)
+    cell_scale, cell_x, cell_y = [], [], []
+
+    for canvas_h, canvas_w, tiles in layout:
+        tile_of = np.full((pnet_output_size(canvas_h), pnet_output_size(canvas_w)), -1, dtype=np.int32)
+        local_x = np.zeros_like(tile_of)
+        local_y = np.zeros_like(tile_of)
+        for i, y, x, th, tw in tiles:
+            oh, ow = pnet_output_size(th), pnet_output_size(tw)
+            tile_of[y // 2:y // 2 + oh, x // 2:x // 2 + ow] = i
+            local_x[y // 2:y // 2 + oh, x // 2:x // 2 + ow] = np.arange(ow)[None, :]
+            local_y[y // 2:y // 2 + oh, x // 2:x // 2 + ow] = np.arange(oh)[:, None]
+
+        cell_scale.append(tile_of.reshape(-1))
+        cell_x.append(local_x.reshape(-1))
+        cell_y.append(local_y.reshape(-1))
+
+    return (
+        layout,
+        torch.from_numpy(np.concatenate(cell_scale)),
+        torch.from_numpy(np.concatenate(cell_x)),
+        torch.from_numpy(np.concatenate(cell_y)),
+    )
+
+
+def pnet_pyramid(imgs, scales, pnet, thresh, dtype=torch.float32, tables=None):
+    """
+    First MTCNN stage over the whole image pyramid in one PNet call per canvas.
+
+    The scaled images are tiled into a few canvases (see pyramid_layout) straight
+    from the summed-area table of each image (the same averages as imresample),
+    PNet runs once per canvas, and candidate windows of all scales are decoded in
+    one pass, followed by NMS within each image + scale.
+
+    Equivalent to running imresample, PNet, generateBoundingBox and NMS scale by
+    scale, except for windows hanging over the right / bottom edge of an odd-sized
+    scaled image, whose padding is read as zeros instead of being skipped by the
+    ceil-mode pooling.
+
+    Arguments:
+        imgs {torch.Tensor} -- Images in (N, H, W, C) layout, as passed to detect_face.
+        scales {list} -- Pyramid scales, largest first.
+        thresh {float} -- PNet score threshold.
+        dtype {torch.dtype} -- PNet input dtype.
+        tables {dict} -- Cache of summed-area tables by image index, shared with later stages.
+
+    Returns:
+        tuple -- boxes (K, 9): x1, y1, x2, y2, score and regression, and image_inds (K,).
+    """
+    device = imgs.device
+    n, h, w, channels = imgs.shape
+    tables = {} if tables is None else tables
+    layout, cell_scale, cell_x, cell_y = pyramid_plan(h, w, tuple(scales))
+    cell_scale, cell_x, cell_y = (v.to(device) for v in (cell_scale, cell_x, cell_y))
+
+    for b_i in range(n):
+        if b_i not in tables:
+            tables[b_i] = integral_image(imgs[b_i])
+
+    zero = torch.zeros(1, dtype=torch.int64, device=device)
+    canvases = []
+    for canvas_h, canvas_w, tiles in layout:
+        canvas = torch.zeros(n, canvas_h, canvas_w, channels, dtype=dtype, device=device)
+        for i, y, x, th, tw in tiles:
+            rows_lo, rows_hi = area_bins(zero, torch.tensor([h], device=device), th)
+            cols_lo, cols_hi = area_bins(zero, torch.tensor([w], device=device), tw)
+            counts = (rows_hi - rows_lo)[0, :, None, None] * (cols_hi - cols_lo)[0, None, :, None]
+            for b_i in range(n):
+                rows = tables[b_i].index_select(0, rows_hi[0]) - tables[b_i].index_select(0, rows_lo[0])
+                sums = rows.index_select(1, cols_hi[0]) - rows.index_select(1, cols_lo[0])
+                canvas[b_i, y:y + th, x:x + tw] = (sums.to(dtype) / counts - 127.5) * 0.0078125
+        # Channels last: PNet runs faster on it than on NCHW here
+        canvases.append(canvas.permute(0, 3, 1, 2))
+
+    reg, probs = [], []
+    for canvas in canvases:
+        reg_c, probs_c = pnet(canvas)
+        reg.append(reg_c.reshape(n, 4, -1))
+        probs.append(probs_c[:, 1].reshape(n, -1))
+    reg = torch.cat(reg, dim=2)
+    probs = torch.cat(probs, dim=1)
+
+    mask = (probs >= thresh) & (cell_scale >= 0)
+    image_inds, cells = mask.nonzero().unbind(1)
+    scale_inds = cell_scale[cells]
+
+    # Window position within its scaled image, as in generateBoundingBox
+    bb = torch.stack([cell_x[cells], cell_y[cells]], dim=1).type(reg.dtype)
+    scale = torch.as_tensor(scales, dtype=reg.dtype, device=device)[scale_inds].unsqueeze(1)
+    q1 = ((2 * bb + 1) / scale).floor()
+    q2 = ((2 * bb + 12) / scale).floor()
+    score = probs[mask]
+    reg = reg.permute(1, 0, 2)[:, mask].permute(1, 0)
+    boxes = torch.cat([q1, q2, score.unsqueeze(1), reg], dim=1)
+
+    # NMS within each scale + image
+    pick = batched_nms(boxes[:, :4], boxes[:, 4], image_inds * len(scales) + scale_inds, 0.5)
+    return boxes[pick], image_inds[pick]
+
+
 def nms_numpy(boxes, scores, threshold, method):
     if boxes.size == 0:
         return np.empty((0, 3))
@@ -230,7 +518,7 @@ def nms_numpy(boxes, scores, threshold, method):
     area = (x2 - x1 + 1) * (y2 - y1 + 1)
 
     I = np.argsort(s)
-    pick = np.zeros_like(s, dtype=np.int16)
+    pick = np.zeros_like(s, dtype=np.int64)
     counter = 0
     while I.size > 0:
         i = I[-1]
@@ -238,13 +526,13 @@ def nms_numpy(boxes, scores, threshold, method):
         counter += 1
         idx = I[0:-1]
 
-        xx1 = np.maximum(x1[i], x1[idx]).copy()
-        yy1 = np.maximum(y1[i], y1[idx]).copy()
-        xx2 = np.minimum(x2[i], x2[idx]).copy()
-        yy2 = np.minimum(y2[i], y2[idx]).copy()
+        xx1 = np.maximum(x1[i], x1[idx])
+        yy1 = np.maximum(y1[i], y1[idx])
+        xx2 = np.minimum(x2[i], x2[idx])
+        yy2 = np.minimum(y2[i], y2[idx])
 
-        w = np.maximum(0.0, xx2 - xx1 + 1).copy()
-        h = np.maximum(0.0, yy2 - yy1 + 1).copy()
+        w = np.maximum(0.0, xx2 - xx1 + 1)
+        h = np.maximum(0.0, yy2 - yy1 + 1)
 
         inter = w * h
         if method == 'Min':
@@ -253,8 +541,7 @@ def nms_numpy(boxes, scores, threshold, method):
             o = inter / (area[i] + area[idx] - inter)
         I = I[np.where(o <= threshold)]
 
-    pick = pick[:counter].copy()
-    return pick
+    return pick[:counter]
 
 
 def batched_nms_numpy(boxes, scores, idxs, threshold, method):
@@ -274,6 +561,96 @@ def batched_nms_numpy(boxes, scores, idxs, threshold, method):
     return torch.as_tensor(keep, dtype=torch.long, device=device)
 
 
+def box_overlap(a, b, method='Union'):
+    """
+    Pairwise overlap (len(a), len(b)) of boxes in inclusive pixel coordinates, as in
+    nms_numpy: 'Union' is IoU, 'Min' is intersection over the smaller area.
+    """
+    area_a = (a[:, 2] - a[:, 0] + 1) * (a[:, 3] - a[:, 1] + 1)
+    area_b = (b[:, 2] - b[:, 0] + 1) * (b[:, 3] - b[:, 1] + 1)
+
+    inter = torch.min(a[:, None, 2], b[None, :, 2]).sub_(torch.max(a[:, None, 0], b[None, :, 0])).add_(1).clamp_(min=0)
+    h = torch.min(a[:, None, 3], b[None, :, 3]).sub_(torch.max(a[:, None, 1], b[None, :, 1])).add_(1).clamp_(min=0)
+    inter.mul_(h)
+
+    if method == 'Min':
+        return inter.div_(torch.min(area_a[:, None], area_b[None, :]))
+    return inter.div_((area_a[:, None] + area_b[None, :]).sub_(inter))
+
+
+def nms_tensor(boxes, scores, threshold, method='Union', block_size=128):
+    """
+    Greedy NMS on the boxes' device, with the same 'Union' / 'Min' overlaps and
+    results as nms_numpy.
+
+    Works like nms_numpy, but `block_size` boxes at a time: the greedy decisions
+    among the highest-scoring remaining boxes are settled by fixed-point iteration
+    (a box is kept if no kept, higher-scoring box in the block overlaps it by more
+    than `threshold`), then the boxes kept from the block suppress all remaining
+    boxes at once. This takes one Python iteration per block instead of one per
+    kept box.
+
+    Returns:
+        torch.Tensor -- int64 indices of the kept boxes, highest score first.
+    """
+    device = boxes.device
+    if boxes.numel() == 0:
+        return torch.empty((0,), dtype=torch.int64, device=device)
+
+    order = torch.sort(scores, descending=True, stable=True)[1]
+    boxes = boxes[order]
+    remaining = torch.arange(len(boxes), device=device)
+    keep = []
+
+    while len(remaining) > 0:
+        candidates, remaining = remaining[:block_size], remaining[block_size:]
+
+        # suppresses[j, i]: candidate j (higher score) suppresses candidate i
+        block = boxes[candidates]
+        suppresses = (box_overlap(block, block, method) > threshold).triu_(diagonal=1)
+        kept = torch.ones(len(candidates), dtype=torch.bool, device=device)
+        while True:
+            new_kept = ~suppresses[kept].any(0)
+            if torch.equal(new_kept, kept):
+                break
+            kept = new_kept
+
+        kept_boxes = block[kept]
+        keep.append(candidates[kept])
+
+        if len(remaining) > 0:
+            suppressed = (box_overlap(kept_boxes, boxes[remaining], method) > threshold).any(0)
+            remaining = remaining[~suppressed]
+
+    return order[torch.cat(keep)]
+
+
+def batched_nms_tensor(boxes, scores, idxs, threshold, method='Union'):
+    """batched_nms_numpy without leaving the boxes' device."""
+    if boxes.numel() == 0:
+        return torch.empty((0,), dtype=torch.int64, device=boxes.device)
+    # Offset boxes per image so that boxes of different images never overlap
+    max_coordinate = boxes.max()
+    offsets = idxs.to(boxes) * (max_coordinate + 1)
+    return nms_tensor(boxes + offsets[:, None], scores, threshold, method)
+
+
+# nms_benchmark on one CPU thread: nms_tensor's 'Union' is 1.5-1.9x faster than nms_numpy
+# from 100 boxes on, its 'Min' 0.3-1.0x as fast (few boxes are kept, so NumPy's loop is short)
+NMS_TENSOR_MIN_BOXES = 100
+
+
+def batched_nms_auto(boxes, scores, idxs, threshold, method='Union'):
+    """
+    batched_nms_tensor or batched_nms_numpy, whichever nms_benchmark measured to
+    be faster for the boxes' device, count and overlap method. Off the CPU, boxes
+    stay on their device.
+    """
+    if boxes.device.type != "cpu" or (method == 'Union' and len(boxes) >= NMS_TENSOR_MIN_BOXES):
+        return batched_nms_tensor(boxes, scores, idxs, threshold, method)
+    return batched_nms_numpy(boxes, scores, idxs, threshold, method)
+
+
 def pad(boxes, w, h):
     boxes = boxes.trunc().int().cpu().numpy()
     x = boxes[:, 0]
@@ -289,6 +666,106 @@ def pad(boxes, w, h):
     return y, ey, x, ex
 
 
+def area_bins(start, length, size):
+    """
+    Pixel ranges [lo, hi) averaged into each of `size` output pixels when `length`
+    input pixels starting at `start` are resized with interpolate(mode="area")
+    (adaptive average pooling bin edges).
+    """
+    i = torch.arange(size + 1, device=start.device)
+    lo = start[:, None] + (i[None, :-1] * length[:, None]) // size
+    hi = start[:, None] + (i[None, 1:] * length[:, None] + size - 1) // size
+    return lo, hi
+
+
+def integral_image(img):
+    """
+    Summed-area table (H+1, W+1, C) of one HWC image.
+
+    uint8 images get an exact int32 table (half the memory traffic of float64);
+    anything else, or images too large for int32 sums, get a float64 table.
+    """
+    h, w, c = img.shape
+    exact_int = img.dtype == torch.uint8 and 255 * h * w < 2 ** 31
+    dtype = torch.int32 if exact_int else torch.float64
+
+    if img.device.type == "cpu" and "cv2" in globals():
+        src = img.numpy() if exact_int else img.double().numpy()
+        table = cv2.integral(np.ascontiguousarray(src), sdepth=cv2.CV_32S if exact_int else cv2.CV_64F)
+        return torch.from_numpy(table.reshape(h + 1, w + 1, c))
+
+    table = torch.zeros(h + 1, w + 1, c, dtype=dtype, device=img.device)
+    table[1:, 1:] = img.to(dtype).cumsum(0, dtype=dtype).cumsum(1, dtype=dtype)
+    return table
+
+
+def crop_resize_boxes(imgs, image_inds, y, ey, x, ex, size, tables=None):
+    """
+    Crop every box out of its image and resize it to size x size, batched.
+
+    Gives the same result as imresample(imgs[i, :, y-1:ey, x-1:ex], (size, size))
+    for each box (pad() coordinates), but averages each output pixel's area from a
+    summed-area table of the image, so all boxes of an image take one gather
+    instead of one slice + interpolate call each.
+
+    Arguments:
+        imgs {torch.Tensor} -- Images in (N, H, W, C) layout, as passed to detect_face.
+        tables {dict} -- Cache of summed-area tables by image index, shared between calls.
+
+    Returns:
+        torch.Tensor -- float32 crops of shape (len(boxes), C, size, size).
+    """
+    device = imgs.device
+    tables = {} if tables is None else tables
+    image_inds = torch.as_tensor(image_inds, device=device)
+    y0 = torch.as_tensor(y, device=device).int() - 1
+    x0 = torch.as_tensor(x, device=device).int() - 1
+    heights = torch.as_tensor(ey, device=device).int() - y0
+    widths = torch.as_tensor(ex, device=device).int() - x0
+
+    rows_lo, rows_hi = area_bins(y0, heights, size)
+    cols_lo, cols_hi = area_bins(x0, widths, size)
+    counts = (rows_hi - rows_lo)[:, None, :, None] * (cols_hi - cols_lo)[:, None, None, :]
+
+    # Flat table offsets of the four corners of every output pixel
+    row_stride = imgs.shape[2] + 1
+    rows = torch.stack([rows_hi, rows_lo, rows_hi, rows_lo])[:, :, :, None] * row_stride
+    cols = torch.stack([cols_hi, cols_hi, cols_lo, cols_lo])[:, :, None, :]
+    corners = rows + cols
+
+    channels = imgs.shape[3]
+    out = torch.empty(len(image_inds), channels, size, size, device=device)
+    for b_i in image_inds.unique().tolist():
+        if b_i not in tables:
+            tables[b_i] = integral_image(imgs[b_i])
+        table = tables[b_i].view(-1, channels)
+
+        k = (image_inds == b_i).nonzero()[:, 0]
+        v = table.index_select(0, corners[:, k].reshape(-1)).view(4, len(k), size, size, channels)
+        sums = (v[0] - v[1] - v[2] + v[3]).permute(0, 3, 1, 2)
+        out[k] = sums.float() / counts[k]
+
+    return out
+
+
+def crop_candidates(imgs, boxes, image_inds, w, h, size, tables=None):
+    """
+    Crop and resize the candidate boxes for the next stage (imgs in (N, H, W, C) layout).
+
+    Boxes that fall completely outside the image have nothing to crop and are
+    dropped. Returns the crops and the remaining boxes / image indices.
+    """
+    y, ey, x, ex = pad(boxes, w, h)
+    valid = (ey > y - 1) & (ex > x - 1)
+    if not valid.all():
+        keep = torch.as_tensor(valid, device=boxes.device)
+        boxes, image_inds = boxes[keep], image_inds[keep]
+        y, ey, x, ex = y[valid], ey[valid], x[valid], ex[valid]
+
+    im_data = crop_resize_boxes(imgs, image_inds, y, ey, x, ex, size, tables)
+    return im_data, boxes, image_inds
+
+
 def rerec(bboxA):
     h = bboxA[:, 3] - bboxA[:, 1]
     w = bboxA[:, 2] - bboxA[:, 0]
@@ -0,0 +1,74 @@
+"""
+Benchmark the tensor NMS used by detect_face against the NumPy reference.
+
+Usage:
+    python -m facenet.models.utils.nms_benchmark
+"""
+
+import time
+
+import numpy as np
+import torch
+
+from .detect_face import NMS_TENSOR_MIN_BOXES, nms_numpy, nms_tensor
+
+SIZES = (100, 1000, 10000)
+
+
+def candidate_boxes(n, image_size=1440, seed=0):
+    """Clustered face-like candidates: jittered copies of a few boxes, as MTCNN stages produce."""
+    rng = np.random.default_rng(seed)
+    faces = max(1, n // 50)
+    centers = rng.uniform(0, image_size, (faces, 2))
+    sizes = rng.uniform(24, 240, faces)
+
+    face = rng.integers(0, faces, n)
+    size = sizes[face] * rng.uniform(0.8, 1.25, n)
+    center = centers[face] + rng.normal(0, 0.15, (n, 2)) * sizes[face, None]
+    boxes = np.concatenate([center - size[:, None] / 2, center + size[:, None] / 2], axis=1)
+    return torch.tensor(boxes, dtype=torch.float32), torch.tensor(rng.uniform(0, 1, n), dtype=torch.float32)
+
+
+def timed(func, repeat):
+    func()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def benchmark(sizes=SIZES, threshold=0.7, device="cpu") -> list:
+    """
+    Time both implementations for each box count and overlap method, checking they
+    agree, and report the one batched_nms_auto selects.
+    """
+    results = []
+    for n in sizes:
+        boxes, scores = candidate_boxes(n)
+        boxes, scores = boxes.to(device), scores.to(device)
+        repeat = 3 if n >= 10000 else 10
+
+        for method in ("Union", "Min"):
+            reference, numpy_time = timed(
+                lambda: nms_numpy(boxes.cpu().numpy(), scores.cpu().numpy(), threshold, method), repeat
+            )
+            picks, tensor_time = timed(lambda: nms_tensor(boxes, scores, threshold, method), repeat)
+
+            results.append({
+                "boxes": n,
+                "method": method,
+                "kept": len(picks),
+                "numpy_ms": numpy_time * 1000,
+                "tensor_ms": tensor_time * 1000,
+                "speedup": numpy_time / tensor_time,
+                "same_picks": np.array_equal(np.sort(reference), np.sort(picks.cpu().numpy())),
+                "selected": "tensor" if device != "cpu" or (method == "Union" and n >= NMS_TENSOR_MIN_BOXES) else "numpy",
+            })
+    return results
+
+
+if __name__ == "__main__":
+    print(f"{'boxes':>6} {'method':>6} {'kept':>5} {'numpy ms':>9} {'tensor ms':>10} {'speedup':>8} same  selected")
+    for r in benchmark():
+        print(f"{r['boxes']:>6} {r['method']:>6} {r['kept']:>5} {r['numpy_ms']:>9.2f} "
+              f"{r['tensor_ms']:>10.2f} {r['speedup']:>7.1f}x {str(r['same_picks']):<5} {r['selected']}")
@@ -0,0 +1,230 @@
+import json
+import threading
+
+import cv2 as cv
+import numpy as np
+
+# Card templates: canonical size (w, h) of the rectified card and the region of its
+# portrait, normalized to that size. ID-1 (85.60 x 53.98 mm) is the format of national
+# ID cards and driving licences, with the portrait on the left; ID-3 (125 x 88 mm) is
+# the passport data page. Regions are generous: the face only has to be inside.
+DEFAULT_TEMPLATES = {
+    "id1": {"size": (856, 540), "portrait": (0.02, 0.15, 0.42, 0.95)},
+    "id3": {"size": (1000, 704), "portrait": (0.02, 0.2, 0.36, 0.9)},
+}
+
+
+def load_templates(path: str) -> dict:
+    """Read card templates from a JSON file with the layout of DEFAULT_TEMPLATES."""
+    with open(path) as f:
+        templates = json.load(f)
+
+    for name, template in templates.items():
+        (w, h), (x1, y1, x2, y2) = template["size"], template["portrait"]
+        if not (w > 0 and h > 0 and 0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+            raise ValueError(f"Invalid card template '{name}': {template}")
+    return templates
+
+
+def order_corners(quad: np.ndarray) -> np.ndarray:
+    """Corners of a quadrilateral (4 x 2) as top-left, top-right, bottom-right, bottom-left."""
+    quad = np.asarray(quad, dtype=np.float32).reshape(4, 2)
+    s, d = quad.sum(axis=1), quad[:, 1] - quad[:, 0]
+    return quad[[np.argmin(s), np.argmin(d), np.argmax(s), np.argmax(d)]]
+
+
+def find_quad(img: np.ndarray, work_side: int = 640, min_area: float = 0.15):
+    """
+    Find the outline of a card in an RGB image with edge and contour operations.
+
+    The image is shrunk to `work_side`, and the largest contours of its edges are
+    approximated by polygons; the first convex quadrilateral is the card. Contours
+    of background clutter touching the card do not simplify to four corners. If
+    there is none (a broken outline, very round corners), the card is the
+    minimum-area rectangle of the largest contour that fills most of it.
+
+    Returns:
+        np.ndarray: Corners (4 x 2, original image coordinates) from order_corners,
+            or None if no convex quadrilateral covers `min_area` of the image.
+    """
+    h, w = img.shape[:2]
+    scale = min(1.0, work_side / max(h, w))
+    small = cv.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv.INTER_AREA)
+
+    gray = cv.GaussianBlur(cv.cvtColor(small, cv.COLOR_RGB2GRAY), (5, 5), 0)
+    edges = cv.dilate(cv.Canny(gray, 50, 150), np.ones((3, 3), np.uint8))
+    contours, _ = cv.findContours(edges, cv.RETR_LIST, cv.CHAIN_APPROX_SIMPLE)
+
+    min_pixels = min_area * small.shape[0] * small.shape[1]
+    candidates = [c for c in sorted(contours, key=cv.contourArea, reverse=True)[:10] if cv.contourArea(c) >= min_pixels]
+    for contour in candidates:
+        quad = cv.approxPolyDP(contour, 0.02 * cv.arcLength(contour, True), True)
+        if len(quad) == 4 and cv.isContourConvex(quad):
+            return order_corners(quad.reshape(4, 2).astype(np.float32) / scale)
+
+    for contour in candidates:
+        rect = cv.minAreaRect(contour)
+        if cv.contourArea(contour) >= 0.9 * rect[1][0] * rect[1][1]:
+            return order_corners(cv.boxPoints(rect) / scale)
+
+    return None
+
+
+class CardLocalizer:
+    """
+    Face detection on ID card photos, restricted to the card's portrait.
+
+    A card photo contains background, text, holograms and patterns which the
+    detection pyramid would otherwise scan. The card outline is found with cheap
+    OpenCV edge and contour operations, matched to the templates by aspect ratio
+    and rectified to the template's size, and only its portrait region is passed
+    to the detector. Boxes and landmarks are mapped back to the original image.
+    The portrait of a card seen the other way up (or sideways) is tried too.
+
+    When no card is found, or no face with a probability of at least `min_prob`
+    is in the portrait of any matching template, the whole image is detected, as
+    without the localizer. Photos cropped to the card are matched as a whole.
+
+    Use `detector(detector)` to get a detector object for
+    `utils.functions.extract_face`.
+
+    Parameters:
+        templates (dict): Template name to {"size": (w, h), "portrait": (x1, y1, x2, y2)}.
+        aspect_tolerance (float): Maximum relative difference between the aspect
+            ratios of the card and of a template.
+        min_area (float): Minimum card area, relative to the image.
+        work_side (int): Image size for the outline search.
+        min_prob (float): Face probability required in the portrait.
+    """
+
+    def __init__(self, templates=DEFAULT_TEMPLATES, aspect_tolerance: float = 0.12, min_area: float = 0.15,
+                 work_side: int = 640, min_prob: float = 0.9):
+        self.templates = templates
+        self.aspect_tolerance = aspect_tolerance
+        self.min_area = min_area
+        self.work_side = work_side
+        self.min_prob = min_prob
+
+        self._lock = threading.Lock()
+        self._counts = {"no_card": 0, "fallbacks": 0, **{name: 0 for name in templates}}
+
+    def match(self, quad: np.ndarray, tolerance: float = None) -> list:
+        """Names of the templates matching the aspect ratio of a card outline (ordered corners)."""
+        tolerance = self.aspect_tolerance if tolerance is None else tolerance
+        width = (np.linalg.norm(quad[1] - quad[0]) + np.linalg.norm(quad[2] - quad[3])) / 2
+        height = (np.linalg.norm(quad[3] - quad[0]) + np.linalg.norm(quad[2] - quad[1])) / 2
+        aspect = max(width, height) / max(min(width, height), 1e-6)
+        return [
+            name for name, template in self.templates.items()
+            if abs(aspect / (template["size"][0] / template["size"][1]) - 1) <= tolerance
+        ]
+
+    def locate(self, img: np.ndarray):
+        """
+        Find the card of an image.
+
+        Returns:
+            tuple: (corners, template names) or None, with the corners ordered
+                top-left first and the matching templates by preference.
+        """
+        quad = find_quad(img, self.work_side, self.min_area)
+        names = self.match(quad) if quad is not None else []
+        if names:
+            return quad, names
+
+        # A photo cropped to the card; the aspect ratio of uncropped photos (4:3,
+        # 3:2) is a few percent off the card formats, so this match is strict
+        h, w = img.shape[:2]
+        quad = np.array([[0, 0], [w, 0], [w, h], [0, h]], dtype=np.float32)
+        names = self.match(quad, self.aspect_tolerance / 4)
+        return (quad, names) if names else None
+
+    def orientations(self, quad: np.ndarray) -> list:
+        """Corner orders to try, with the card's long side on top: upright first, then upside down."""
+        upright = quad if np.linalg.norm(quad[1] - quad[0]) >= np.linalg.norm(quad[3] - quad[0]) else np.roll(quad, -1, axis=0)
+        return [upright, np.roll(upright, 2, axis=0)]
+
+    def portrait(self, img: np.ndarray, quad: np.ndarray, template: dict):
+        """
+        The rectified portrait region of a card.
+
+        Returns:
+            tuple: (portrait image, 3 x 3 homography from portrait to image coordinates).
+        """
+        (w, h), (x1, y1, x2, y2) = template["size"], template["portrait"]
+        left, top = round(x1 * w), round(y1 * h)
+        size = (round(x2 * w) - left, round(y2 * h) - top)
+
+        # Maps the card corners to the canonical card shifted so the portrait starts at 0, 0
+        target = np.array([[0, 0], [w, 0], [w, h], [0, h]], dtype=np.float32) - np.array([left, top], dtype=np.float32)
+        to_portrait = cv.getPerspectiveTransform(quad.astype(np.float32), target)
+        crop = cv.warpPerspective(img, to_portrait, size, flags=cv.INTER_LINEAR, borderMode=cv.BORDER_REPLICATE)
+        return crop, np.linalg.inv(to_portrait)
+
+    def detect(self, detector, img: np.ndarray, landmarks=False):
+        """
+        Detect faces in the portrait of the card of a single RGB numpy image.
+
+        Returns:
+            Same as `MTCNN.detect` for a single image, in original image coordinates.
+        """
+        result, outcome = None, "no_card"
+        located = self.locate(img)
+        if located is not None:
+            quad, names = located
+            outcome = "fallbacks"
+            for name in names:
+                for corners in self.orientations(quad):
+                    crop, to_image = self.portrait(img, corners, self.templates[name])
+                    boxes, probs, points = detector.detect(crop, landmarks=True)
+                    if boxes is not None and len(boxes) and max(probs) >= self.min_prob:
+                        result, outcome = self._to_image(boxes, probs, points, to_image), name
+                        break
+                if result is not None:
+                    break
+
+        self._record(outcome)
+        if result is None:
+            result = detector.detect(img, landmarks=True)
+
+        boxes, probs, points = result
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    @staticmethod
+    def _to_image(boxes, probs, points, to_image: np.ndarray):
+        """Map portrait boxes (as the bounds of their mapped corners) and landmarks to the image."""
+        boxes = np.asarray(boxes, dtype=np.float32)
+        corners = boxes[:, [[0, 1], [2, 1], [2, 3], [0, 3]]].reshape(-1, 1, 2)
+        corners = cv.perspectiveTransform(corners, to_image).reshape(-1, 4, 2)
+        mapped = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+
+        points = np.asarray(points, dtype=np.float32)
+        points = cv.perspectiveTransform(points.reshape(-1, 1, 2), to_image).reshape(points.shape)
+        return mapped, probs, points
+
+    def _record(self, outcome: str):
+        with self._lock:
+            self._counts[outcome] += 1
+
+    def detector(self, detector) -> "CardDetector":
+        """Detector restricted to card portraits."""
+        return CardDetector(self, detector)
+
+    def stats(self) -> dict:
+        """Detections resolved in the portrait of each template, photos without a card, and fallbacks
+        to whole-image detection after a card was found."""
+        with self._lock:
+            return dict(self._counts)
+
+
+class CardDetector:
+    """`detect()` restricted to card portraits, with MTCNN.detect's signature."""
+
+    def __init__(self, localizer: CardLocalizer, detector):
+        self.localizer = localizer
+        self.detector = detector
+
+    def detect(self, img: np.ndarray, landmarks=False):
+        return self.localizer.detect(self.detector, img, landmarks=landmarks)
@@ -0,0 +1,243 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+METRICS = ("euclidean", "cosine")
+DTYPES = ("float32", "float16")
+
+# float16 candidates re-scored exactly per query: max(SHORTLIST_FACTOR * k, SHORTLIST_MIN)
+SHORTLIST_FACTOR = 4
+SHORTLIST_MIN = 32
+
+# Rows allocated for a new shard, doubled as it fills up to the shard size
+INITIAL_ROWS = 1024
+
+
+class _Shard:
+    """A block of at most `max_rows` rows of the gallery matrix."""
+
+    def __init__(self, max_rows: int, dim: int, dtype):
+        self.max_rows = max_rows
+        rows = min(INITIAL_ROWS, max_rows)
+        self.vectors = np.zeros((rows, dim), dtype=dtype)
+        self.sq_norms = np.zeros(rows, dtype=np.float32)
+        self.ids = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, identity) -> int:
+        """Reserve a row for `identity` and return its index."""
+        row = len(self.ids)
+        if row == len(self.vectors):
+            rows = min(2 * row, self.max_rows)
+            vectors = np.zeros((rows, self.vectors.shape[1]), dtype=self.vectors.dtype)
+            sq_norms = np.zeros(rows, dtype=np.float32)
+            vectors[:row], sq_norms[:row] = self.vectors, self.sq_norms
+            self.vectors, self.sq_norms = vectors, sq_norms
+        self.ids.append(identity)
+        return row
+
+
+class EmbeddingGallery:
+    """
+    In-memory 1:N search over enrolled face embeddings.
+
+    Embeddings live in contiguous float32 (or float16, half the memory) matrices
+    of `shard_size` rows. A query is answered with one matrix multiply per shard
+    followed by `argpartition`, and the per-shard top-k are merged. With
+    `workers` > 1 the shards are searched in parallel threads (NumPy releases the
+    GIL in the matmul), which is what makes large galleries fast on
+    single-threaded BLAS builds.
+
+    Distances are those of utils.distance, so findThreshold applies:
+    'euclidean' is the L2 distance and 'cosine' the angle (radians) between
+    embeddings.
+
+    Identities are added and removed incrementally. A removed row is filled with
+    the last row of its shard, so shards stay dense. Searches and updates are
+    serialized by a lock.
+
+    Parameters:
+        dim (int): Embedding size.
+        dtype (str): 'float32' or 'float16'.
+        metric (str): 'euclidean' or 'cosine'.
+        shard_size (int): Rows per shard.
+        workers (int): Threads searching the shards of one query.
+    """
+
+    def __init__(self, dim: int = 512, dtype: str = "float32", metric: str = "euclidean", shard_size: int = 65536,
+                 workers: int = 1):
+        if dtype not in DTYPES:
+            raise ValueError(f"Unknown gallery dtype '{dtype}', expected one of {DTYPES}")
+        if metric not in METRICS:
+            raise ValueError(f"Unknown gallery metric '{metric}', expected one of {METRICS}")
+
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.metric = metric
+        self.shard_size = shard_size
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._shards = []
+        self._where = {}  # identity: (shard, row)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gallery") if workers > 1 else None
+        self._searches = 0
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, identity):
+        return identity in self._where
+
+    def ids(self) -> list:
+        """Identities in the gallery."""
+        with self._lock:
+            return list(self._where)
+
+    def add(self, ids, embeddings):
+        """
+        Add embeddings (N x dim) under the given identities.
+
+        An identity already in the gallery has its embedding replaced.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim)
+        if len(ids) != len(embeddings):
+            raise ValueError(f"Got {len(ids)} identities for {len(embeddings)} embeddings")
+
+        with self._lock:
+            for identity, vector in zip(ids, embeddings):
+                if identity in self._where:
+                    shard_index, row = self._where[identity]
+                    shard = self._shards[shard_index]
+                else:
+                    shard_index, shard = self._free_shard()
+                    row = shard.append(identity)
+                    self._where[identity] = (shard_index, row)
+
+                shard.vectors[row] = vector
+                stored = shard.vectors[row].astype(np.float32)
+                shard.sq_norms[row] = np.dot(stored, stored)
+
+    def remove(self, ids) -> int:
+        """Remove identities, returning how many were in the gallery."""
+        removed = 0
+        with self._lock:
+            for identity in ids:
+                location = self._where.pop(identity, None)
+                if location is None:
+                    continue
+
+                shard_index, row = location
+                shard = self._shards[shard_index]
+                last = len(shard) - 1
+                if row != last:
+                    shard.vectors[row] = shard.vectors[last]
+                    shard.sq_norms[row] = shard.sq_norms[last]
+                    shard.ids[row] = shard.ids[last]
+                    self._where[shard.ids[row]] = (shard_index, row)
+                shard.ids.pop()
+                removed += 1
+        return removed
+
+    def search(self, queries, k: int = 5) -> list:
+        """
+        Find the `k` closest identities to each query embedding.
+
+        Parameters:
+            queries: Query embeddings (Q x dim, or a single dim vector).
+            k (int): Number of identities to return per query.
+
+        Returns:
+            list: For each query, a list of up to k (identity, distance) pairs, closest first.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+
+        with self._lock:
+            self._searches += 1
+            shards = [shard for shard in self._shards if len(shard)]
+            if not shards or k <= 0:
+                return [[] for _ in queries]
+
+            if self._executor is not None and len(shards) > 1:
+                partial = list(self._executor.map(lambda shard: self._search_shard(shard, queries, k), shards))
+            else:
+                partial = [self._search_shard(shard, queries, k) for shard in shards]
+
+        # Merge the per-shard candidates
+        distances = np.concatenate([d for d, _ in partial], axis=1)
+        ids = [sum((shard_ids[q] for _, shard_ids in partial), []) for q in range(len(queries))]
+
+        results = []
+        for q in range(len(queries)):
+            top = np.argsort(distances[q], kind="stable")[:k]
+            results.append([(ids[q][i], float(distances[q, i])) for i in top])
+        return results
+
+    def _search_shard(self, shard: _Shard, queries: np.ndarray, k: int):
+        """Top-k distances and identities of one shard, unsorted."""
+        n = len(shard)
+        vectors, sq_norms = shard.vectors[:n], shard.sq_norms[:n]
+        q_sq = np.einsum("ij,ij->i", queries, queries)[:, None]
+
+        if vectors.dtype == np.float32:
+            distances = self._distances(queries @ vectors.T, q_sq, sq_norms[None])
+            top = self._top(distances, k)
+            distances = np.take_along_axis(distances, top, axis=1)
+        else:
+            # NumPy has no float16 BLAS and upcasting costs more than the matmul, so a
+            # torch half-precision matmul shortlists candidates, which are then
+            # re-scored exactly (half-precision dots are off by ~1e-3, too coarse
+            # near the distances of genuine matches)
+            dots = (torch.from_numpy(queries).half() @ torch.from_numpy(vectors).T).float().numpy()
+            shortlist = self._top(self._distances(dots, q_sq, sq_norms[None]), max(SHORTLIST_FACTOR * k, SHORTLIST_MIN))
+
+            dots = np.einsum("qsd,qd->qs", vectors[shortlist].astype(np.float32), queries)
+            distances = self._distances(dots, q_sq, sq_norms[shortlist])
+            top = self._top(distances, k)
+            distances = np.take_along_axis(distances, top, axis=1)
+            top = np.take_along_axis(shortlist, top, axis=1)
+
+        return distances, [[shard.ids[i] for i in rows] for rows in top]
+
+    def _distances(self, dots: np.ndarray, q_sq: np.ndarray, sq_norms: np.ndarray) -> np.ndarray:
+        """Distances from dot products and squared norms."""
+        if self.metric == "euclidean":
+            return np.sqrt(np.maximum(q_sq + sq_norms - 2 * dots, 0))
+
+        norms = np.sqrt(q_sq * sq_norms)
+        return np.arccos(np.clip(dots / np.maximum(norms, 1e-12), -1, 1))
+
+    @staticmethod
+    def _top(distances: np.ndarray, k: int) -> np.ndarray:
+        """Column indices of the k smallest distances of each row, unsorted."""
+        n = distances.shape[1]
+        if k < n:
+            return np.argpartition(distances, k - 1, axis=1)[:, :k]
+        return np.broadcast_to(np.arange(n), distances.shape)
+
+    def _free_shard(self):
+        for index, shard in enumerate(self._shards):
+            if len(shard) < self.shard_size:
+                return index, shard
+        self._shards.append(_Shard(self.shard_size, self.dim, self.dtype))
+        return len(self._shards) - 1, self._shards[-1]
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """Return gallery counters."""
+        with self._lock:
+            return {
+                "identities": len(self._where),
+                "shards": len(self._shards),
+                "dtype": self.dtype.name,
+                "metric": self.metric,
+                "memory_mb": round(sum(s.vectors.nbytes for s in self._shards) / 2 ** 20, 1),
+                "searches": self._searches,
+            }
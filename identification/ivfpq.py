@@ -0,0 +1,330 @@
+"""
+On-disk IVF-PQ index for 1:N search over millions of face embeddings.
+
+A brute-force float32 gallery (identification.gallery) needs 2 KB of RAM per
+512-d embedding. This index keeps only compact codes in the search path:
+
+- an inverted file (IVF): a coarse k-means quantizer assigns every embedding to
+  one of `nlist` lists, and a query only scans the `nprobe` lists closest to it;
+- product quantization (PQ): the residual of an embedding to its list centroid
+  is split into `m` sub-vectors, each replaced by the index (one byte) of its
+  nearest centroid in a 256-entry sub-codebook, so an embedding is `m` bytes;
+- asymmetric distance computation (ADC): the query is not quantized. Per probed
+  list, a table of distances from the query residual to every sub-codebook entry
+  is built, and the approximate distance to a code is `m` table lookups;
+- exact re-ranking: the `rerank` best approximate candidates are re-scored
+  against the full-precision embeddings, stored on disk next to the codes and
+  only read for those candidates.
+
+The index is a directory of append-only segments. Each add() writes a new
+segment with its codes sorted by list, and everything is opened with mmap, so
+the resident memory is what the OS pages in (codes of the scanned lists and the
+re-ranked rows). compact() merges the segments. Distances are Euclidean, as
+EmbeddingGallery's, so findThreshold applies.
+
+Usage:
+    index = IVFPQIndex.train("path/to/index", sample_embeddings, nlist=1024, m=32)
+    index.add(ids, embeddings)
+    index = IVFPQIndex.open("path/to/index")
+    index.search(query_embeddings, k=10)
+"""
+
+import json
+import os
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+META_FILE = "index.json"
+FORMAT_VERSION = 1
+
+# Rows per block when assigning vectors to centroids
+ASSIGN_BLOCK = 65536
+
+
+def nearest(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid of each row of `x`."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    assign = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), ASSIGN_BLOCK):
+        block = x[start:start + ASSIGN_BLOCK]
+        assign[start:start + len(block)] = np.argmin(c_sq[None] - 2 * block @ centroids.T, axis=1)
+    return assign
+
+
+def kmeans(x: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means; empty clusters are re-seeded with random points."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        assign = nearest(x, centroids)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=k)
+
+        filled = counts > 0
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = np.add.reduceat(x[order], starts, axis=0) / counts[filled, None]
+        centroids[~filled] = x[rng.choice(len(x), int((~filled).sum()), replace=False)]
+
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    Memory-mapped IVF-PQ index (see the module docstring).
+
+    Create one with IVFPQIndex.train() and load it with IVFPQIndex.open().
+    Identities are int64 labels (e.g. row numbers of the verification history).
+
+    Parameters:
+        path (str): Index directory.
+        nprobe (int): Lists scanned per query.
+        rerank (int): Approximate candidates re-scored exactly per query.
+    """
+
+    def __init__(self, path: str, nprobe: int = 16, rerank: int = 100):
+        self.path = path
+        self.nprobe = nprobe
+        self.rerank = rerank
+
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format {meta['version']} in {path}")
+
+        self.dim = meta["dim"]
+        self.nlist = meta["nlist"]
+        self.m = meta["m"]
+        self.coarse = np.load(os.path.join(path, "coarse.npy"))
+        self.codebooks = np.load(os.path.join(path, "codebooks.npy"))  # m x 256 x dim / m
+        self._codebook_sq = np.einsum("mjd,mjd->mj", self.codebooks, self.codebooks)
+
+        self._lock = threading.Lock()
+        self._segments = [self._load_segment(name) for name in meta["segments"]]
+
+    @classmethod
+    def train(cls, path: str, sample: np.ndarray, nlist: int = 1024, m: int = 32, iterations: int = 20,
+              seed: int = 0, **kwargs) -> "IVFPQIndex":
+        """
+        Train the coarse quantizer and the PQ codebooks on `sample` and create an
+        empty index at `path`.
+
+        The sample should be representative embeddings, at least ~40 per list and
+        at least 256 (one per sub-codebook entry).
+        """
+        sample = np.ascontiguousarray(sample, dtype=np.float32)
+        dim = sample.shape[1]
+        if dim % m:
+            raise ValueError(f"Embedding size {dim} is not divisible into {m} sub-vectors")
+
+        coarse = kmeans(sample, nlist, iterations, seed)
+        residuals = sample - coarse[nearest(sample, coarse)]
+        sub = dim // m
+        codebooks = np.stack([
+            kmeans(np.ascontiguousarray(residuals[:, i * sub:(i + 1) * sub]), 256, iterations, seed + 1 + i)
+            for i in range(m)
+        ])
+
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "coarse.npy"), coarse)
+        np.save(os.path.join(path, "codebooks.npy"), codebooks)
+        _write_meta(path, {"version": FORMAT_VERSION, "dim": dim, "nlist": nlist, "m": m, "segments": []})
+        return cls(path, **kwargs)
+
+    @classmethod
+    def open(cls, path: str, **kwargs) -> "IVFPQIndex":
+        return cls(path, **kwargs)
+
+    def __len__(self):
+        return sum(len(segment["ids"]) for segment in self._segments)
+
+    def encode(self, vectors: np.ndarray):
+        """List assignment and PQ codes (N x m uint8) of embeddings."""
+        lists = nearest(vectors, self.coarse)
+        residuals = vectors - self.coarse[lists]
+        sub = self.dim // self.m
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for i in range(self.m):
+            codes[:, i] = nearest(np.ascontiguousarray(residuals[:, i * sub:(i + 1) * sub]), self.codebooks[i])
+        return lists, codes
+
+    def add(self, ids, vectors):
+        """Append embeddings (N x dim) under int64 `ids` as a new segment."""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} identities for {len(vectors)} embeddings")
+        if not len(ids):
+            return
+
+        lists, codes = self.encode(vectors)
+        order = np.argsort(lists, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(lists, minlength=self.nlist))])
+
+        with self._lock:
+            name = self._write_segment({
+                "codes": codes[order], "ids": ids[order], "vectors": vectors[order], "offsets": offsets,
+            })
+            self._commit(self._segments + [self._load_segment(name)])
+
+    def search(self, queries, k: int = 10, nprobe: int = None, rerank: int = None) -> list:
+        """
+        Find the `k` closest identities to each query embedding.
+
+        Returns:
+            list: For each query, up to k (id, distance) pairs, closest first.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        rerank = max(rerank or self.rerank, k)
+        segments = self._segments
+
+        q_sq = np.einsum("ij,ij->i", queries, queries)
+        coarse_distances = np.einsum("ij,ij->i", self.coarse, self.coarse)[None] - 2 * queries @ self.coarse.T
+        probes = np.argpartition(coarse_distances, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, probe in zip(queries, probes):
+            approx, locations = self._scan(query, probe, segments)
+            if not len(approx):
+                results.append([])
+                continue
+
+            shortlist = np.argpartition(approx, min(rerank, len(approx)) - 1)[:rerank]
+
+            # Exact re-ranking on the full-precision embeddings
+            ids, distances = [], []
+            for s, rows in _group(locations[shortlist]):
+                segment = segments[s]
+                vectors = segment["vectors"][rows]
+                distances.append(np.sqrt(np.maximum(((vectors - query) ** 2).sum(axis=1), 0)))
+                ids.append(segment["ids"][rows])
+            ids, distances = np.concatenate(ids), np.concatenate(distances)
+
+            top = np.argsort(distances, kind="stable")[:k]
+            results.append([(int(ids[i]), float(distances[i])) for i in top])
+        return results
+
+    def _scan(self, query: np.ndarray, probe: np.ndarray, segments: list):
+        """ADC distances of every code in the probed lists, with their (segment, row) locations."""
+        sub = self.dim // self.m
+        lookup_offsets = np.arange(self.m) * 256
+
+        approx, locations = [], []
+        for list_index in probe:
+            residual = (query - self.coarse[list_index]).reshape(self.m, sub)
+            # ||r_i - c_ij||^2 for every sub-vector i and sub-codebook entry j
+            table = (
+                np.einsum("md,md->m", residual, residual)[:, None]
+                - 2 * np.einsum("md,mjd->mj", residual, self.codebooks)
+                + self._codebook_sq
+            ).ravel()
+
+            for s, segment in enumerate(segments):
+                start, end = segment["offsets"][list_index], segment["offsets"][list_index + 1]
+                if start == end:
+                    continue
+                codes = segment["codes"][start:end]
+                approx.append(table[codes.astype(np.intp) + lookup_offsets].sum(axis=1))
+                locations.append(np.stack([np.full(end - start, s), np.arange(start, end)], axis=1))
+
+        if not approx:
+            return np.zeros(0, dtype=np.float32), np.zeros((0, 2), dtype=np.int64)
+        return np.concatenate(approx), np.concatenate(locations)
+
+    def compact(self):
+        """Merge all segments into one, so each list is scanned with a single slice."""
+        with self._lock:
+            segments = self._segments
+            if len(segments) < 2:
+                return
+
+            counts = sum(np.diff(segment["offsets"]) for segment in segments)
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            name = _segment_name()
+            directory = os.path.join(self.path, name)
+            os.makedirs(directory)
+
+            total = int(offsets[-1])
+            out = {
+                "codes": np.lib.format.open_memmap(os.path.join(directory, "codes.npy"), "w+", np.uint8, (total, self.m)),
+                "ids": np.lib.format.open_memmap(os.path.join(directory, "ids.npy"), "w+", np.int64, (total,)),
+                "vectors": np.lib.format.open_memmap(
+                    os.path.join(directory, "vectors.npy"), "w+", np.float32, (total, self.dim)
+                ),
+            }
+            # Copied list by list, so the embeddings are never all in memory
+            for list_index in range(self.nlist):
+                position = offsets[list_index]
+                for segment in segments:
+                    start, end = segment["offsets"][list_index], segment["offsets"][list_index + 1]
+                    for key, array in out.items():
+                        array[position:position + end - start] = segment[key][start:end]
+                    position += end - start
+            for array in out.values():
+                array.flush()
+            np.save(os.path.join(directory, "offsets.npy"), offsets)
+
+            self._commit([self._load_segment(name)])
+            for segment in segments:
+                shutil.rmtree(os.path.join(self.path, segment["name"]), ignore_errors=True)
+
+    def stats(self) -> dict:
+        """Return index counters."""
+        segments = self._segments
+        return {
+            "embeddings": sum(len(segment["ids"]) for segment in segments),
+            "segments": len(segments),
+            "nlist": self.nlist,
+            "m": self.m,
+            "code_bytes": self.m,
+            "codes_mb": round(sum(segment["codes"].nbytes for segment in segments) / 2 ** 20, 1),
+        }
+
+    def _write_segment(self, arrays: dict) -> str:
+        name = _segment_name()
+        directory = os.path.join(self.path, name)
+        os.makedirs(directory)
+        for key, array in arrays.items():
+            np.save(os.path.join(directory, f"{key}.npy"), array)
+        return name
+
+    def _load_segment(self, name: str) -> dict:
+        directory = os.path.join(self.path, name)
+        segment = {
+            key: np.load(os.path.join(directory, f"{key}.npy"), mmap_mode="r")
+            for key in ("codes", "ids", "vectors")
+        }
+        segment["offsets"] = np.load(os.path.join(directory, "offsets.npy"))
+        segment["name"] = name
+        return segment
+
+    def _commit(self, segments: list):
+        """Publish a new segment list (the metadata file is replaced atomically)."""
+        _write_meta(self.path, {
+            "version": FORMAT_VERSION, "dim": self.dim, "nlist": self.nlist, "m": self.m,
+            "segments": [segment["name"] for segment in segments],
+        })
+        self._segments = segments
+
+
+def _write_meta(path: str, meta: dict):
+    tmp = os.path.join(path, f"{META_FILE}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, META_FILE))
+
+
+def _segment_name() -> str:
+    return f"segment-{uuid.uuid4().hex[:12]}"
+
+
+def _group(locations: np.ndarray):
+    """(segment, sorted rows) groups of (segment, row) pairs, rows sorted for sequential reads."""
+    order = np.lexsort((locations[:, 1], locations[:, 0]))
+    locations = locations[order]
+    for s in np.unique(locations[:, 0]):
+        yield int(s), locations[locations[:, 0] == s, 1]
@@ -53,7 +53,7 @@ class EmotionDetectionModel(nn.Module):
         x = F.relu(self.conv_5_2(x))
         x = F.relu(self.conv_5_3(x))
         x = F.max_pool2d(x, 2, 2)
-        x = x.view(x.size(0), -1)
+        x = x.reshape(x.size(0), -1)
         x = F.relu(self.fc6(x))
         x = F.dropout(x, 0.3, self.training)
         x = F.relu(self.fc7(x))
@@ -62,18 +62,34 @@ class EmotionDetectionModel(nn.Module):
     
 class EmotionPredictor():
     
-    def __init__(self, pretrained = 'landmarks/emotion_weights.pt', device = 'cpu', img_size = (64,64), classes = ['smile','surprise', 'neutral']):
+    def __init__(self, pretrained = 'landmarks/emotion_weights.pt', device = 'cpu', img_size = (64,64), classes = ['smile','surprise', 'neutral'], quantized = None):
+        """
+        Parameters:
+            pretrained (str): Weights path relative to this folder.
+            device (str or torch.device): Device to run the model on.
+            img_size (tuple): Model input size.
+            classes (list): Class labels in model output order.
+            quantized (str, optional): Path to an INT8 TorchScript artifact built with
+                `python -m quantization.calibrate`. Replaces `pretrained` and runs on CPU.
+        """
         
         if isinstance(device, str):
             if (device == 'cuda' or device == 'gpu') and torch.cuda.is_available():
                 device = torch.device(device)
             else:
                 device = torch.device('cpu')
+
+        if quantized:
+            from quantization.int8 import load_quantized
+            device = torch.device('cpu')
+            self.model = load_quantized(quantized)
+            pretrained = None
+        else:
+            self.model = EmotionDetectionModel().to(device)
+            self.model.eval()
+
         self.device = device
         
-        self.model = EmotionDetectionModel().to(device)
-        self.model.eval() 
-        
         if pretrained:
             state_dict_path = os.path.join(os.path.dirname(__file__), pretrained)
             self.model.load_state_dict(torch.load(state_dict_path, map_location= 'cpu'))
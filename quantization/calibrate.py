@@ -0,0 +1,214 @@
+"""
+Build INT8 variants of the eKYC models from a folder of calibration images and
+report how closely they agree with the FP32 models.
+
+Usage:
+    python -m quantization.calibrate --images path/to/calibration_images --output quantization/artifacts
+
+Writes vggface2_int8.pt, rnet_int8.pt, onet_int8.pt, emotion_int8.pt (TorchScript) and
+report.json to the output folder. Part of the images is held out for the report.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+
+import torch
+from PIL import Image
+from torchvision import transforms as T
+
+from facenet.models.mtcnn import MTCNN
+from liveness_detection import emotion_prediction
+from liveness_detection.emotion_prediction import EmotionDetectionModel
+from quantization.int8 import (
+    quantize_emotion_model,
+    quantize_mtcnn_net,
+    quantize_vggface2,
+    save_quantized,
+)
+from utils.distance import findThreshold
+from utils.functions import extract_face, face_transform, get_image
+from verification_models import VGGFace2
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Same preprocessing as EmotionPredictor.transform
+emotion_transform = T.Compose(
+    [T.Resize((64, 64)), T.ToTensor(), T.Normalize(mean=[0.5], std=[0.5])]
+)
+
+
+def load_calibration_images(folder: str, limit: int = None) -> list:
+    """Load RGB images from a folder, sorted by filename."""
+    names = sorted(f for f in os.listdir(folder) if f.lower().endswith(IMAGE_EXTENSIONS))
+    if limit:
+        names = names[:limit]
+    return [get_image(os.path.join(folder, name)) for name in names]
+
+
+def collect_calibration_data(images: list, mtcnn: MTCNN) -> dict:
+    """
+    Run the FP32 pipeline over the images and record the inputs each model sees:
+    RNet/ONet candidate crops (via forward hooks), VGGFace2 faces and emotion faces.
+    """
+    data = {"rnet": [], "onet": [], "vggface2": [], "emotion": []}
+
+    hooks = [
+        mtcnn.rnet.register_forward_pre_hook(lambda m, inp: data["rnet"].append(inp[0].detach().cpu())),
+        mtcnn.onet.register_forward_pre_hook(lambda m, inp: data["onet"].append(inp[0].detach().cpu())),
+    ]
+    try:
+        for img in images:
+            face, box, _ = extract_face(img, mtcnn, padding=1)
+            if box is None or face.size == 0:
+                continue
+            data["vggface2"].append(face_transform(face, model_name="VGG-Face2").cpu())
+            gray = Image.fromarray(face).convert("L")
+            data["emotion"].append(emotion_transform(gray)[None, ...])
+    finally:
+        for hook in hooks:
+            hook.remove()
+
+    return data
+
+
+def batches(tensors: list, size: int) -> list:
+    """Concatenate single-sample tensors into batches of `size`."""
+    return [torch.cat(tensors[i:i + size]) for i in range(0, len(tensors), size)]
+
+
+def benchmark(model, inputs: list, repeat: int = 3) -> float:
+    """Average seconds to run the model over all inputs."""
+    with torch.no_grad():
+        for x in inputs[:1]:
+            model(x)
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for x in inputs:
+                model(x)
+    return (time.perf_counter() - start) / repeat
+
+
+def compare_embeddings(fp32, int8, faces: list) -> dict:
+    """Embedding similarity and verification-decision agreement of the INT8 VGGFace2."""
+    with torch.no_grad():
+        a = torch.cat([fp32(x) for x in faces])
+        b = torch.cat([int8(x) for x in faces])
+
+    cosine = torch.nn.functional.cosine_similarity(a, b, dim=1)
+
+    threshold = findThreshold("VGG-Face2", "euclidean")
+    decisions_a = torch.cdist(a, a) < threshold
+    decisions_b = torch.cdist(b, b) < threshold
+    pairs = torch.triu(torch.ones_like(decisions_a), diagonal=1)
+    agreement = ((decisions_a == decisions_b) & pairs).sum() / pairs.sum().clamp(min=1)
+
+    return {
+        "faces": len(a),
+        "cosine_mean": float(cosine.mean()),
+        "cosine_min": float(cosine.min()),
+        "decision_agreement": float(agreement),
+    }
+
+
+def compare_classifier(fp32, int8, inputs: list, index: int = None) -> dict:
+    """Top-1 agreement of two classifiers (optionally using one output of a multi-output model)."""
+    agree = total = 0
+    with torch.no_grad():
+        for x in inputs:
+            a, b = fp32(x), int8(x)
+            if index is not None:
+                a, b = a[index], b[index]
+            agree += int((a.argmax(1) == b.argmax(1)).sum())
+            total += len(x)
+    return {"samples": total, "decision_agreement": agree / max(total, 1)}
+
+
+def report_entry(fp32, int8, inputs, comparison) -> dict:
+    fp32_time = benchmark(fp32, inputs)
+    int8_time = benchmark(int8, inputs)
+    comparison.update({
+        "fp32_seconds": fp32_time,
+        "int8_seconds": int8_time,
+        "speedup": fp32_time / int8_time if int8_time else None,
+    })
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build INT8 eKYC models from calibration images")
+    parser.add_argument("--images", required=True, help="Folder of calibration images (ID cards / selfies)")
+    parser.add_argument("--output", default="quantization/artifacts", help="Output folder for artifacts")
+    parser.add_argument("--limit", type=int, default=None, help="Maximum number of images to use")
+    parser.add_argument("--holdout", type=float, default=0.25, help="Fraction of images held out for the report")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--emotion-weights", default="landmarks/emotion_weights.pt",
+                        help="Emotion model weights, relative to liveness_detection/")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    torch.manual_seed(0)
+
+    images = load_calibration_images(args.images, args.limit)
+    if len(images) < 2:
+        raise SystemExit("Need at least two calibration images")
+
+    split = max(1, int(len(images) * (1 - args.holdout)))
+    calibration_images, holdout_images = images[:split], images[split:] or images[:split]
+    logger.info(f"{len(calibration_images)} calibration images, {len(holdout_images)} held out")
+
+    mtcnn = MTCNN(device=torch.device("cpu"))
+    calibration = collect_calibration_data(calibration_images, mtcnn)
+    holdout = collect_calibration_data(holdout_images, mtcnn)
+
+    report = {}
+
+    # MTCNN RNet / ONet: index 1 (RNet) / 2 (ONet) is the face / no-face softmax
+    for name, net, score_index in (("rnet", mtcnn.rnet, 1), ("onet", mtcnn.onet, 2)):
+        if not calibration[name]:
+            logger.warning(f"No {name} candidates collected, skipping")
+            continue
+        int8 = quantize_mtcnn_net(net, calibration[name])
+        save_quantized(int8, calibration[name][0], os.path.join(args.output, f"{name}_int8.pt"))
+        inputs = holdout[name] or calibration[name]
+        report[name] = report_entry(net, int8, inputs, compare_classifier(net, int8, inputs, score_index))
+
+    if calibration["vggface2"]:
+        try:
+            vggface2 = VGGFace2.load_model(device="cpu")
+        except FileNotFoundError as e:
+            logger.warning(f"VGGFace2 weights not found, skipping: {e}")
+        else:
+            faces = batches(calibration["vggface2"], args.batch_size)
+            int8 = quantize_vggface2(vggface2, faces)
+            save_quantized(int8, faces[0], os.path.join(args.output, "vggface2_int8.pt"))
+            inputs = batches(holdout["vggface2"], args.batch_size) or faces
+            report["vggface2"] = report_entry(vggface2, int8, inputs, compare_embeddings(vggface2, int8, inputs))
+
+        emotion_path = os.path.join(os.path.dirname(emotion_prediction.__file__), args.emotion_weights)
+        if os.path.exists(emotion_path):
+            emotion = EmotionDetectionModel().eval()
+            emotion.load_state_dict(torch.load(emotion_path, map_location="cpu"))
+            faces = batches(calibration["emotion"], args.batch_size)
+            int8 = quantize_emotion_model(emotion, faces)
+            save_quantized(int8, faces[0], os.path.join(args.output, "emotion_int8.pt"))
+            inputs = batches(holdout["emotion"], args.batch_size) or faces
+            report["emotion"] = report_entry(emotion, int8, inputs, compare_classifier(emotion, int8, inputs))
+        else:
+            logger.warning(f"Emotion weights not found at {emotion_path}, skipping")
+    else:
+        logger.warning("No faces found in the calibration images, skipping VGGFace2 and emotion models")
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import copy
+import os
+
+import torch
+from torch import nn
+from torch.ao.quantization import (
+    QConfigMapping,
+    default_qconfig,
+    get_default_qconfig,
+    quantize_dynamic,
+)
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+
+def select_engine() -> str:
+    """Pick the best available quantized CPU engine and make it the active one."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("No quantized engine available in this PyTorch build")
+
+
+def static_qconfig_mapping(engine: str) -> QConfigMapping:
+    """
+    QConfig mapping for static INT8 quantization of the convolutional layers.
+
+    Linear layers are skipped here and converted to dynamic INT8 afterwards.
+    PReLU (MTCNN) only supports a per-tensor weight observer.
+    """
+    return (
+        QConfigMapping()
+        .set_global(get_default_qconfig(engine))
+        .set_object_type(nn.Linear, None)
+        .set_object_type(nn.PReLU, default_qconfig)
+    )
+
+
+def quantize_model(model: nn.Module, calibration_batches: list) -> nn.Module:
+    """
+    Produce an INT8 copy of a model: static quantization for the convolutions
+    (calibrated on `calibration_batches`) and dynamic quantization for Linear layers.
+
+    Parameters:
+        model (nn.Module): A float model in eval mode. It is not modified.
+        calibration_batches (list): Input tensors that are representative of real traffic.
+
+    Returns:
+        nn.Module: The quantized model (a torch.fx GraphModule), CPU only.
+    """
+    if not calibration_batches:
+        raise ValueError("At least one calibration batch is required")
+
+    engine = select_engine()
+    model = copy.deepcopy(model).cpu().eval()
+
+    prepared = prepare_fx(model, static_qconfig_mapping(engine), (calibration_batches[0],))
+    with torch.no_grad():
+        for batch in calibration_batches:
+            prepared(batch)
+
+    quantized = convert_fx(prepared)
+    return quantize_dynamic(quantized, {nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_vggface2(model: nn.Module, faces: list) -> nn.Module:
+    """Quantize a VGGFace2 InceptionResnetV1 (reference build, not optimize_for_inference)."""
+    model = copy.deepcopy(model)
+    model.logits = None
+    return quantize_model(model, faces)
+
+
+def quantize_emotion_model(model: nn.Module, faces: list) -> nn.Module:
+    """Quantize the liveness EmotionDetectionModel."""
+    return quantize_model(model, faces)
+
+
+def quantize_mtcnn_net(net: nn.Module, crops: list) -> nn.Module:
+    """Quantize an MTCNN RNet or ONet."""
+    return quantize_model(net, crops)
+
+
+def save_quantized(model: nn.Module, example: torch.Tensor, path: str):
+    """Save a quantized model as a TorchScript artifact."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with torch.no_grad():
+        scripted = torch.jit.trace(model, example)
+    torch.jit.save(scripted, path)
+
+
+def load_quantized(path: str) -> torch.jit.ScriptModule:
+    """Load a TorchScript INT8 artifact written by save_quantized()."""
+    select_engine()
+    model = torch.jit.load(path, map_location="cpu")
+    model.eval()
+    return model
+
+
+class QuantizedEmbeddingModel(nn.Module):
+    """
+    Wrap an INT8 VGGFace2 artifact so it exposes the same interface as
+    InceptionResnetV1 (`forward` and `device()`).
+    """
+
+    def __init__(self, model: torch.jit.ScriptModule):
+        super().__init__()
+        self.model = model
+
+    def device(self):
+        return torch.device("cpu")
+
+    def forward(self, x):
+        with torch.inference_mode():
+            return self.model(x.cpu())
@@ -0,0 +1,161 @@
+import cv2 as cv
+import numpy as np
+import torch
+
+from facenet.models.mtcnn import MTCNN
+from facenet.models.utils.detect_face import detect_face
+from serving.micro_batcher import MicroBatcher
+
+# (height, width) canvases, both orientations of the common camera aspect ratios
+DEFAULT_BUCKETS = (
+    (480, 640), (640, 480),
+    (720, 960), (960, 720),
+    (1080, 1440), (1440, 1080),
+)
+
+
+def parse_buckets(spec: str):
+    """Parse a bucket list such as '480x640,640x480' (height x width) into tuples."""
+    buckets = []
+    for item in spec.split(","):
+        item = item.strip()
+        if item:
+            h, w = item.lower().split("x")
+            buckets.append((int(h), int(w)))
+    return tuple(buckets)
+
+
+def detection_buckets(buckets, max_side: int):
+    """
+    Add the canvases of images downscaled to `max_side` (DownscaledDetector) to `buckets`:
+    4:3 in both orientations, which also hold 3:2 and 16:9 images of that size.
+    """
+    if max_side <= 0:
+        return tuple(buckets)
+    added = ((max_side * 3 // 4, max_side), (max_side, max_side * 3 // 4))
+    return tuple(sorted(set(buckets) | set(added), key=lambda b: (b[0] * b[1], b)))
+
+
+def choose_bucket(shape, buckets):
+    """
+    Choose a canvas for an image of the given shape.
+
+    The smallest bucket the image fits into unchanged is preferred. If the image is
+    larger than every bucket, the bucket that needs the least downscaling is used.
+    Ties go to the bucket closest to the image's aspect ratio (and orientation).
+
+    Returns:
+        tuple: (bucket, scale) where scale <= 1 is applied to the image before padding.
+    """
+    h, w = shape[:2]
+
+    def aspect_mismatch(b):
+        return abs(np.log((b[0] / b[1]) / (h / w)))
+
+    fitting = [b for b in buckets if b[0] >= h and b[1] >= w]
+    if fitting:
+        return min(fitting, key=lambda b: (b[0] * b[1], aspect_mismatch(b))), 1.0
+
+    bucket = max(buckets, key=lambda b: (min(b[0] / h, b[1] / w), -aspect_mismatch(b)))
+    return bucket, min(bucket[0] / h, bucket[1] / w)
+
+
+def letterbox(img: np.ndarray, bucket, scale: float) -> np.ndarray:
+    """Resize `img` by `scale` and pad it at the bottom/right to the bucket size."""
+    if scale != 1.0:
+        size = (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale)))
+        img = cv.resize(img, size, interpolation=cv.INTER_AREA)
+
+    canvas = np.zeros((bucket[0], bucket[1], 3), dtype=np.uint8)
+    canvas[:img.shape[0], :img.shape[1]] = img
+    return canvas
+
+
+class DetectionBatcher(MicroBatcher):
+    """
+    Cross-request batched MTCNN detection with resolution bucketing.
+
+    `detect_face` accepts a batch of images but only if they share one size. Every
+    submitted image is therefore letterboxed onto one of a few fixed canvases
+    (padded, and downscaled only when larger than every bucket), images that share
+    a canvas (and detection settings) are detected together in one P/R/O-net pass,
+    and boxes and landmarks are mapped back to each original image's coordinates.
+
+    `detect()` has the same signature and return values as `MTCNN.detect` for a
+    single image, so the batcher can be passed to `utils.functions.extract_face` and
+    `face_verification.verify` in place of the MTCNN model.
+
+    Parameters:
+        mtcnn (MTCNN): The loaded MTCNN model providing the nets and detection settings.
+        buckets (tuple): Canvas sizes as (height, width) pairs.
+        max_batch_size (int): Maximum number of images per scheduling round.
+        max_wait_ms (float): Maximum time to wait for more images after the first one arrives.
+    """
+
+    def __init__(self, mtcnn: MTCNN, buckets=DEFAULT_BUCKETS, max_batch_size: int = 16, max_wait_ms: float = 5.0):
+        self.mtcnn = mtcnn
+        self.buckets = tuple(buckets)
+        super().__init__(max_batch_size, max_wait_ms, name="detection-batcher")
+
+    def detect(self, img: np.ndarray, landmarks=False, min_face_size=None, dominant_face=None, report=None):
+        """
+        Detect faces in a single RGB numpy image.
+
+        Parameters:
+            min_face_size (int, optional): Minimum face size instead of the MTCNN model's.
+            dominant_face (float, optional): detect_face's dominant face fraction, relative
+                to the bucket canvas (so at least as strict as for the image alone).
+            report (dict, optional): Receives detect_face's report for the image's batch.
+
+        Returns:
+            Same as `MTCNN.detect` for a single image: boxes, probs and optionally landmarks.
+        """
+        boxes, probs, points = self.submit((img, min_face_size or self.mtcnn.min_face_size, dominant_face, report))
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    def _process_batch(self, payloads: list) -> list:
+        groups = {}
+        for i, (img, min_face_size, dominant_face, _) in enumerate(payloads):
+            bucket, scale = choose_bucket(img.shape, self.buckets)
+            groups.setdefault((bucket, min_face_size, dominant_face), []).append((i, scale))
+
+        results = [None] * len(payloads)
+        for (bucket, min_face_size, dominant_face), members in groups.items():
+            batch = np.stack([letterbox(payloads[i][0], bucket, scale) for i, scale in members])
+
+            report = {}
+            with torch.no_grad():
+                batch_boxes, batch_points = detect_face(
+                    batch, min_face_size,
+                    self.mtcnn.pnet, self.mtcnn.rnet, self.mtcnn.onet,
+                    self.mtcnn.thresholds, self.mtcnn.factor,
+                    self.mtcnn.device,
+                    dominant_face=dominant_face, report=report
+                )
+
+            for (i, scale), box, point in zip(members, batch_boxes, batch_points):
+                results[i] = self._format(box, point, scale)
+                if payloads[i][3] is not None:
+                    payloads[i][3].update(report)
+
+        return results
+
+    def _format(self, box, point, scale: float):
+        """Map one image's detections back to original coordinates, in MTCNN.detect's output format."""
+        box = np.asarray(box, dtype=np.float32).reshape(-1, 5)
+        point = np.asarray(point, dtype=np.float32).reshape(-1, 5, 2)
+
+        if len(box) == 0:
+            return None, [None], None
+
+        box[:, :4] /= scale
+        point /= scale
+
+        if self.mtcnn.select_largest:
+            box_order = np.argsort((box[:, 2] - box[:, 0]) * (box[:, 3] - box[:, 1]))[::-1]
+            box = box[box_order]
+            point = point[box_order]
+
+        return box[:, :4], box[:, 4], point
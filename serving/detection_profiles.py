@@ -0,0 +1,160 @@
+import threading
+
+import numpy as np
+
+from serving.downscaled_detector import DownscaledDetector, downscale_factor
+
+# Per kind of input: cheap (max_side, min_face_size) steps tried before the exhaustive
+# detection, with min_face_size in pixels of the image downscaled to max_side, and the
+# fraction of the image a face must cover to end detect_face's pyramid early
+# (dominant_face). A selfie face covers a large part of the frame and an ID card
+# portrait a few percent of the card. "dominant_steps", if given, replaces "steps"
+# when the pyramid ends early: dominant mode keeps full-resolution boxes and beat the
+# cheap steps on selfies and ID cards; video frames are small and faces vary more.
+DEFAULT_PROFILES = {
+    "selfie": {"steps": ((640, 80),), "dominant_face": 0.04, "dominant_steps": ()},
+    "id_card": {"steps": ((640, 40),), "dominant_face": 0.01, "dominant_steps": ()},
+    "video_frame": {"steps": ((480, 40),), "dominant_face": 0.02},
+}
+
+# Minimum face size of the exhaustive step (MTCNN's default)
+EXHAUSTIVE_MIN_FACE_SIZE = 20
+
+
+class DetectionLadder:
+    """
+    Coarse-to-fine face detection with named per-input profiles.
+
+    MTCNN's cost is dominated by the small scales of its image pyramid, which only
+    matter for small faces. Each profile first detects on a downscaled image with a
+    large minimum face size, and escalates through its steps to the exhaustive
+    detection (`max_side`, the detector's own minimum face size) only when no face
+    with a probability of at least `min_prob` was found. The exhaustive step is the
+    detection used without profiles, so results never get worse than that.
+
+    Every step also runs in the profile's dominant face mode: the pyramid stops
+    after its coarse scales when they found a confident face covering the profile's
+    fraction of the image, and runs the fine scales otherwise (see detect_face).
+    In this mode the profile's "dominant_steps" are used instead of its "steps".
+
+    Use `profile(name)` to get a detector object for `utils.functions.extract_face`.
+
+    Parameters:
+        detector: MTCNN or DetectionBatcher.
+        profiles (dict): Profile name to {"steps": tuple of cheap (max_side, min_face_size)
+            steps, "dominant_face": image fraction or None, optional "dominant_steps":
+            steps used instead when dominant_face is set}.
+        max_side (int): Image size of the exhaustive step (0: full resolution).
+        min_prob (float): Face probability that stops the escalation (extract_face's `min_prob`).
+    """
+
+    def __init__(self, detector, profiles=DEFAULT_PROFILES, max_side: int = 1024, min_prob: float = 0.9):
+        self.min_prob = min_prob
+        exhaustive = (DownscaledDetector(detector, max_side), None)
+        self._steps = {
+            name: [
+                (DownscaledDetector(detector, side), min_face_size) for side, min_face_size in self._cheap_steps(profile)
+            ] + [exhaustive]
+            for name, profile in profiles.items()
+        }
+        self._dominant_face = {name: profile.get("dominant_face") for name, profile in profiles.items()}
+
+        self._lock = threading.Lock()
+        self._counts = {name: [0] * len(steps) for name, steps in self._steps.items()}
+        self._not_found = dict.fromkeys(self._steps, 0)
+        self._early_exits = dict.fromkeys(self._steps, 0)
+        self._skipped_scales = dict.fromkeys(self._steps, 0)
+
+    @staticmethod
+    def _cheap_steps(profile: dict) -> tuple:
+        if profile.get("dominant_face") is not None:
+            return profile.get("dominant_steps", profile["steps"])
+        return profile["steps"]
+
+    @property
+    def profiles(self) -> tuple:
+        return tuple(self._steps)
+
+    def profile(self, name: str) -> "ProfileDetector":
+        """Detector running the ladder of profile `name`."""
+        if name not in self._steps:
+            raise ValueError(f"Unknown detection profile '{name}', expected one of {self.profiles}")
+        return ProfileDetector(self, name)
+
+    def detect(self, img: np.ndarray, profile: str, landmarks=False, min_face_size=None):
+        """
+        Detect faces in a single RGB numpy image with the ladder of `profile`.
+
+        `min_face_size`, in pixels of `img`, is a lower bound on the face size known
+        by the caller (such as the Haar prefilter). It raises the minimum face size of
+        every step that it exceeds.
+
+        Returns:
+            Same as `MTCNN.detect` for a single image: the result of the first step
+            that found a face above `min_prob`, else of the exhaustive step.
+        """
+        steps = self._steps[profile]
+        for i, (step, step_min_face_size) in enumerate(steps):
+            if min_face_size is not None:
+                bound = int(min_face_size * downscale_factor(img.shape, step.max_side))
+                if bound > (step_min_face_size or EXHAUSTIVE_MIN_FACE_SIZE):
+                    step_min_face_size = bound
+
+            report = {}
+            boxes, probs, points = step.detect(
+                img, landmarks=True, min_face_size=step_min_face_size,
+                dominant_face=self._dominant_face[profile], report=report
+            )
+            self._record_pyramid(profile, report)
+            if boxes is not None and max(probs) >= self.min_prob:
+                self._record(profile, i)
+                break
+        else:
+            self._record(profile, None)
+
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    def _record(self, profile: str, step):
+        with self._lock:
+            if step is None:
+                self._not_found[profile] += 1
+            else:
+                self._counts[profile][step] += 1
+
+    def _record_pyramid(self, profile: str, report: dict):
+        skipped = len(report.get("skipped_scales", ()))
+        if skipped:
+            with self._lock:
+                self._early_exits[profile] += 1
+                self._skipped_scales[profile] += skipped
+
+    def stats(self) -> dict:
+        """
+        Per profile: detections resolved at each step (the last one exhaustive) and not
+        found, and the detections that ended their pyramid early with the pyramid scales
+        they skipped in total.
+        """
+        with self._lock:
+            return {
+                name: {
+                    "resolved_at_step": list(counts),
+                    "not_found": self._not_found[name],
+                    "dominant_face": self._dominant_face[name],
+                    "early_exits": self._early_exits[name],
+                    "skipped_scales": self._skipped_scales[name],
+                }
+                for name, counts in self._counts.items()
+            }
+
+
+class ProfileDetector:
+    """`detect()` of one DetectionLadder profile, with MTCNN.detect's signature."""
+
+    def __init__(self, ladder: DetectionLadder, name: str):
+        self.ladder = ladder
+        self.name = name
+
+    def detect(self, img: np.ndarray, landmarks=False, min_face_size=None):
+        return self.ladder.detect(img, self.name, landmarks=landmarks, min_face_size=min_face_size)
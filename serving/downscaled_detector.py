@@ -0,0 +1,79 @@
+import cv2 as cv
+import numpy as np
+
+
+def downscale_factor(shape, max_side: int) -> float:
+    """Factor by which `downscale` shrinks an image of `shape` (1.0 if it is not shrunk)."""
+    h, w = shape[:2]
+    if max_side <= 0 or max(h, w) <= max_side:
+        return 1.0
+    return max_side / max(h, w)
+
+
+def downscale(img: np.ndarray, max_side: int):
+    """
+    Shrink `img` so that its longer side is at most `max_side` pixels.
+
+    Returns:
+        tuple: (image, (scale_x, scale_y)), the scales mapping original coordinates
+            to the returned image's. Smaller images are returned as they are.
+    """
+    h, w = img.shape[:2]
+    scale = downscale_factor(img.shape, max_side)
+    if scale == 1.0:
+        return img, (1.0, 1.0)
+
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    small = cv.resize(img, size, interpolation=cv.INTER_AREA)
+    return small, (size[0] / w, size[1] / h)
+
+
+class DownscaledDetector:
+    """
+    Face detection on a downscaled copy of large images.
+
+    MTCNN's cost grows with the image area, while the faces of an eKYC upload (ID
+    card portrait, selfie) stay far above its minimum face size when a 12 MP photo
+    is shrunk to ~1000 px. Images whose longer side exceeds `max_side` are
+    detected at that size, and boxes and landmarks are mapped back to the original
+    image, so `utils.functions.extract_face` still crops the face from the
+    full-resolution pixels.
+
+    `detect()` has the same signature and return values as `MTCNN.detect` for a
+    single image, so the wrapper can be used in place of the MTCNN model or a
+    DetectionBatcher (which it usually wraps).
+
+    Parameters:
+        detector: MTCNN or DetectionBatcher.
+        max_side (int): Longest image side to run detection at; 0 disables downscaling.
+    """
+
+    def __init__(self, detector, max_side: int = 1024):
+        self.detector = detector
+        self.max_side = max_side
+
+    def detect(self, img: np.ndarray, landmarks=False, min_face_size=None, dominant_face=None, report=None):
+        """
+        Detect faces in a single RGB numpy image.
+
+        Parameters:
+            min_face_size (int, optional): Minimum face size in the downscaled image,
+                instead of the detector's.
+            dominant_face (float, optional), report (dict, optional): Passed to the
+                detector (see detect_face).
+
+        Returns:
+            Same as `MTCNN.detect` for a single image, in original image coordinates.
+        """
+        small, (scale_x, scale_y) = downscale(img, self.max_side)
+        boxes, probs, points = self.detector.detect(
+            small, landmarks=True, min_face_size=min_face_size, dominant_face=dominant_face, report=report
+        )
+
+        if boxes is not None and (scale_x, scale_y) != (1.0, 1.0):
+            boxes = np.asarray(boxes, dtype=np.float32) / np.array([scale_x, scale_y] * 2, dtype=np.float32)
+            points = np.asarray(points, dtype=np.float32) / np.array([scale_x, scale_y], dtype=np.float32)
+
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
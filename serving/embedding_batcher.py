@@ -0,0 +1,43 @@
+import torch
+
+from serving.micro_batcher import MicroBatcher
+
+
+class EmbeddingBatcher(MicroBatcher):
+    """
+    Dynamic micro-batching scheduler for a face embedding model.
+
+    Face crops from all in-flight requests are gathered for up to `max_wait_ms`
+    (or `max_batch_size` faces) and run through the model as one batched forward
+    pass.
+
+    The batcher mimics the parts of the model interface used by
+    `face_verification.face_matching` (`__call__` and `device()`), so it can be
+    passed anywhere a VGGFace2 model is expected.
+
+    Parameters:
+        model (torch.nn.Module): The embedding model (e.g. VGGFace2 InceptionResnetV1) in eval mode.
+        max_batch_size (int): Maximum number of faces per forward pass.
+        max_wait_ms (float): Maximum time to wait for more faces after the first one arrives.
+    """
+
+    def __init__(self, model: torch.nn.Module, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.model = model
+        super().__init__(max_batch_size, max_wait_ms, name="embedding-batcher")
+
+    def device(self):
+        return self.model.device()
+
+    def __call__(self, faces: torch.Tensor) -> torch.Tensor:
+        """
+        Compute embeddings for a batch of preprocessed faces (N x 3 x H x W).
+
+        Blocks until the scheduler has run the batch containing these faces.
+        """
+        return self.submit(faces, size=len(faces))
+
+    def _process_batch(self, payloads: list) -> list:
+        batch = torch.cat(payloads, dim=0)
+        with torch.inference_mode():
+            embeddings = self.model(batch)
+        return list(torch.split(embeddings, [len(faces) for faces in payloads]))
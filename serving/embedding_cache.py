@@ -0,0 +1,108 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class EmbeddingCache:
+    """
+    Cache of per-image face detection + embedding results, keyed by a hash of the
+    uploaded bytes.
+
+    The same ID card image is often verified against several selfie retries; with
+    the cache it is decoded, detected and embedded once. Entries are evicted least
+    recently used first beyond `max_entries`, and expire `ttl_seconds` after they
+    were computed.
+
+    Concurrent requests for an image that is being computed wait for that
+    computation instead of starting their own (request coalescing). Failures are
+    not cached: every waiter gets the exception, and the next request retries.
+
+    Parameters:
+        max_entries (int): Maximum number of cached images.
+        ttl_seconds (float): Lifetime of an entry.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 600.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key: (expires_at, value)
+        self._inflight = {}  # key: Future
+        self._hits = 0
+        self._misses = 0
+        self._coalesced = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    @staticmethod
+    def key(content: bytes) -> str:
+        """Cache key of an uploaded file."""
+        return hashlib.sha256(content).hexdigest()
+
+    def get_or_compute(self, key: str, compute):
+        """
+        Return the cached value for `key`, computing it with `compute()` on a miss.
+
+        Blocks while another thread computes the same key.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > self._clock():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self._expirations += 1
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self._misses += 1
+            else:
+                self._coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._inflight[key]
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Return cache counters."""
+        with self._lock:
+            lookups = self._hits + self._misses + self._coalesced
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "coalesced": self._coalesced,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "hit_rate": (self._hits + self._coalesced) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,109 @@
+from datetime import datetime
+
+import numpy as np
+import torch
+from bson import Binary, ObjectId
+from bson.errors import InvalidId
+
+# Embeddings fetched per find() when syncing a gallery
+SYNC_BATCH = 1000
+
+
+class EnrollmentNotFound(Exception):
+    """Raised when an enrollment ID is unknown or malformed."""
+
+
+class EnrollmentStore:
+    """
+    Reference face embeddings of enrolled ID cards, stored in MongoDB.
+
+    An ID card is detected and embedded once at enrollment; later selfie checks
+    against it only load the stored embedding. Embeddings are stored as raw
+    float32 bytes together with the model that produced them, so a check is
+    refused rather than silently compared across incompatible models.
+
+    Parameters:
+        collection: The pymongo collection holding the enrollments.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def add(self, embedding: torch.Tensor, model_name: str, **fields) -> str:
+        """
+        Store an embedding (1 x D) and return its enrollment ID.
+
+        Extra keyword arguments (e.g. the face box) are stored with it.
+        """
+        vector = np.ascontiguousarray(embedding.detach().cpu().numpy().reshape(-1), dtype=np.float32)
+        document = {
+            "timestamp": datetime.utcnow(),
+            "model": model_name,
+            "dim": int(vector.size),
+            "embedding": Binary(vector.tobytes()),
+            **fields,
+        }
+        return str(self.collection.insert_one(document).inserted_id)
+
+    def get(self, enrollment_id: str) -> dict:
+        """
+        Load an enrollment, with its "embedding" decoded to a 1 x D float32 tensor.
+
+        Raises:
+            EnrollmentNotFound: If there is no enrollment with this ID.
+        """
+        try:
+            document = self.collection.find_one({"_id": ObjectId(enrollment_id)})
+        except InvalidId:
+            document = None
+        if document is None:
+            raise EnrollmentNotFound(enrollment_id)
+
+        document["embedding"] = torch.from_numpy(decode_embedding(document).copy()).reshape(1, document["dim"])
+        document["_id"] = str(document["_id"])
+        return document
+
+    def delete(self, enrollment_id: str) -> bool:
+        """Delete an enrollment, returning whether it existed."""
+        try:
+            return self.collection.delete_one({"_id": ObjectId(enrollment_id)}).deleted_count > 0
+        except InvalidId:
+            return False
+
+    def sync_gallery(self, gallery, model_name: str):
+        """
+        Bring an identification.gallery.EmbeddingGallery in line with the stored
+        enrollments of `model_name`.
+
+        Only the enrollment IDs are read, plus the embeddings of enrollments the
+        gallery does not have yet, so repeated syncs are cheap. Enrollments added
+        to the gallery while this runs are kept.
+
+        Returns:
+            tuple: (added, removed) counts.
+        """
+        current = set(gallery.ids())
+        query = {"model": model_name, "dim": gallery.dim}
+        stored = {str(document["_id"]) for document in self.collection.find(query, {"_id": 1})}
+
+        removed = gallery.remove(current - stored)
+
+        missing = [ObjectId(enrollment_id) for enrollment_id in stored - current]
+        added = 0
+        for start in range(0, len(missing), SYNC_BATCH):
+            documents = list(self.collection.find(
+                {"_id": {"$in": missing[start:start + SYNC_BATCH]}}, {"embedding": 1, "dim": 1}
+            ))
+            if documents:
+                gallery.add(
+                    [str(document["_id"]) for document in documents],
+                    np.stack([decode_embedding(document) for document in documents]),
+                )
+                added += len(documents)
+
+        return added, removed
+
+
+def decode_embedding(document: dict) -> np.ndarray:
+    """The stored embedding of an enrollment document, as a float32 vector."""
+    return np.frombuffer(document["embedding"], dtype=np.float32)
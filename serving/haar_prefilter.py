@@ -0,0 +1,182 @@
+import threading
+
+import cv2 as cv
+import numpy as np
+
+from serving.downscaled_detector import downscale_factor
+
+# Frontal faces. Frames with turned heads (liveness turn challenges) also need the
+# profile cascade, which is run on the mirrored image too as it only detects one side,
+# and roughly triples the cost of frames without a face.
+DEFAULT_CASCADES = ("haarcascade_frontalface_default.xml",)
+TURNED_FACE_CASCADES = DEFAULT_CASCADES + ("haarcascade_profileface.xml",)
+
+# Detection window of the OpenCV face cascades, in pixels
+CASCADE_WINDOW = 24
+
+
+class HaarPrefilter:
+    """
+    Haar cascade prefilter in front of an MTCNN detector, for high-frequency
+    paths (liveness frames, previews) where most frames need a cheap answer.
+
+    The cascades run on a small grayscale copy of the frame. A frame in which they
+    find nothing is returned without faces and MTCNN is skipped. Otherwise MTCNN
+    only runs on the union of the cascade boxes, grown by `margin` times its size
+    on each side, and falls back to the whole frame if it finds no face with a
+    probability of at least `min_prob` there.
+
+    The prefilter only answers for faces of at least `min_face` of the frame's
+    shorter side, the faces these paths are interested in. The copy is made just
+    large enough for such a face to span `recall_margin` times the cascade's
+    24 px window, since faces near the window size are the ones a cascade misses;
+    a larger margin costs time for recall. Cascades also miss faces MTCNN finds
+    (strong rotation, poor light): `min_neighbors` is the cascade's acceptance
+    threshold (lower finds more faces, and more false positives, which only cost
+    an MTCNN run on their region), and every `audit_every`-th rejected frame still
+    goes through MTCNN. Audits return MTCNN's result and count the frames in which
+    the cascades missed a face, which measures the prefilter's recall in production.
+
+    Parameters:
+        detector: MTCNN or a detector with its `detect()` signature.
+        min_face (float): Smallest face to find, relative to the frame's shorter side.
+        recall_margin (float): Size of that face in the cascade's copy, in cascade windows.
+        min_neighbors (int): detectMultiScale's minNeighbors.
+        margin (float): Region margin around the cascade boxes, relative to their size.
+        min_prob (float): Face probability required to accept the region's result.
+        audit_every (int): Run MTCNN on every n-th rejected frame (0: never).
+        cascades (tuple): Cascade files of cv2.data.haarcascades (or paths).
+    """
+
+    def __init__(self, detector, min_face: float = 0.2, recall_margin: float = 1.5, min_neighbors: int = 3,
+                 margin: float = 0.5, min_prob: float = 0.9, audit_every: int = 20, cascades=DEFAULT_CASCADES):
+        if not hasattr(cv, "CascadeClassifier"):
+            raise ImportError("The Haar prefilter requires OpenCV 4 (cv2.CascadeClassifier)")
+
+        self.detector = detector
+        self.min_face = min_face
+        self.recall_margin = recall_margin
+        self.min_neighbors = min_neighbors
+        self.margin = margin
+        self.min_prob = min_prob
+        self.audit_every = audit_every
+        self.cascades = [cascade if "/" in cascade else cv.data.haarcascades + cascade for cascade in cascades]
+        for path in self.cascades:
+            if cv.CascadeClassifier(path).empty():
+                raise ValueError(f"Cannot load Haar cascade {path}")
+
+        # CascadeClassifier is not safe to share between threads
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(
+            ("frames", "rejected", "region_detections", "region_fallbacks", "audited", "missed"), 0
+        )
+        self._pixels = 0
+        self._image_pixels = 0
+
+    def candidates(self, img: np.ndarray) -> np.ndarray:
+        """Cascade face boxes (N x 4: x1, y1, x2, y2) in image coordinates."""
+        classifiers = getattr(self._local, "classifiers", None)
+        if classifiers is None:
+            classifiers = self._local.classifiers = [cv.CascadeClassifier(path) for path in self.cascades]
+
+        h, w = img.shape[:2]
+        scale = min(1.0, CASCADE_WINDOW * self.recall_margin / (self.min_face * min(h, w)))
+        gray = cv.cvtColor(img, cv.COLOR_RGB2GRAY)
+        if scale < 1.0:
+            gray = cv.resize(gray, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv.INTER_AREA)
+        gray = cv.equalizeHist(gray)
+
+        # Later cascades only run when the earlier ones found nothing
+        boxes = []
+        mirrored = gray[:, ::-1].copy()
+        for i, classifier in enumerate(classifiers):
+            for image in ((gray,) if i == 0 else (gray, mirrored)):
+                for x, y, bw, bh in classifier.detectMultiScale(image, scaleFactor=1.1, minNeighbors=self.min_neighbors):
+                    if image is mirrored:
+                        x = image.shape[1] - x - bw
+                    boxes.append((x, y, x + bw, y + bh))
+            if boxes:
+                break
+
+        return np.asarray(boxes, dtype=np.float32).reshape(-1, 4) / scale
+
+    def detect(self, img: np.ndarray, landmarks=False, **kwargs):
+        """
+        Detect faces in a single RGB numpy image, skipping MTCNN when the cascades find none.
+
+        Keyword arguments are passed to the detector.
+
+        Returns:
+            Same as `MTCNN.detect` for a single image.
+        """
+        h, w = img.shape[:2]
+        candidates = self.candidates(img)
+        outcomes, pixels = ["frames"], 0
+
+        if not len(candidates):
+            outcomes.append("rejected")
+            result = (None, [None], None)
+            with self._lock:
+                audit = self.audit_every > 0 and self._counts["rejected"] % self.audit_every == 0
+            if audit:
+                outcomes.append("audited")
+                result = self.detector.detect(img, landmarks=True, **kwargs)
+                pixels = h * w
+                if self._found(result):
+                    outcomes.append("missed")
+        else:
+            x1, y1 = candidates[:, :2].min(axis=0)
+            x2, y2 = candidates[:, 2:].max(axis=0)
+            mx, my = (x2 - x1) * self.margin, (y2 - y1) * self.margin
+            x1, y1 = max(0, int(x1 - mx)), max(0, int(y1 - my))
+            x2, y2 = min(w, int(np.ceil(x2 + mx))), min(h, int(np.ceil(y2 + my)))
+
+            # The cascade boxes also bound the face size, which prunes MTCNN's pyramid. A
+            # DownscaledDetector reads min_face_size in pixels of the region it downscales
+            sides = np.minimum(candidates[:, 2] - candidates[:, 0], candidates[:, 3] - candidates[:, 1])
+            scale = downscale_factor((y2 - y1, x2 - x1), getattr(self.detector, "max_side", 0))
+            region_kwargs = {"min_face_size": max(20, int(sides.min() * scale / 3)), **kwargs}
+            boxes, probs, points = self.detector.detect(img[y1:y2, x1:x2], landmarks=True, **region_kwargs)
+            pixels = (x2 - x1) * (y2 - y1)
+            if self._found((boxes, probs, points)):
+                outcomes.append("region_detections")
+                boxes = np.asarray(boxes, dtype=np.float32) + np.array([x1, y1, x1, y1], dtype=np.float32)
+                points = np.asarray(points, dtype=np.float32) + np.array([x1, y1], dtype=np.float32)
+                result = (boxes, probs, points)
+            else:
+                outcomes.append("region_fallbacks")
+                result = self.detector.detect(img, landmarks=True, **kwargs)
+                pixels += h * w
+
+        self._record(outcomes, pixels, h * w)
+
+        boxes, probs, points = result
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    def _found(self, result) -> bool:
+        """Whether a detection result has a face with a probability of at least `min_prob`."""
+        boxes, probs, _ = result
+        return boxes is not None and len(boxes) > 0 and max(probs) >= self.min_prob
+
+    def _record(self, outcomes: list, pixels: int, image_pixels: int):
+        with self._lock:
+            for outcome in outcomes:
+                self._counts[outcome] += 1
+            self._pixels += pixels
+            self._image_pixels += image_pixels
+
+    def stats(self) -> dict:
+        """
+        Frames, frames rejected without MTCNN (including audited ones), detections in
+        the cascade region and fallbacks to the whole frame, audited frames and the
+        confident faces the cascades missed in them, and the pixels MTCNN ran on relative to
+        running it on every whole frame.
+        """
+        with self._lock:
+            return {
+                **self._counts,
+                "mtcnn_pixel_ratio": round(self._pixels / self._image_pixels, 3) if self._image_pixels else None,
+            }
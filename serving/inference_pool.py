@@ -0,0 +1,87 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InferencePoolFull(Exception):
+    """Raised when the admission queue of an InferencePool is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Inference queue is full")
+        self.retry_after = retry_after
+
+
+class InferencePool:
+    """
+    Bounded executor for blocking model inference.
+
+    PyTorch releases the GIL inside its kernels, so running MTCNN / VGGFace2 on a
+    dedicated thread pool keeps the asyncio event loop free for I/O (uploads,
+    /health, admin endpoints). At most `max_workers` jobs run at once and at most
+    `max_queue` more wait for a worker; anything beyond that is rejected
+    immediately with InferencePoolFull instead of piling up in memory.
+
+    Parameters:
+        max_workers (int): Number of inference threads.
+        max_queue (int): Number of jobs allowed to wait for a free worker.
+        retry_after (int): Seconds suggested to rejected clients before retrying.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue: int = 8, retry_after: int = 1):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="inference"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run `func(*args, **kwargs)` on the pool and await its result.
+
+        The admission slot is released when the job itself finishes, not when the
+        awaiting request goes away, so cancelled requests still count against the
+        queue until their inference is done.
+
+        Raises:
+            InferencePoolFull: If all workers are busy and the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise InferencePoolFull(self.retry_after)
+
+        with self._lock:
+            self._pending += 1
+
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._release()
+            raise
+
+        future.add_done_callback(lambda _: self._release())
+        return await asyncio.wrap_future(future)
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        """Return a snapshot of the pool occupancy."""
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queue_size": self.max_queue,
+                "pending": self._pending,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,149 @@
+import threading
+
+from facenet.models.utils.detect_face import detection_memory
+from serving.detection_batcher import choose_bucket
+from utils.functions import decode_reduction
+
+POLICIES = ("downscale", "reject")
+
+# Images are never downscaled below this longer side to fit the budget
+MIN_SIDE = 256
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when an image cannot be processed within the per-request memory budget."""
+
+    def __init__(self, estimate: int, budget: int):
+        super().__init__(
+            f"needs ~{estimate / 2 ** 20:.0f} MB to process, over the budget of {budget / 2 ** 20:.0f} MB"
+        )
+        self.estimate = estimate
+        self.budget = budget
+
+
+class MemoryGuard:
+    """
+    Per-request memory budget for decoding an uploaded image and detecting faces in it.
+
+    The peak memory is estimated from the image header alone, before anything is
+    decoded: the decoded image (JPEGs at their reduced decode size), the copies
+    made to downscale it, and detect_face's working set for the image pyramid it
+    will build at the detection size (the bucket canvas when detection batching is
+    on). A small PNG that decompresses to hundreds of megapixels is caught here.
+
+    Images over the budget are either rejected or processed at the largest size
+    that fits, depending on `policy`.
+
+    Parameters:
+        budget_bytes (int): Memory allowed per request.
+        policy (str): 'downscale' or 'reject'.
+        decode_min_side (int): `target_side` passed to decode_image (0: full resolution).
+        detection_side (int): DownscaledDetector max side (0: full resolution).
+        min_face_size (int), factor (float): MTCNN pyramid settings.
+        buckets (tuple, optional): DetectionBatcher canvases, if detection is batched.
+    """
+
+    def __init__(self, budget_bytes: int, policy: str = "downscale", decode_min_side: int = 0, detection_side: int = 0,
+                 min_face_size: int = 20, factor: float = 0.709, buckets=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown memory budget policy '{policy}', expected one of {POLICIES}")
+
+        self.budget_bytes = budget_bytes
+        self.policy = policy
+        self.decode_min_side = decode_min_side
+        self.detection_side = detection_side
+        self.min_face_size = min_face_size
+        self.factor = factor
+        self.buckets = buckets
+
+        self._lock = threading.Lock()
+        self._images = 0
+        self._downscaled = 0
+        self._rejected = 0
+        self._max_estimate = 0
+
+    def decode_side(self, max_side: int = None) -> int:
+        """`target_side` to decode an image with when it will be downscaled to `max_side`."""
+        if max_side:
+            return min(self.decode_min_side, max_side) if self.decode_min_side else max_side
+        return self.decode_min_side
+
+    def estimate(self, width: int, height: int, image_format: str, max_side: int = None) -> int:
+        """Estimated peak bytes to decode and detect on an image, optionally downscaled to `max_side`."""
+        reduction = decode_reduction((width, height), image_format, self.decode_side(max_side))
+        w, h = -(-width // reduction), -(-height // reduction)
+        total = w * h * 3
+
+        # Copies made by the downscale here and by DownscaledDetector
+        for side in (max_side, self.detection_side):
+            if side and max(w, h) > side:
+                scale = side / max(w, h)
+                w, h = max(1, round(w * scale)), max(1, round(h * scale))
+                total += w * h * 3
+
+        if self.buckets:
+            (h, w), _ = choose_bucket((h, w), self.buckets)
+        return total + detection_memory(h, w, self.min_face_size, self.factor)
+
+    def plan(self, width: int, height: int, image_format: str, share: float = 1.0):
+        """
+        Check an image against the budget before decoding it.
+
+        Parameters:
+            share (float): Fraction of the budget available to this image (e.g. 0.5
+                for each of the two images of a /verify request).
+
+        Returns:
+            tuple: (max_side, estimate) -- the longer side to downscale the image to
+                (None if it fits as it is) and the estimated peak bytes.
+
+        Raises:
+            MemoryBudgetExceeded: If the image is over budget and the policy is
+                'reject', or it does not fit even at MIN_SIDE.
+        """
+        budget = int(self.budget_bytes * share)
+        estimate = self.estimate(width, height, image_format)
+        max_side = None
+
+        if estimate > budget:
+            if self.policy == "downscale":
+                max_side = self._fit(width, height, image_format, budget)
+            if max_side is None:
+                self._record(estimate, rejected=True)
+                raise MemoryBudgetExceeded(estimate, budget)
+
+        self._record(estimate, downscaled=max_side is not None)
+        return max_side, estimate
+
+    def _fit(self, width: int, height: int, image_format: str, budget: int):
+        """Largest longer side (>= MIN_SIDE) whose estimate fits the budget, or None."""
+        lo, hi = MIN_SIDE, max(width, height) - 1
+        if hi < lo or self.estimate(width, height, image_format, lo) > budget:
+            return None
+
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.estimate(width, height, image_format, mid) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo
+
+    def _record(self, estimate: int, downscaled: bool = False, rejected: bool = False):
+        with self._lock:
+            self._images += 1
+            self._downscaled += downscaled
+            self._rejected += rejected
+            self._max_estimate = max(self._max_estimate, estimate)
+
+    def stats(self) -> dict:
+        """Return budget counters."""
+        with self._lock:
+            return {
+                "budget_mb": self.budget_bytes / 2 ** 20,
+                "policy": self.policy,
+                "images": self._images,
+                "downscaled": self._downscaled,
+                "rejected": self._rejected,
+                "max_estimate_mb": round(self._max_estimate / 2 ** 20, 1),
+            }
@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Base class for cross-request micro-batching schedulers.
+
+    Callers on any thread submit a payload with `submit()`. A single scheduler
+    thread gathers the payloads of all in-flight requests until either
+    `max_batch_size` items are queued or `max_wait_ms` has passed since the first
+    one arrived, hands them to `_process_batch()` and scatters the results back to
+    the waiting callers.
+
+    Parameters:
+        max_batch_size (int): Maximum number of items per batch.
+        max_wait_ms (float): Maximum time to wait for more items after the first one arrives.
+        name (str): Name of the scheduler thread.
+    """
+
+    def __init__(self, max_batch_size: int = 32, max_wait_ms: float = 5.0, name: str = "micro-batcher"):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, payload, size: int = 1):
+        """
+        Queue a payload and block until the batch containing it has been processed.
+
+        Parameters:
+            payload: Request data passed to `_process_batch()`.
+            size (int): How many items the payload counts for towards `max_batch_size`.
+
+        Returns:
+            The result produced by `_process_batch()` for this payload.
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self._thread.name} is closed")
+            self._queue.put((payload, size, future))
+        return future.result()
+
+    def _process_batch(self, payloads: list) -> list:
+        """Process a list of payloads and return one result per payload."""
+        raise NotImplementedError
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the window closes."""
+        item = self._queue.get()
+        if item is None:
+            return None
+
+        items = [item]
+        size = item[1]
+        deadline = time.monotonic() + self.max_wait
+
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Finish the current batch, then stop
+                self._queue.put(None)
+                break
+            items.append(item)
+            size += item[1]
+
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            if items is None:
+                self._fail_pending()
+                return
+
+            payloads = [payload for payload, _, _ in items]
+            futures = [future for _, _, future in items]
+            try:
+                results = self._process_batch(payloads)
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+
+            with self._lock:
+                self._batches += 1
+                self._items += sum(size for _, size, _ in items)
+
+    def _fail_pending(self):
+        """Fail requests that were still queued behind the stop sentinel."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                item[2].set_exception(RuntimeError(f"{self._thread.name} is closed"))
+
+    def stats(self) -> dict:
+        """Return batching counters."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "items": self._items,
+                "avg_batch_size": self._items / self._batches if self._batches else 0.0,
+            }
+
+    def close(self):
+        """Stop the scheduler thread after the queued requests are served."""
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
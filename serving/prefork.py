@@ -0,0 +1,141 @@
+"""
+Pre-fork multi-worker server for the eKYC API.
+
+The master process loads the models once, moves their weights into shared memory
+and then forks the workers, so N workers share one copy of the MTCNN and VGGFace2
+weights instead of loading N private copies. Each worker gets its own torch thread
+settings, MongoDB client, inference pool and batching threads.
+
+Usage:
+    python -m serving.prefork
+
+Configuration (environment variables):
+    HOST, PORT                 Listen address (default: 0.0.0.0:8000)
+    WEB_WORKERS                Number of worker processes (default: 2)
+    TORCH_THREADS_PER_WORKER   Intra-op threads per worker (default: cpu_count // WEB_WORKERS)
+    TORCH_INTEROP_THREADS      Inter-op threads per worker (default: 1)
+"""
+
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+
+import torch
+import uvicorn
+
+logger = logging.getLogger(__name__)
+
+
+def share_model_memory(*models):
+    """Move the parameters and buffers of the given modules into shared memory."""
+    for model in models:
+        if model is not None:
+            model.share_memory()
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Create the listening socket in the master so every worker accepts on it."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, torch_threads: int, interop_threads: int):
+    """Configure torch for this worker and serve the app on the inherited socket."""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    torch.set_num_threads(torch_threads)
+    torch.set_num_interop_threads(interop_threads)
+    logger.info(f"Worker {os.getpid()} started with {torch_threads} torch threads")
+
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+
+def serve(host="0.0.0.0", port=8000, workers=2, torch_threads=None, interop_threads=1):
+    """
+    Load models in this process, then fork and supervise `workers` API workers.
+
+    Dead workers are respawned; SIGTERM / SIGINT stop all workers and return.
+    """
+    import api
+
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # No inference may run here: forking after torch has started its thread pools
+    # is unsafe, so the master only loads weights.
+    api.load_ml_models()
+    share_model_memory(api.mtcnn, api.verification_model)
+
+    # Keep the garbage collector from touching (and un-sharing) the loaded objects
+    gc.collect()
+    gc.freeze()
+
+    sock = bind_socket(host, port)
+    logger.info(f"Master {os.getpid()} listening on {host}:{port}, starting {workers} workers")
+
+    children = {}
+    stopping = False
+
+    def spawn(slot):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(api.app, sock, torch_threads, interop_threads)
+            finally:
+                os._exit(0)
+        children[pid] = slot
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for slot in range(workers):
+        spawn(slot)
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+
+        slot = children.pop(pid, None)
+        if slot is not None and not stopping:
+            logger.warning(f"Worker {pid} exited with status {status}, respawning")
+            time.sleep(1)
+            spawn(slot)
+
+    sock.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    workers = int(os.getenv("WEB_WORKERS", "2"))
+    torch_threads = os.getenv("TORCH_THREADS_PER_WORKER")
+
+    serve(
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        torch_threads=int(torch_threads) if torch_threads else None,
+        interop_threads=int(os.getenv("TORCH_INTEROP_THREADS", "1")),
+    )
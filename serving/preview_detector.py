@@ -0,0 +1,64 @@
+import numpy as np
+import torch
+
+from facenet.models.mtcnn import MTCNN
+from facenet.models.utils.detect_face import detect_face
+from serving.downscaled_detector import downscale
+
+
+class PreviewDetector:
+    """
+    Low-latency face detection for capture previews ("is a face centered?").
+
+    Preview clients call detection on every few frames and only need the box of
+    the face they are framing. The image is shrunk to a small fixed size, faces
+    smaller than `min_face` of its shorter side are ignored, at most
+    `max_candidates` PNet candidates are scored by RNet, and ONet is skipped
+    unless landmarks are requested. Boxes are RNet's, a few pixels less precise
+    than ONet's, and are mapped back to the original image.
+
+    Parameters:
+        mtcnn (MTCNN): The MTCNN model (its networks and thresholds are used).
+        side (int): Longest side of the image detection runs on.
+        min_face (float): Smallest face, relative to the shorter side.
+        max_candidates (int): Maximum PNet candidates passed to RNet.
+    """
+
+    def __init__(self, mtcnn: MTCNN, side: int = 160, min_face: float = 0.2, max_candidates: int = 8):
+        self.mtcnn = mtcnn
+        self.side = side
+        self.min_face = min_face
+        self.max_candidates = max_candidates
+
+    def detect(self, img: np.ndarray, landmarks=False):
+        """
+        Detect faces in a single RGB numpy image.
+
+        Returns:
+            Same as `MTCNN.detect` for a single image, largest face first.
+        """
+        small, (scale_x, scale_y) = downscale(img, self.side)
+        min_face_size = max(12, int(self.min_face * min(small.shape[:2])))
+
+        with torch.no_grad():
+            batch_boxes, batch_points = detect_face(
+                small, min_face_size,
+                self.mtcnn.pnet, self.mtcnn.rnet, self.mtcnn.onet,
+                self.mtcnn.thresholds, self.mtcnn.factor,
+                self.mtcnn.device,
+                stages=3 if landmarks else 2, max_candidates=self.max_candidates
+            )
+
+        box = np.asarray(batch_boxes[0], dtype=np.float32).reshape(-1, 5)
+        point = np.asarray(batch_points[0], dtype=np.float32).reshape(-1, 5, 2)
+        if len(box) == 0:
+            boxes, probs, points = None, [None], None
+        else:
+            box[:, :4] /= np.array([scale_x, scale_y] * 2, dtype=np.float32)
+            point /= np.array([scale_x, scale_y], dtype=np.float32)
+            order = np.argsort((box[:, 2] - box[:, 0]) * (box[:, 3] - box[:, 1]))[::-1]
+            boxes, probs, points = box[order, :4], box[order, 4], point[order]
+
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
@@ -0,0 +1,135 @@
+import threading
+
+import numpy as np
+
+
+def parse_roi(spec: str):
+    """
+    Parse a region of interest "x1,y1,x2,y2" in normalized image coordinates (0-1).
+
+    Returns:
+        tuple: (x1, y1, x2, y2) floats, or None for an empty spec.
+
+    Raises:
+        ValueError: If the spec is malformed or not a non-empty region inside the image.
+    """
+    if spec is None or not spec.strip():
+        return None
+
+    try:
+        roi = tuple(float(v) for v in spec.split(","))
+    except ValueError:
+        raise ValueError(f"Invalid region '{spec}', expected x1,y1,x2,y2")
+    if len(roi) != 4:
+        raise ValueError(f"Invalid region '{spec}', expected x1,y1,x2,y2")
+
+    x1, y1, x2, y2 = roi
+    if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+        raise ValueError(f"Invalid region '{spec}', expected 0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1")
+    return roi
+
+
+class RegionHints:
+    """
+    Face detection restricted to a client-supplied region of interest.
+
+    Guided captures (the ID card overlay, the selfie oval) tell where the face
+    should be. The detector then only runs on that region, grown by `margin` (a
+    fraction of the region's width and height on each side) so that a face
+    slightly off the guide is still whole, and boxes and landmarks are mapped back
+    to full-image coordinates. If no face with a probability of at least
+    `min_prob` is found there, the whole image is detected instead.
+
+    Use `detector(detector, roi)` to get a detector object for
+    `utils.functions.extract_face`.
+
+    Parameters:
+        margin (float): Margin around the region, relative to its size.
+        min_prob (float): Face probability required to accept the region's result.
+    """
+
+    def __init__(self, margin: float = 0.25, min_prob: float = 0.9):
+        self.margin = margin
+        self.min_prob = min_prob
+
+        self._lock = threading.Lock()
+        self._found = 0
+        self._fallbacks = 0
+        self._pixels = 0
+        self._image_pixels = 0
+
+    def crop_box(self, shape, roi) -> tuple:
+        """Pixel box (x1, y1, x2, y2) of `roi` plus the margin, clipped to an image of `shape`."""
+        h, w = shape[:2]
+        x1, y1, x2, y2 = roi
+        mx, my = (x2 - x1) * self.margin, (y2 - y1) * self.margin
+        return (
+            max(0, int(np.floor((x1 - mx) * w))),
+            max(0, int(np.floor((y1 - my) * h))),
+            min(w, int(np.ceil((x2 + mx) * w))),
+            min(h, int(np.ceil((y2 + my) * h))),
+        )
+
+    def detector(self, detector, roi) -> "RegionDetector":
+        """Detector restricted to `roi` (None: the whole image)."""
+        return RegionDetector(self, detector, roi)
+
+    def detect(self, detector, img: np.ndarray, roi, landmarks=False):
+        """
+        Detect faces in a single RGB numpy image, in `roi` first.
+
+        Returns:
+            Same as `MTCNN.detect` for a single image, in full-image coordinates.
+        """
+        if roi is None:
+            return detector.detect(img, landmarks=landmarks)
+
+        x1, y1, x2, y2 = self.crop_box(img.shape, roi)
+        boxes, probs, points = None, None, None
+        if x2 > x1 and y2 > y1:
+            boxes, probs, points = detector.detect(img[y1:y2, x1:x2], landmarks=True)
+
+        found = boxes is not None and len(boxes) > 0 and max(probs) >= self.min_prob
+        pixels = (x2 - x1) * (y2 - y1)
+        if found:
+            boxes = np.asarray(boxes, dtype=np.float32) + np.array([x1, y1, x1, y1], dtype=np.float32)
+            points = np.asarray(points, dtype=np.float32) + np.array([x1, y1], dtype=np.float32)
+        else:
+            boxes, probs, points = detector.detect(img, landmarks=True)
+            pixels += img.shape[0] * img.shape[1]
+        self._record(found, pixels, img.shape[0] * img.shape[1])
+
+        if landmarks:
+            return boxes, probs, points
+        return boxes, probs
+
+    def _record(self, found: bool, pixels: int, image_pixels: int):
+        with self._lock:
+            if found:
+                self._found += 1
+            else:
+                self._fallbacks += 1
+            self._pixels += pixels
+            self._image_pixels += image_pixels
+
+    def stats(self) -> dict:
+        """Hinted detections resolved in their region and fallen back to the whole image,
+        and the detected pixels relative to whole-image detection."""
+        with self._lock:
+            return {
+                "found_in_region": self._found,
+                "fallbacks": self._fallbacks,
+                "pixel_ratio": round(self._pixels / self._image_pixels, 3) if self._image_pixels else None,
+            }
+
+
+class RegionDetector:
+    """`detect()` restricted to one region of interest, with MTCNN.detect's signature."""
+
+    def __init__(self, hints: RegionHints, detector, roi):
+        self.hints = hints
+        self.detector = detector
+        self.roi = roi
+
+    def detect(self, img: np.ndarray, landmarks=False):
+        return self.hints.detect(self.detector, img, self.roi, landmarks=landmarks)
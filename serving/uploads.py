@@ -0,0 +1,109 @@
+import io
+
+from fastapi import HTTPException
+from PIL import Image
+
+CHUNK_SIZE = 256 * 1024
+# Bytes of an upload searched for the image header (JPEG EXIF segments are at most 64 KiB)
+HEADER_PREFIX = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded image exceeds its byte or pixel limit."""
+
+
+def image_header(data):
+    """(width, height, format) from an image header, or None if the header is not complete (or not an image)."""
+    try:
+        image = Image.open(io.BytesIO(data))
+        return image.width, image.height, image.format
+    except Exception:
+        return None
+
+
+async def read_upload(upload, max_bytes: int, max_pixels: int = None, chunk_size: int = CHUNK_SIZE) -> bytearray:
+    """
+    Read an UploadFile in chunks, giving up as soon as a limit is exceeded.
+
+    The size recorded by the multipart parser is checked before reading anything,
+    the byte count while reading, and the image dimensions as soon as the header
+    has been read, so an oversized upload is never held in memory in full. The
+    header is only searched for in the first HEADER_PREFIX bytes.
+
+    Parameters:
+        upload (UploadFile): The uploaded file.
+        max_bytes (int): Maximum file size.
+        max_pixels (int, optional): Maximum width x height from the image header.
+
+    Returns:
+        bytearray: The file content.
+
+    Raises:
+        UploadTooLarge: If the file or the image it contains is too large.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(f"too large (max {max_bytes // (1024 * 1024)}MB)")
+
+    content = bytearray()
+    check_header = bool(max_pixels)
+    while chunk := await upload.read(chunk_size):
+        content += chunk
+        if len(content) > max_bytes:
+            raise UploadTooLarge(f"too large (max {max_bytes // (1024 * 1024)}MB)")
+
+        if check_header:
+            header = image_header(bytes(content[:HEADER_PREFIX]))
+            check_header = header is None and len(content) < HEADER_PREFIX
+            if header is not None and header[0] * header[1] > max_pixels:
+                raise UploadTooLarge(
+                    f"dimensions too large ({header[0]}x{header[1]}, max {max_pixels / 1e6:g} megapixels)"
+                )
+
+    return content
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware rejecting request bodies larger than `max_bytes` with 413.
+
+    Requests announcing a larger Content-Length are rejected before their body is
+    read; bodies without one (chunked transfer) are cut off once they exceed the
+    limit, before multipart parsing spools the rest of them.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_bytes:
+            await self.reject(send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # FastAPI passes HTTPExceptions raised while reading the form through
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    async def reject(self, send):
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,75 @@
+import numpy as np
+import torch
+
+from facenet.models.utils.detect_face import crop_candidates, crop_resize_boxes, imresample, pad
+
+
+def random_boxes(n, w, h, seed=0):
+    """Square candidate boxes, some of them crossing the image border."""
+    rng = np.random.default_rng(seed)
+    size = rng.uniform(6, min(w, h) * 0.6, n)
+    x1 = rng.uniform(-0.3 * w, w, n)
+    y1 = rng.uniform(-0.3 * h, h, n)
+    return torch.tensor(np.stack([x1, y1, x1 + size, y1 + size, rng.uniform(0, 1, n)], 1), dtype=torch.float32)
+
+
+def reference_crops(imgs_hwc, image_inds, y, ey, x, ex, size):
+    """The per-box crop + imresample loop that crop_resize_boxes replaces."""
+    imgs = imgs_hwc.permute(0, 3, 1, 2).float()
+    return torch.cat([
+        imresample(imgs[image_inds[k], :, (y[k] - 1):ey[k], (x[k] - 1):ex[k]].unsqueeze(0), (size, size))
+        for k in range(len(y))
+    ])
+
+
+def check_crops(imgs_hwc, size):
+    h, w = imgs_hwc.shape[1:3]
+    boxes = random_boxes(300, w, h)
+    image_inds = torch.arange(len(boxes)) % len(imgs_hwc)
+
+    crops, kept_boxes, kept_inds = crop_candidates(imgs_hwc, boxes, image_inds, w, h, size)
+    y, ey, x, ex = pad(kept_boxes, w, h)
+    expected = reference_crops(imgs_hwc, kept_inds, y, ey, x, ex, size)
+
+    assert crops.shape == (len(kept_boxes), 3, size, size)
+    assert torch.allclose(crops, expected, atol=1e-3), (crops - expected).abs().max()
+
+
+def test_uint8_crops_match_imresample():
+    imgs = torch.randint(0, 256, (2, 97, 131, 3), dtype=torch.uint8)
+    check_crops(imgs, 24)
+    check_crops(imgs, 48)
+
+
+def test_float_crops_match_imresample():
+    imgs = torch.rand(1, 64, 80, 3) * 255
+    check_crops(imgs, 24)
+
+
+def test_boxes_outside_image_are_dropped():
+    imgs = torch.randint(0, 256, (1, 50, 60, 3), dtype=torch.uint8)
+    boxes = torch.tensor([[10.0, 10.0, 30.0, 30.0, 0.9], [70.0, 10.0, 90.0, 30.0, 0.9]])
+
+    crops, kept_boxes, kept_inds = crop_candidates(imgs, boxes, torch.zeros(2, dtype=torch.long), 60, 50, 24)
+
+    assert len(crops) == len(kept_boxes) == len(kept_inds) == 1
+    assert torch.equal(kept_boxes, boxes[:1])
+
+
+def test_tables_are_reused():
+    imgs = torch.randint(0, 256, (1, 40, 40, 3), dtype=torch.uint8)
+    tables = {}
+    y, ey, x, ex = (np.array([v], dtype=np.int32) for v in (1, 20, 1, 20))
+
+    first = crop_resize_boxes(imgs, torch.zeros(1, dtype=torch.long), y, ey, x, ex, 24, tables)
+    assert list(tables) == [0]
+    second = crop_resize_boxes(imgs, torch.zeros(1, dtype=torch.long), y, ey, x, ex, 24, tables)
+    assert torch.equal(first, second)
+
+
+if __name__ == "__main__":
+    test_uint8_crops_match_imresample()
+    test_float_crops_match_imresample()
+    test_boxes_outside_image_are_dropped()
+    test_tables_are_reused()
+    print("Batched crops match the per-box imresample loop")
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import torch
+
+from facenet.models.mtcnn import MTCNN
+from id_documents.card import CardLocalizer, find_quad
+
+CORNERS = np.float32([[250, 200], [1050, 260], [1000, 780], [220, 720]])
+PORTRAIT = (40, 130, 320, 480)
+
+
+def card_scene():
+    """An ID-1 card with the largest face of multiface.jpg as its portrait, in perspective on clutter."""
+    img = cv2.cvtColor(cv2.imread("facenet/data/multiface.jpg"), cv2.COLOR_BGR2RGB)
+    with torch.no_grad():
+        boxes, _ = MTCNN().detect(img)
+    boxes = np.asarray(boxes, dtype=float)
+    x1, y1, x2, y2 = boxes[np.argmax((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))].astype(int)
+    w, h = x2 - x1, y2 - y1
+    face = img[max(0, y1 - h // 2):y2 + h // 3, max(0, x1 - w // 2):x2 + w // 2]
+
+    card = np.full((540, 856, 3), 235, np.uint8)
+    for row in range(8):
+        cv2.putText(card, "NGUYEN VAN A 0123456789", (380, 110 + row * 50), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (40, 40, 60), 2)
+    px1, py1, px2, py2 = PORTRAIT
+    card[py1:py2, px1:px2] = cv2.resize(face, (px2 - px1, py2 - py1))
+
+    rng = np.random.default_rng(0)
+    scene = cv2.GaussianBlur((rng.random((960, 1280, 3)) * 60 + 40).astype(np.uint8), (0, 0), 3)
+    for _ in range(30):
+        position = (int(rng.integers(0, 1200)), int(rng.integers(0, 960)))
+        cv2.putText(scene, "clutter", position, cv2.FONT_HERSHEY_SIMPLEX, 1, (200, 200, 200), 2)
+
+    to_scene = cv2.getPerspectiveTransform(np.float32([[0, 0], [856, 0], [856, 540], [0, 540]]), CORNERS)
+    warped = cv2.warpPerspective(card, to_scene, (1280, 960))
+    mask = cv2.warpPerspective(np.full((540, 856), 255, np.uint8), to_scene, (1280, 960))
+    scene = np.where(mask[..., None] > 0, warped, scene)
+
+    portrait = cv2.perspectiveTransform(np.float32([[[px1, py1]], [[px2, py2]]]), to_scene).reshape(-1)
+    return scene, card, portrait
+
+
+def inside(box, region, tolerance=10):
+    x1, y1, x2, y2 = region
+    return box[0] >= x1 - tolerance and box[1] >= y1 - tolerance and box[2] <= x2 + tolerance and box[3] <= y2 + tolerance
+
+
+def test_find_quad():
+    scene, _, _ = card_scene()
+    quad = find_quad(scene)
+    assert quad is not None
+    assert np.abs(quad - CORNERS).max() < 15
+
+
+def test_portrait_detection():
+    mtcnn = MTCNN()
+    scene, card, portrait = card_scene()
+    localizer = CardLocalizer()
+    detector = localizer.detector(mtcnn)
+
+    with torch.no_grad():
+        boxes, probs = detector.detect(scene)
+        assert len(boxes) == 1 and inside(boxes[0], portrait)
+
+        # The card the other way up, and a photo cropped to the card
+        h, w = scene.shape[:2]
+        boxes, _ = detector.detect(scene[::-1, ::-1].copy())
+        assert len(boxes) == 1 and inside(boxes[0], (w - portrait[2], h - portrait[3], w - portrait[0], h - portrait[1]))
+        boxes, _ = detector.detect(card)
+        assert len(boxes) == 1
+
+        # Not a card: the whole image is detected
+        img = cv2.cvtColor(cv2.imread("facenet/data/multiface.jpg"), cv2.COLOR_BGR2RGB)
+        boxes, _ = detector.detect(img)
+        expected, _ = mtcnn.detect(img)
+        assert len(boxes) == len(expected)
+
+    assert localizer.stats() == {"no_card": 1, "fallbacks": 0, "id1": 3, "id3": 0}
+
+
+if __name__ == "__main__":
+    test_find_quad()
+    test_portrait_detection()
+    print("Card localization finds the portrait face")
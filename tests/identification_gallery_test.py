@@ -0,0 +1,74 @@
+import numpy as np
+import torch
+
+from identification.gallery import EmbeddingGallery
+from utils.distance import Cosine_Distance, Euclidean_Distance
+
+
+def random_embeddings(n, dim=64, seed=0):
+    x = np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def brute_force(gallery_ids, vectors, query, k, distance):
+    distances = [float(distance(torch.from_numpy(query), torch.from_numpy(v))) for v in vectors]
+    order = np.argsort(distances, kind="stable")[:k]
+    return [gallery_ids[i] for i in order], [distances[i] for i in order]
+
+
+def test_search_matches_utils_distance():
+    vectors = random_embeddings(500)
+    queries = random_embeddings(4, seed=1)
+    ids = [f"id{i}" for i in range(len(vectors))]
+
+    for metric, distance in (("euclidean", Euclidean_Distance), ("cosine", Cosine_Distance)):
+        # Several shards searched in parallel give the same result as one
+        for shard_size, workers in ((1000, 1), (64, 4)):
+            gallery = EmbeddingGallery(dim=64, metric=metric, shard_size=shard_size, workers=workers)
+            gallery.add(ids, vectors)
+            results = gallery.search(queries, k=5)
+            gallery.close()
+
+            for query, result in zip(queries, results):
+                expected_ids, expected_distances = brute_force(ids, vectors, query, 5, distance)
+                assert [identity for identity, _ in result] == expected_ids, (metric, shard_size)
+                assert np.allclose([d for _, d in result], expected_distances, atol=1e-3)
+
+
+def test_add_remove():
+    vectors = random_embeddings(300)
+    ids = list(range(len(vectors)))
+    gallery = EmbeddingGallery(dim=64, shard_size=100)
+    gallery.add(ids, vectors)
+
+    removed = ids[::3]
+    assert gallery.remove(removed + [-1]) == len(removed)
+    assert len(gallery) == 200 and 0 not in gallery
+
+    # Every remaining identity is still its own nearest neighbour
+    for identity in ids[1::3]:
+        assert gallery.search(vectors[identity], k=1)[0][0][0] == identity
+
+    # Re-adding an identity replaces its embedding
+    gallery.add([1], vectors[0:1])
+    assert gallery.search(vectors[0], k=1)[0][0][0] == 1
+    assert len(gallery) == 200
+
+
+def test_float16():
+    vectors = random_embeddings(200)
+    ids = list(range(len(vectors)))
+    gallery = EmbeddingGallery(dim=64, dtype="float16")
+    gallery.add(ids, vectors)
+
+    result = gallery.search(vectors[:10], k=3)
+    assert [r[0][0] for r in result] == ids[:10]
+    assert all(r[0][1] < 1e-2 for r in result)
+    assert gallery.search(vectors[0], k=0) == [[]]
+
+
+if __name__ == "__main__":
+    test_search_matches_utils_distance()
+    test_add_remove()
+    test_float16()
+    print("EmbeddingGallery matches brute-force search")
@@ -0,0 +1,37 @@
+import tempfile
+
+import numpy as np
+
+from identification.ivfpq import IVFPQIndex
+from identification.ivfpq_benchmark import synthetic_embeddings
+
+
+def test_search_append_reopen_compact():
+    x, labels = synthetic_embeddings(4100, seed=3)
+    x, queries = x[:4000], x[4000:]
+
+    with tempfile.TemporaryDirectory() as path:
+        index = IVFPQIndex.train(path, x, nlist=16, m=16, iterations=10)
+        index.add(np.arange(2000), x[:2000])
+        index.add(np.arange(2000, 4000), x[2000:])
+        assert len(index) == 4000 and index.stats()["segments"] == 2
+
+        # Every query is a fresh sample of an indexed identity, found with its exact distance
+        exact = np.sqrt(np.maximum(((queries[:, None] - x[None]) ** 2).sum(axis=2), 0))
+        results = index.search(queries, k=3, nprobe=4)
+        for result, distances in zip(results, exact):
+            assert result[0][0] == np.argmin(distances)
+            assert np.isclose(result[0][1], distances.min(), atol=1e-4)
+            assert [d for _, d in result] == sorted(d for _, d in result)
+
+        # Persisted across restarts, and unchanged by merging the segments
+        reopened = IVFPQIndex.open(path)
+        assert reopened.search(queries, k=3, nprobe=4) == results
+        reopened.compact()
+        assert reopened.stats()["segments"] == 1
+        assert IVFPQIndex.open(path).search(queries, k=3, nprobe=4) == results
+
+
+if __name__ == "__main__":
+    test_search_append_reopen_compact()
+    print("IVF-PQ index search, persistence and compaction OK")
@@ -0,0 +1,47 @@
+import numpy as np
+import torch
+
+from facenet.models.utils.detect_face import batched_nms_auto, batched_nms_numpy, batched_nms_tensor, nms_numpy, nms_tensor
+from facenet.models.utils.nms_benchmark import candidate_boxes
+
+
+def test_nms_tensor_matches_numpy():
+    boxes, scores = candidate_boxes(700)
+    for method in ("Union", "Min"):
+        for threshold in (0.3, 0.7):
+            expected = nms_numpy(boxes.numpy(), scores.numpy(), threshold, method)
+            for block_size in (16, 128, 1024):
+                picks = nms_tensor(boxes, scores, threshold, method, block_size)
+                assert picks.dtype == torch.int64
+                assert np.array_equal(picks.numpy(), expected), (method, threshold, block_size)
+
+
+def test_batched_nms_tensor_matches_numpy():
+    boxes, scores = candidate_boxes(300, seed=1)
+    image_inds = torch.arange(len(boxes)) % 3
+
+    expected = batched_nms_numpy(boxes, scores, image_inds, 0.7, "Min")
+    picks = batched_nms_tensor(boxes, scores, image_inds, 0.7, "Min")
+    assert torch.equal(picks, expected)
+
+
+def test_batched_nms_auto_matches_numpy():
+    for n in (50, 300):
+        boxes, scores = candidate_boxes(n, seed=2)
+        image_inds = torch.arange(len(boxes)) % 2
+        for method in ("Union", "Min"):
+            expected = batched_nms_numpy(boxes, scores, image_inds, 0.7, method)
+            assert torch.equal(batched_nms_auto(boxes, scores, image_inds, 0.7, method), expected)
+
+
+def test_empty_input():
+    assert len(nms_tensor(torch.zeros(0, 4), torch.zeros(0), 0.7, "Min")) == 0
+    assert len(batched_nms_tensor(torch.zeros(0, 4), torch.zeros(0), torch.zeros(0), 0.7, "Min")) == 0
+
+
+if __name__ == "__main__":
+    test_nms_tensor_matches_numpy()
+    test_batched_nms_tensor_matches_numpy()
+    test_batched_nms_auto_matches_numpy()
+    test_empty_input()
+    print("Tensor NMS matches nms_numpy")
@@ -0,0 +1,116 @@
+import cv2
+import numpy as np
+import torch
+
+from facenet.models.mtcnn import MTCNN
+from facenet.models.utils.detect_face import detect_face, pnet_output_size, pyramid_layout, pyramid_scales
+
+
+def test_pyramid_scales():
+    for h, w, minsize in ((480, 640, 20), (1080, 1440, 40), (300, 200, 12), (11, 40, 20)):
+        scales = pyramid_scales(h, w, minsize, 0.709)
+        if min(h, w) * 12.0 / minsize < 12:
+            assert scales == []
+            continue
+
+        # Faces of minsize px map to PNet's 12 px window, then each scale shrinks by the factor
+        assert scales[0] == 12.0 / minsize
+        assert np.allclose(np.diff(np.log(scales)), np.log(0.709))
+        # Down to the last scale at which the shorter side still covers the window
+        assert min(h, w) * scales[-1] >= 12 > min(h, w) * scales[-1] * 0.709
+
+
+def test_layout_tiles_are_aligned_and_disjoint():
+    for h, w in ((480, 640), (481, 643), (1080, 1440), (300, 200)):
+        scales = pyramid_scales(h, w, 20, 0.709)
+        layout = pyramid_layout(h, w, scales, max_pixels=100000)
+        tiles = [tile for _, _, canvas_tiles in layout for tile in canvas_tiles]
+        assert sorted(tile[0] for tile in tiles) == list(range(len(scales)))
+
+        for canvas_h, canvas_w, canvas_tiles in layout:
+            used = np.zeros((canvas_h, canvas_w), dtype=int)
+            for i, y, x, th, tw in canvas_tiles:
+                assert (th, tw) == (int(h * scales[i] + 1), int(w * scales[i] + 1))
+                assert y % 2 == 0 and x % 2 == 0
+                used[y:y + th + th % 2, x:x + tw + tw % 2] += 1
+            assert used.max() == 1
+            assert len(canvas_tiles) == 1 or canvas_h * canvas_w <= 100000
+
+
+def test_output_size_matches_pnet():
+    pnet = MTCNN().pnet
+    for size in (12, 13, 48, 101):
+        with torch.no_grad():
+            _, probs = pnet(torch.rand(1, 3, size, size + 1))
+        assert probs.shape[2:] == (pnet_output_size(size), pnet_output_size(size + 1))
+
+
+def test_fused_pyramid_matches_scale_loop():
+    mtcnn = MTCNN()
+    img = cv2.cvtColor(cv2.imread("facenet/data/multiface.jpg"), cv2.COLOR_BGR2RGB)
+    for image in (img, cv2.resize(img, (643, 481)), np.stack([img, img[:, ::-1]])):
+        args = (image, mtcnn.min_face_size, mtcnn.pnet, mtcnn.rnet, mtcnn.onet,
+                mtcnn.thresholds, mtcnn.factor, mtcnn.device)
+        with torch.no_grad():
+            expected_boxes, expected_points = detect_face(*args, fused_pyramid=False)
+            boxes, points = detect_face(*args, fused_pyramid=True)
+
+        for expected, actual in zip(expected_boxes, boxes):
+            assert len(expected) == len(actual) > 0
+            assert np.allclose(np.asarray(expected, float), np.asarray(actual, float), atol=1e-2)
+        for expected, actual in zip(expected_points, points):
+            assert np.allclose(np.asarray(expected, float), np.asarray(actual, float), atol=1e-2)
+
+
+def test_dominant_face_skips_fine_scales():
+    mtcnn = MTCNN()
+    img = cv2.cvtColor(cv2.imread("facenet/data/multiface.jpg"), cv2.COLOR_BGR2RGB)
+    args = (img, mtcnn.min_face_size, mtcnn.pnet, mtcnn.rnet, mtcnn.onet,
+            mtcnn.thresholds, mtcnn.factor, mtcnn.device)
+    with torch.no_grad():
+        full_boxes, _ = detect_face(*args)
+        report = {}
+        boxes, _ = detect_face(*args, dominant_face=0.01, report=report)
+        # No face covers half the image: the fine scales run and nothing is lost
+        no_exit = {}
+        all_boxes, _ = detect_face(*args, dominant_face=0.5, report=no_exit)
+
+    assert report["skipped_scales"] and set(report["skipped_scales"]) <= set(report["scales"])
+    assert no_exit["skipped_scales"] == []
+    assert len(all_boxes[0]) == len(full_boxes[0])
+
+    def largest(b):
+        b = np.asarray(b, float)
+        return b[np.argmax((b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]))]
+
+    assert np.allclose(largest(boxes[0]), largest(full_boxes[0]), atol=1e-2)
+
+
+def test_two_stage_preview_finds_the_largest_face():
+    mtcnn = MTCNN()
+    img = cv2.cvtColor(cv2.imread("facenet/data/multiface.jpg"), cv2.COLOR_BGR2RGB)
+    args = (img, mtcnn.min_face_size, mtcnn.pnet, mtcnn.rnet, mtcnn.onet,
+            mtcnn.thresholds, mtcnn.factor, mtcnn.device)
+    with torch.no_grad():
+        full_boxes, _ = detect_face(*args)
+        boxes, points = detect_face(*args, stages=2, max_candidates=8)
+
+    assert 0 < len(boxes[0]) <= 8 and np.all(np.asarray(points[0]) == 0)
+
+    def largest(b):
+        b = np.asarray(b, float)
+        return b[np.argmax((b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]))]
+
+    # RNet boxes are less precise than ONet's
+    full, preview = largest(full_boxes[0]), largest(boxes[0])
+    assert np.abs(full[:4] - preview[:4]).max() < 0.15 * (full[2] - full[0])
+
+
+if __name__ == "__main__":
+    test_pyramid_scales()
+    test_layout_tiles_are_aligned_and_disjoint()
+    test_output_size_matches_pnet()
+    test_fused_pyramid_matches_scale_loop()
+    test_dominant_face_skips_fine_scales()
+    test_two_stage_preview_finds_the_largest_face()
+    print("Fused PNet pyramid matches the per-scale loop")
@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+import torch
+
+import api
+from facenet.models.mtcnn import MTCNN
+from serving.downscaled_detector import DownscaledDetector
+from serving.preview_detector import PreviewDetector
+from serving.roi import RegionHints
+
+
+def setup_detection():
+    mtcnn = MTCNN()
+    api.detector = DownscaledDetector(mtcnn, api.DETECTION_MAX_SIDE)
+    api.preview_detector = PreviewDetector(mtcnn)
+    api.region_hints = RegionHints()
+
+
+def largest(boxes):
+    boxes = np.asarray(boxes, dtype=float)
+    return boxes[np.argmax((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]))]
+
+
+def test_boxes_of_large_jpegs_are_in_original_coordinates():
+    setup_detection()
+    img = cv2.imread("facenet/data/multiface.jpg")
+    h, w = img.shape[:2]
+    small = cv2.imencode(".jpg", img)[1].tobytes()
+    # Decoded at reduced resolution, then downscaled for detection
+    large = cv2.imencode(".jpg", cv2.resize(img, (w * 4, h * 4), interpolation=cv2.INTER_CUBIC))[1].tobytes()
+
+    with torch.no_grad():
+        for preview in (False, True):
+            small_boxes, _ = api.detect_upload(small, preview=preview)
+            large_boxes, _ = api.detect_upload(large, preview=preview)
+            expected = largest(small_boxes)[:4] * 4
+            assert np.abs(largest(large_boxes)[:4] - expected).max() < 0.1 * (expected[2] - expected[0])
+
+
+if __name__ == "__main__":
+    test_boxes_of_large_jpegs_are_in_original_coordinates()
+    print("Detection boxes are in original image coordinates")
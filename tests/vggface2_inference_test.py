@@ -0,0 +1,61 @@
+import copy
+
+import torch
+
+from verification_models.VGGFace2 import InceptionResnetV1, load_model
+
+
+def randomize_batchnorm(model: torch.nn.Module):
+    """Give every BatchNorm non-trivial statistics so BN folding is actually exercised."""
+    torch.manual_seed(0)
+    for module in model.modules():
+        if isinstance(module, (torch.nn.BatchNorm1d, torch.nn.BatchNorm2d)):
+            module.running_mean.uniform_(-0.5, 0.5)
+            module.running_var.uniform_(0.5, 2.0)
+            module.weight.data.uniform_(0.5, 1.5)
+            module.bias.data.uniform_(-0.2, 0.2)
+
+
+def build_models():
+    reference = InceptionResnetV1().eval()
+    randomize_batchnorm(reference)
+    optimized = copy.deepcopy(reference).optimize_for_inference()
+    return reference, optimized
+
+
+def test_embedding_parity():
+    reference, optimized = build_models()
+
+    torch.manual_seed(1)
+    faces = torch.rand(4, 3, 160, 160) * 2 - 1
+
+    with torch.no_grad():
+        expected = reference(faces)
+    actual = optimized(faces)
+
+    assert actual.shape == (4, 512)
+    assert torch.allclose(actual, expected, atol=1e-4), (actual - expected).abs().max()
+
+
+def test_optimized_structure():
+    _, optimized = build_models()
+
+    assert optimized.logits is None
+    assert not any(isinstance(m, torch.nn.BatchNorm2d) for m in optimized.modules())
+    assert optimized.conv2d_1a.conv.weight.is_contiguous(memory_format=torch.channels_last)
+
+    faces = torch.rand(1, 3, 160, 160, requires_grad=True)
+    assert optimized(faces).is_inference()
+
+
+def test_load_model_inference_flag():
+    model = load_model(pretrained=None, inference=True)
+    assert model.inference_only
+    assert model.logits is None
+
+
+if __name__ == "__main__":
+    test_embedding_parity()
+    test_optimized_structure()
+    test_load_model_inference_flag()
+    print("VGGFace2 inference build matches the reference model")
@@ -1,3 +1,5 @@
+import io
+
 import cv2 as cv
 import numpy as np
 import torch
@@ -50,16 +52,18 @@ def extract_face(img: np.ndarray, model: MTCNN, padding=None, min_prob=0.9):
         min_prob (float, optional): Minimum probability threshold for face detection.
 
     Returns:
-        np.ndarray: Extracted face image.
-        np.ndarray: Bounding box of the extracted face.
-        list: Landmarks of the extracted face.
+        np.ndarray: Extracted face image (the whole image if no face was found).
+        np.ndarray: Bounding box of the extracted face (None if no face was found).
+        list: Landmarks of the extracted face (None if no face was found).
 
     """
     boxes, prob, landmarks = model.detect(img, landmarks=True)
 
     if boxes is not None:
-        boxes = boxes[prob > min_prob]
+        keep = np.asarray(prob, dtype=np.float32) > min_prob
+        boxes, landmarks = boxes[keep], landmarks[keep]
 
+    if boxes is not None and len(boxes):
         max_area = 0
         max_box = [0, 0, 0, 0]
         max_landmarks = []
@@ -129,3 +133,54 @@ def get_image(filename: str) -> np.ndarray:
     img = cv.imread(filename)
     img = cv.cvtColor(img, cv.COLOR_BGR2RGB)
     return img
+
+
+# cv2.imdecode flags for JPEGs decoded at 1/2, 1/4 and 1/8 resolution (DCT scaling)
+REDUCED_DECODE_FLAGS = (
+    (8, cv.IMREAD_REDUCED_COLOR_8),
+    (4, cv.IMREAD_REDUCED_COLOR_4),
+    (2, cv.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def decode_reduction(size, image_format: str, target_side: int = None) -> int:
+    """
+    Reduction factor (1, 2, 4 or 8) decode_image() uses for an image of `size`
+    (width, height) in `image_format` (PIL format name): the largest one that keeps
+    the longer side at least `target_side`, for JPEGs only.
+    """
+    if target_side and image_format == "JPEG":
+        for factor, _ in REDUCED_DECODE_FLAGS:
+            if max(size) // factor >= target_side:
+                return factor
+    return 1
+
+
+def decode_image(data: bytes, target_side: int = None) -> np.ndarray:
+    """
+    Decode an encoded image (JPEG, PNG, WebP, ...) straight to an RGB array.
+
+    The image is decoded once by OpenCV into a single buffer that is converted to
+    RGB in place. With `target_side`, JPEGs are decoded at the smallest 1/2, 1/4 or
+    1/8 resolution whose longer side is still at least `target_side` pixels, which
+    skips most of the decoding work for large photos. Formats OpenCV cannot read
+    fall back to PIL. EXIF orientation is ignored, as with PIL.
+
+    Parameters:
+        data (bytes): The encoded image.
+        target_side (int, optional): Smallest acceptable longer side of the decoded image.
+
+    Returns:
+        np.ndarray: RGB image (H x W x 3, uint8).
+    """
+    # Only reads the header
+    header = Image.open(io.BytesIO(data))
+
+    factor = decode_reduction(header.size, header.format, target_side)
+    flags = dict(REDUCED_DECODE_FLAGS).get(factor, cv.IMREAD_COLOR)
+
+    img = cv.imdecode(np.frombuffer(data, dtype=np.uint8), flags | cv.IMREAD_IGNORE_ORIENTATION)
+    if img is None:
+        return np.asarray(header.convert("RGB"))
+
+    return cv.cvtColor(img, cv.COLOR_BGR2RGB, dst=img)
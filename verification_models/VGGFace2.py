@@ -3,6 +3,7 @@ import os
 import torch
 from torch import nn
 from torch.nn import functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval, fuse_linear_bn_eval
 
 
 class BasicConv2d(nn.Module):
@@ -28,6 +29,12 @@ class BasicConv2d(nn.Module):
         x = self.relu(x)
         return x
 
+    def fuse(self):
+        """Fold the BatchNorm into the convolution weights (eval mode only)."""
+        if isinstance(self.bn, nn.BatchNorm2d):
+            self.conv = fuse_conv_bn_eval(self.conv, self.bn)
+            self.bn = nn.Identity()
+
 
 class Block35(nn.Module):
 
@@ -193,6 +200,10 @@ class InceptionResnetV1(nn.Module):
             equal to that used for the pretrained model, the final linear layer will be randomly
             initialized. (default: {None})
         dropout_prob {float} -- Dropout probability. (default: {0.6})
+
+    Call optimize_for_inference() on a loaded model to get an embedding-only build: BatchNorm
+    folded into the preceding conv/linear layers, classifier head removed, channels_last memory
+    layout and every forward pass run under torch.inference_mode().
     """
     def __init__(self, classify=False, num_classes=None, dropout_prob=0.6, device=None):
         super().__init__()
@@ -200,6 +211,7 @@ class InceptionResnetV1(nn.Module):
         # Set simple attributes
         self.classify = classify
         self.num_classes = num_classes
+        self.inference_only = False
 
         # Define layers
         self.conv2d_1a = BasicConv2d(3, 32, kernel_size=3, stride=2)
@@ -248,6 +260,34 @@ class InceptionResnetV1(nn.Module):
     def device(self):
         return next(self.parameters()).device
 
+    def optimize_for_inference(self):
+        """Convert the model in place into an embedding-only inference build.
+
+        - BatchNorm layers are folded into the preceding convolution / linear weights
+        - the 512 x 8631 classifier head is dropped
+        - weights use the channels_last memory format
+        - forward() always runs under torch.inference_mode()
+
+        Returns:
+            InceptionResnetV1 -- self, for chaining.
+        """
+        self.eval()
+
+        for module in self.modules():
+            if isinstance(module, BasicConv2d):
+                module.fuse()
+
+        if isinstance(self.last_bn, nn.BatchNorm1d):
+            self.last_linear = fuse_linear_bn_eval(self.last_linear, self.last_bn)
+            self.last_bn = nn.Identity()
+
+        self.classify = False
+        self.logits = None
+
+        self.to(memory_format=torch.channels_last)
+        self.inference_only = True
+        return self
+
     def forward(self, x):
         """Calculate embeddings or logits given a batch of input image tensors.
 
@@ -257,6 +297,12 @@ class InceptionResnetV1(nn.Module):
         Returns:
             torch.tensor -- Batch of embedding vectors or multinomial logits.
         """
+        if self.inference_only:
+            with torch.inference_mode():
+                return self._forward(x.contiguous(memory_format=torch.channels_last))
+        return self._forward(x)
+
+    def _forward(self, x):
         x = self.conv2d_1a(x)
         x = self.conv2d_2a(x)
         x = self.conv2d_2b(x)
@@ -281,7 +327,15 @@ class InceptionResnetV1(nn.Module):
         return x
 
 
-def load_model(pretrained = 'weights/vggface2_weights.pt', device = 'cpu'):
+def load_model(pretrained = 'weights/vggface2_weights.pt', device = 'cpu', inference = False):
+    """Load the VGGFace2 InceptionResnetV1.
+
+    Keyword Arguments:
+        pretrained {str} -- State dict path relative to this folder, or None for random weights.
+        device {str or torch.device} -- Device to load the model on.
+        inference {bool} -- Return the optimized embedding-only build (see
+            InceptionResnetV1.optimize_for_inference). (default: {False})
+    """
     if isinstance(device, str):
         if (device == 'cuda' or device == 'gpu') and torch.cuda.is_available():
             device = torch.device(device)
@@ -295,7 +349,10 @@ def load_model(pretrained = 'weights/vggface2_weights.pt', device = 'cpu'):
         model.load_state_dict(torch.load(state_dict_path, map_location= 'cpu'))
         print('Weights loaded successfully from path:', state_dict_path)
         print('====================================================')
-        
+
+    if inference:
+        model.optimize_for_inference()
+
     return model
 
 if __name__ == '__main__':